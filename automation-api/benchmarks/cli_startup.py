@@ -0,0 +1,73 @@
+"""
+Benchmark the startup time of the gm-eval CLI.
+
+Runs a few gm-eval commands that don't need any provider in fresh interpreters,
+and reports the wall time and the provider SDKs loaded by importing the CLI.
+
+Usage:
+    python benchmarks/cli_startup.py [--runs N]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+COMMANDS = [
+    ["--help"],
+    ["split", "--help"],
+    ["merge", "--help"],
+]
+
+PROVIDER_MODULES = ["litellm", "vertexai", "google.cloud.storage", "anthropic", "mistralai", "openai"]
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_command(args, runs):
+    """Run `gm-eval <args>` in fresh interpreters and return the wall times in seconds."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", "import sys; from lib.pilot.gm_eval.cli import main; sys.exit(main())", *args],
+            cwd=PROJECT_DIR,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=False,
+        )
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def loaded_provider_modules():
+    """Return the provider SDKs imported by importing the CLI."""
+    code = (
+        "import sys; import lib.pilot.gm_eval.cli; "
+        f"print(','.join(m for m in {PROVIDER_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=PROJECT_DIR, capture_output=True, text=True, check=True)
+    return [m for m in result.stdout.strip().split(",") if m]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs per command (default: 5)")
+    args = parser.parse_args()
+
+    print(f"{'command':<24}{'median':>10}{'min':>10}{'max':>10}")
+    for command in COMMANDS:
+        timings = time_command(command, args.runs)
+        print(
+            f"{' '.join(['gm-eval', *command]):<24}"
+            f"{statistics.median(timings):>9.2f}s{min(timings):>9.2f}s{max(timings):>9.2f}s"
+        )
+
+    loaded = loaded_provider_modules()
+    print(f"\nProvider SDKs loaded at startup: {', '.join(loaded) if loaded else 'none'}")
+
+
+if __name__ == "__main__":
+    main()
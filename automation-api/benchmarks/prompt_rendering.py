@@ -0,0 +1,94 @@
+"""
+Benchmark rendering question prompts for all question and prompt variation combinations.
+
+Compares generate_question_prompt_combinations with formatting every combination
+with str.format in a Python loop, on synthetic questions and variations.
+
+Usage:
+    python benchmarks/prompt_rendering.py [--questions N] [--variations N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import polars as pl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.pilot.generate_prompts import generate_question_prompt_combinations  # noqa: E402
+
+
+def make_questions(n):
+    return pl.DataFrame(
+        {
+            "question_id": [str(i) for i in range(n)],
+            "question_text": [f"What share of the world population lives in region {i}? " * 3 for i in range(n)],
+            "option_a": [f"About {i % 10}0%" for i in range(n)],
+            "option_b": [f"About {(i + 3) % 10}0%" for i in range(n)],
+            "option_c": [f"About {(i + 6) % 10}0%" for i in range(n)],
+        }
+    )
+
+
+def make_variations(n):
+    return pl.DataFrame(
+        {
+            "variation_id": [f"v{i}" for i in range(n)],
+            "question_template": [
+                f"Variation {i}.\n{{question_text}}\nA. {{option_a}}\nB. {{option_b}}\nC. {{option_c}}"
+                for i in range(n)
+            ],
+            "question_prompt_template": [
+                f"You are a helpful assistant ({i}). Answer the question:\n{{question}}\nAnswer:" for i in range(n)
+            ],
+        }
+    )
+
+
+def format_each_combination(questions, prompt_variations):
+    """The per-row str.format loop generate_question_prompt_combinations replaced."""
+    processed = []
+    for combo in questions.join(prompt_variations, how="cross").to_dicts():
+        formatted_question = combo["question_template"].format(
+            question_text=combo["question_text"],
+            option_a=combo["option_a"],
+            option_b=combo["option_b"],
+            option_c=combo["option_c"],
+        )
+        processed.append(
+            {
+                "prompt_id": f"{combo['question_id']}-{combo['variation_id']}",
+                "prompt_text": combo["question_prompt_template"].format(question=formatted_question),
+            }
+        )
+    return pl.DataFrame(processed)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=5000, help="Number of questions (default: 5000)")
+    parser.add_argument("--variations", type=int, default=50, help="Number of prompt variations (default: 50)")
+    args = parser.parse_args()
+
+    questions = make_questions(args.questions)
+    variations = make_variations(args.variations)
+    print(f"Rendering {questions.height} questions x {variations.height} variations")
+
+    reference, loop_seconds = timed(format_each_combination, questions, variations)
+    rendered, vectorised_seconds = timed(generate_question_prompt_combinations, questions, variations)
+
+    assert rendered.equals(reference), "Rendered prompts differ from str.format"
+    print(f"str.format loop: {loop_seconds:.2f}s")
+    print(f"vectorised:      {vectorised_seconds:.2f}s ({loop_seconds / vectorised_seconds:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark serialising batch requests to JSONL lines.
+
+Compares RequestRenderer, which serialises the request envelope once and splices in
+the escaped prompt fields, with json.dumps of every request, on synthetic prompts.
+
+Usage:
+    python benchmarks/request_rendering.py [--prompts N] [--format openai|mistral|vertex]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.pilot.generate_prompts import (  # noqa: E402
+    PROMPT_FIELDS,
+    build_mistral_request,
+    build_openai_request,
+    build_vertex_request,
+)
+from lib.pilot.request_renderer import RequestRenderer  # noqa: E402
+
+MODEL_PARAMETERS = {"temperature": 0.01, "max_tokens": 2048, "top_p": 1.0}
+
+BUILDERS = {
+    "openai": lambda row: build_openai_request(row, "gpt-4o-mini", MODEL_PARAMETERS, "mc001-"),
+    "mistral": lambda row: build_mistral_request(row, MODEL_PARAMETERS, "mc001-"),
+    "vertex": lambda row: build_vertex_request(row, MODEL_PARAMETERS),
+}
+
+
+def make_rows(n):
+    return [
+        {
+            "prompt_id": f"{i}-v{i % 50}",
+            "prompt_text": f'You are a helpful assistant. Answer "question {i}":\nA. 10%\nB. 20%\nC. 30%\nAnswer:',
+        }
+        for i in range(n)
+    ]
+
+
+def dump_each_request(rows, build_request):
+    """Build and serialise every request, as the converters did before RequestRenderer."""
+    return [json.dumps(build_request(row), ensure_ascii=False) for row in rows]
+
+
+def render_each_request(rows, build_request):
+    renderer = RequestRenderer(build_request, PROMPT_FIELDS)
+    return [renderer.render(row) for row in rows]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=250000, help="Number of prompts (default: 250000)")
+    parser.add_argument("--format", choices=list(BUILDERS), default="vertex", help="Request format (default: vertex)")
+    args = parser.parse_args()
+
+    rows = make_rows(args.prompts)
+    build_request = BUILDERS[args.format]
+    print(f"Serialising {len(rows)} {args.format} requests")
+
+    reference, dumps_seconds = timed(dump_each_request, rows, build_request)
+    rendered, render_seconds = timed(render_each_request, rows, build_request)
+
+    assert rendered == reference, "Rendered requests differ from json.dumps"
+    print(f"json.dumps per request: {dumps_seconds:.2f}s")
+    print(f"RequestRenderer:        {render_seconds:.2f}s ({dumps_seconds / render_seconds:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,52 @@
 import logging
+import multiprocessing as mp
 import sys
-from io import StringIO
-from typing import Optional
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Deque, List, Optional, Tuple
 
 import bracelogger
 
+# Number of INFO and above log lines kept in memory for get_log_messages()
+LOG_BUFFER_SIZE = 1000
+
+
+class RingBufferHandler(logging.Handler):
+    """Logging handler keeping the last `capacity` formatted records in memory."""
+
+    def __init__(self, capacity: int = LOG_BUFFER_SIZE) -> None:
+        super().__init__()
+        self.buffer: Deque[str] = deque(maxlen=capacity)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.buffer.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def clear(self) -> None:
+        self.buffer.clear()
+
+    def getvalue(self) -> str:
+        return "".join(f"{line}\n" for line in self.buffer)
+
+
+class _WorkerQueueHandler(QueueHandler):
+    """QueueHandler sending records of worker processes to the main process."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        # bracelogger attaches a getMessage function to the record, which can't be pickled.
+        # The message is already formatted at this point.
+        record.__dict__.pop("getMessage", None)
+        return record
+
 
 class AppSingleton:
     __instance: Optional["AppSingleton"] = None
     __logger: logging.Logger = bracelogger.get_logger()
-    __log_buffer: StringIO = StringIO()
+    __log_buffer: RingBufferHandler = RingBufferHandler()
+    __handlers: List[logging.Handler] = []
 
     def __new__(cls) -> "AppSingleton":
         if cls.__instance is None:
@@ -27,23 +64,54 @@ class AppSingleton:
         stderr_output.setFormatter(formatter)
         self.__logger.addHandler(stderr_output)
 
-        # Configure the logging module to use a StringIO object as a buffer
-        # for log messages with level INFO and above
-        self.__log_buffer = StringIO()
-        buffered_output = logging.StreamHandler(self.__log_buffer)
-        buffered_output.setLevel(logging.INFO)
-        buffered_output.setFormatter(formatter)
-        self.__logger.addHandler(buffered_output)
+        # Keep the latest log messages with level INFO and above in a bounded buffer,
+        # so long runs don't grow memory with every logged line
+        self.__log_buffer = RingBufferHandler(LOG_BUFFER_SIZE)
+        self.__log_buffer.setLevel(logging.INFO)
+        self.__log_buffer.setFormatter(formatter)
+        self.__logger.addHandler(self.__log_buffer)
+
+        self.__handlers = [stderr_output, self.__log_buffer]
 
     def get_logger(self) -> logging.Logger:
         return self.__logger
 
     def reset_log_buffer(self) -> None:
-        self.__log_buffer.truncate(0)
+        self.__log_buffer.clear()
 
     def get_log_messages(self) -> str:
         log_messages = self.__log_buffer.getvalue()
         return log_messages
 
+    def start_log_listener(self) -> Tuple[Any, QueueListener]:
+        """
+        Start handling log records sent by worker processes.
+
+        Pass the returned queue to `setup_worker_logging` in each worker (e.g. as pool
+        initializer), and stop the listener once the workers are done.
+
+        Returns:
+            Tuple of the log queue and the started listener
+        """
+        log_queue: "mp.Queue[logging.LogRecord]" = mp.Queue()
+        listener = QueueListener(log_queue, *self.__handlers, respect_handler_level=True)
+        listener.start()
+        return log_queue, listener
+
+
+def setup_worker_logging(log_queue: Any, level: int = logging.INFO) -> None:
+    """
+    Route the logs of a worker process to the queue of the main process.
+
+    Args:
+        log_queue: Queue returned by AppSingleton.start_log_listener
+        level: Log level of the worker logger
+    """
+    logger = AppSingleton().get_logger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(_WorkerQueueHandler(log_queue))
+    logger.setLevel(level)
+
 
 app_logger = AppSingleton().get_logger()
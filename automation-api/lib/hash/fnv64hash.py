@@ -14,8 +14,8 @@ def fnv64(data):
 
 
 def hash_dn(dn, salt):
-    # Turn dn into bytes with a salt, dn is expected to be ascii data
-    data = salt.encode("ascii") + dn.encode("ascii")
+    # Turn dn into bytes with a salt, ascii data gives the same bytes as before
+    data = salt.encode("utf-8") + dn.encode("utf-8")
     # Hash data
     hash_ = fnv64(data)
     # Pack hash (int) into bytes
@@ -2,7 +2,6 @@
 
 import json
 import os
-import time
 from typing import Any, Dict, Optional
 
 import anthropic
@@ -12,6 +11,7 @@ from anthropic.types.messages.batch_create_params import Request
 from lib.app_singleton import AppSingleton
 from lib.config import read_config
 
+from ..jsonl_io import open_jsonl
 from .base import BaseBatchJob
 from .utils import post_process_response
 
@@ -121,7 +121,10 @@ class AnthropicBatchJob(BaseBatchJob):
                 elif status not in _PROCESSING_STATUSES:
                     logger.warning(f"Unexpected status: {status}")
 
-                time.sleep(poll_interval)
+                # Sleep until the next check, unless stop_waiting is called meanwhile
+                if self._stop_waiting.wait(poll_interval):
+                    logger.info(f"Stopped waiting for batch {self.batch_id}")
+                    return None
         except Exception as e:
             logger.error(f"Error while waiting for batch completion: {str(e)}")
             return None
@@ -153,7 +156,7 @@ def _send_batch_file(client: anthropic.Anthropic, jsonl_path: str) -> str:
     """
     try:
         # Read and parse the JSONL file
-        with open(jsonl_path, "r", encoding="utf-8") as f:
+        with open_jsonl(jsonl_path) as f:
             requests = [json.loads(line) for line in f]
 
         # Convert to Anthropic format
@@ -216,10 +219,16 @@ def _simplify_anthropic_response(response_data: Any) -> Dict[str, Any]:
     if status == "succeeded":
         # skip thinking responses
         contents = [m for m in response_data.result.message.content if m.type == "text"]
+        tool_uses = [m for m in response_data.result.message.content if m.type == "tool_use"]
         if contents:  # Ensure there is text content
             simplified["content"] = contents[0].text
+        elif tool_uses:  # Structured output of a forced tool call
+            simplified["content"] = json.dumps(tool_uses[0].input, ensure_ascii=False)
     elif status == "errored":
         simplified["error"] = (str(response_data.result.error),)
+    else:
+        # expired and canceled requests have neither a message nor an error
+        simplified["error"] = f"Error: request {status}"
 
     # Post-process the response content
     simplified["content"] = post_process_response(simplified["content"])
@@ -240,7 +249,7 @@ def _download_batch_job_output(client: anthropic.Anthropic, batch_id: str, outpu
         Path to the output file
     """
     try:
-        with open(output_path, "w", encoding="utf-8") as out_file:
+        with open_jsonl(output_path, "w") as out_file:
             for result in client.messages.batches.results(batch_id):
                 # Convert to dict and simplify
                 simplified = _simplify_anthropic_response(result)
@@ -2,10 +2,11 @@
 
 import abc
 import os
-import time
+import threading
 from typing import Optional
 
 from lib.app_singleton import AppSingleton
+from lib.pilot.jsonl_io import split_jsonl_extension
 
 logger = AppSingleton().get_logger()
 
@@ -13,6 +14,9 @@ logger = AppSingleton().get_logger()
 class BaseBatchJob(abc.ABC):
     """Abstract base class for batch job implementations."""
 
+    # True when send() processes all prompts itself instead of submitting them to a batch API
+    synchronous: bool = False
+
     def __init__(self, jsonl_path: str):
         """
         Initialize a batch job.
@@ -25,6 +29,7 @@ class BaseBatchJob(abc.ABC):
         self._output_path = self._get_output_path()
         self._processing_file = f"{self._output_path}.processing"
         self._is_completed = False
+        self._stop_waiting = threading.Event()
 
         # Check if job is already being processed
         if os.path.exists(self._processing_file):
@@ -97,11 +102,22 @@ class BaseBatchJob(abc.ABC):
                 elif status not in self._get_processing_statuses():
                     logger.warning(f"Unexpected status: {status}")
 
-                time.sleep(poll_interval)
+                # Sleep until the next check, unless stop_waiting is called meanwhile
+                if self._stop_waiting.wait(poll_interval):
+                    logger.info(f"Stopped waiting for batch {self.batch_id}")
+                    return None
         except Exception as e:
             logger.error(f"Error while waiting for batch completion: {str(e)}")
             return None
 
+    def stop_waiting(self) -> None:
+        """
+        Make wait_for_completion return None at its next status check.
+
+        The processing file is kept, so the batch is picked up again when the command is rerun.
+        """
+        self._stop_waiting.set()
+
     @property
     def batch_id(self) -> str:
         """Get the batch job ID."""
@@ -134,10 +150,10 @@ class BaseBatchJob(abc.ABC):
         return False
 
     def _get_output_path(self) -> str:
-        """Calculate output path from input path."""
-        base_name = os.path.splitext(os.path.basename(self.jsonl_path))[0]
+        """Calculate output path from input path, keeping the compression of the input."""
+        base_name, ext = split_jsonl_extension(os.path.basename(self.jsonl_path))
         output_dir = os.path.dirname(self.jsonl_path)
-        return os.path.join(output_dir, f"{base_name}-response.jsonl")
+        return os.path.join(output_dir, f"{base_name}-response{ext}")
 
     @staticmethod
     def _get_processing_statuses() -> set[str]:
@@ -3,32 +3,44 @@
 import json
 import multiprocessing as mp
 import os
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 
 import litellm
 from litellm import Cache  # type: ignore
 
-from lib.app_singleton import AppSingleton
+from lib.app_singleton import AppSingleton, setup_worker_logging
 from lib.config import read_config
 
+from ..custom_ids import split_repeat_id
+from ..jsonl_io import open_jsonl
 from .base import BaseBatchJob
-from .utils import post_process_response
+from .utils import ProgressLogger, post_process_response
 
 logger = AppSingleton().get_logger()
-config = read_config()
 
-# Provider-specific configurations
-_PROVIDER_CONFIGS: Dict[str, Dict[str, Any]] = {
-    "alibaba": {
-        "api_key": config.get("DASHSCOPE_API_KEY", ""),
-        "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1",
+
+@lru_cache(maxsize=None)
+def _get_config() -> Dict[str, str]:
+    """Read the configuration on first use instead of at import time."""
+    return read_config()
+
+
+def _get_provider_configs() -> Dict[str, Dict[str, Any]]:
+    """Get provider-specific configurations."""
+    return {
+        "alibaba": {
+            "api_key": _get_config().get("DASHSCOPE_API_KEY", ""),
+            "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1",
+        }
     }
-}
 
 
 class LiteLLMBatchJob(BaseBatchJob):
     """Class for managing LiteLLM batch jobs."""
 
+    synchronous = True
+
     def __init__(self, jsonl_path: str, provider: Optional[str] = None, num_processes: int = 1):
         """
         Initialize a batch job.
@@ -115,6 +127,7 @@ class LiteLLMBatchJob(BaseBatchJob):
 
 def _setup_litellm_cache() -> None:
     """Configure LiteLLM Redis cache with 60 day TTL."""
+    config = _get_config()
     if "REDIS_HOST" in config and "REDIS_PORT" in config:
         litellm.cache = Cache(  # type: ignore
             type="redis",
@@ -134,12 +147,18 @@ def _process_single_prompt(data: Dict, provider: Optional[str] = None) -> Dict:
         # Merge provider config with request body if provider exists
         request_body = data["body"].copy()
         if provider:
-            if provider in _PROVIDER_CONFIGS:
-                request_body.update(_PROVIDER_CONFIGS[provider])
+            provider_configs = _get_provider_configs()
+            if provider in provider_configs:
+                request_body.update(provider_configs[provider])
             else:
                 logger.error("provider not found: %s", provider)
                 raise ValueError("provider not found")
 
+        # Repeated samples of a prompt are identical requests, only the first one may come from the cache
+        repeat_index = split_repeat_id(data.get("custom_id") or "")[1]
+        if repeat_index and litellm.cache is not None:
+            request_body.setdefault("cache", {"no-cache": True})
+
         response = litellm.completion(**request_body)  # type: ignore
         content = response.choices[0].message.content
 
@@ -160,8 +179,7 @@ def _process_single_prompt(data: Dict, provider: Optional[str] = None) -> Dict:
             "error": None,
         }
 
-        # Log that the prompt has been processed
-        logger.info(f"Prompt with custom_id '{data.get('custom_id')}' has been processed")
+        logger.debug(f"Prompt with custom_id '{data.get('custom_id')}' has been processed")
 
         return result
     except Exception as e:
@@ -189,46 +207,116 @@ def _process_batch_prompts(
 
     _setup_litellm_cache()
 
-    with open(input_jsonl_path) as f:
+    with open_jsonl(input_jsonl_path) as f:
         all_prompts = [json.loads(line) for line in f]
 
-    total_prompts = len(all_prompts)
+    processed_results = _run_prompts([(prompt, provider) for prompt in all_prompts], num_processes)
+
+    return _write_results(processed_results, output_path)
+
+
+def send_batch_jobs(batch_jobs: List["LiteLLMBatchJob"], num_processes: int = 1) -> List[str]:
+    """
+    Process the prompts of several LiteLLM batch jobs under one shared worker pool.
+
+    All prompts are submitted to the same pool, so ``num_processes`` is the concurrency
+    budget for all jobs together rather than for each job.
+
+    Args:
+        batch_jobs: LiteLLM batch jobs to process
+        num_processes: Number of processes shared by all jobs
+
+    Returns:
+        List of output paths of the jobs that completed
+    """
+    pending_jobs = [job for job in batch_jobs if not job.should_skip_processing()]
+    completed = [job.output_path for job in batch_jobs if job not in pending_jobs]
+    if not pending_jobs:
+        return completed
+
+    _setup_litellm_cache()
+
+    tasks: List[Tuple[Dict, Optional[str]]] = []
+    job_sizes = []
+    for job in pending_jobs:
+        with open_jsonl(job.jsonl_path) as f:
+            job_prompts = [json.loads(line) for line in f]
+        tasks.extend((prompt, job._provider) for prompt in job_prompts)
+        job_sizes.append(len(job_prompts))
+
+    logger.info(f"Processing {len(pending_jobs)} batch jobs together")
+    processed_results = _run_prompts(tasks, num_processes)
+    if len(processed_results) != len(tasks):
+        logger.warning("Not all prompts were processed. Output files not written.")
+        return completed
+
+    offset = 0
+    for job, size in zip(pending_jobs, job_sizes):
+        result_path = _write_results(processed_results[offset : offset + size], job.output_path)
+        offset += size
+        if result_path:
+            job._is_completed = True
+            completed.append(result_path)
+
+    return completed
+
+
+def _process_task(task: Tuple[Dict, Optional[str]]) -> Dict:
+    """Process a (prompt, provider) task, for use with Pool.imap."""
+    return _process_single_prompt(*task)
+
+
+def _get_chunksize(total: int, num_processes: int) -> int:
+    """Get the number of tasks sent to a worker at once, like Pool.map does by default."""
+    chunksize, extra = divmod(total, num_processes * 4)
+    return chunksize + 1 if extra else max(chunksize, 1)
+
+
+def _run_prompts(tasks: List[Tuple[Dict, Optional[str]]], num_processes: int = 1) -> List[Dict]:
+    """Run (prompt, provider) tasks sequentially or with a process pool, keeping input order."""
+    total_prompts = len(tasks)
     logger.info(f"Starting to process {total_prompts} prompts with {num_processes} processes")
 
     processed_results: List[Dict] = []  # Initialize to an empty list
 
+    progress = ProgressLogger(logger, total_prompts)
+
     if num_processes > 1:
         logger.info(f"Using multiprocessing with {num_processes} processes")
-        pool = mp.Pool(processes=num_processes)
+        # Workers send their logs to the main process, which writes them to its handlers
+        log_queue, listener = AppSingleton().start_log_listener()
+        pool = mp.Pool(
+            processes=num_processes,
+            initializer=setup_worker_logging,
+            initargs=(log_queue, logger.getEffectiveLevel()),
+        )
         try:
-            # Use starmap_async for non-blocking behavior in the main thread
-            async_task = pool.starmap_async(
-                _process_single_prompt,
-                [(prompt, provider) for prompt in all_prompts],
-            )
+            # imap keeps the input order and yields results as they are done, for progress logging
+            results_iter = pool.imap(_process_task, tasks, chunksize=_get_chunksize(total_prompts, num_processes))
 
             # Wait for tasks to complete, checking periodically to allow interrupts
             logger.info("Tasks submitted to pool. Waiting for completion... (Press Ctrl+C to interrupt)")
-            while not async_task.ready():
+            while len(processed_results) < total_prompts:
                 try:
-                    # get() with a timeout allows KeyboardInterrupt to be caught by the main thread
-                    async_task.get(timeout=1)  # Check every 1 second
+                    # next() with a timeout allows KeyboardInterrupt to be caught by the main thread
+                    result = results_iter.next(timeout=1)  # Check every 1 second
                 except mp.TimeoutError:
                     # This is expected if tasks are still running
                     continue
-                # If KeyboardInterrupt occurs during get(), it will propagate to the outer handler
-
-            processed_results = async_task.get()  # Retrieve all results once ready
+                # If KeyboardInterrupt occurs during next(), it will propagate to the outer handler
+                processed_results.append(result)
+                progress.update(result["error"] is None)
 
             pool.close()  # No more tasks will be submitted
             pool.join()  # Wait for all worker processes to complete their current tasks and exit
+            progress.finish()
             logger.info("All multiprocessing tasks completed and workers joined.")
         except KeyboardInterrupt:
             logger.warning("Keyboard interrupt received by main process. Terminating worker processes...")
             pool.terminate()  # Send SIGTERM to worker processes
             pool.join()  # Wait for worker processes to terminate
             logger.info("Worker processes terminated due to keyboard interrupt.")
-            # processed_results will remain as they were (likely empty or incomplete)
+            # processed_results will remain incomplete, so no output file is written.
             # Re-raising KeyboardInterrupt is crucial to stop the script.
             raise
         except Exception as e:
@@ -238,14 +326,17 @@ def _process_batch_prompts(
             logger.info("Worker processes terminated due to an error.")
             # Re-raise the caught exception
             raise
+        finally:
+            listener.stop()
     else:  # Sequential processing
         logger.info("Processing prompts sequentially")
         try:
-            for prompt_data in all_prompts:
+            for prompt_data, prompt_provider in tasks:
                 # Process one by one to allow interruption between prompts
-                if not isinstance(processed_results, list):  # Should not happen with init
-                    processed_results = []
-                processed_results.append(_process_single_prompt(prompt_data, provider))
+                result = _process_single_prompt(prompt_data, prompt_provider)
+                processed_results.append(result)
+                progress.update(result["error"] is None)
+            progress.finish()
             logger.info("Sequential processing completed.")
         except KeyboardInterrupt:
             logger.warning("Keyboard interrupt received during sequential processing.")
@@ -254,11 +345,15 @@ def _process_batch_prompts(
             raise
         # Other exceptions in sequential mode will propagate naturally.
 
-    # Write results to output file only if processing wasn't interrupted before completion
-    # and results were actually gathered.
+    return processed_results
+
+
+def _write_results(processed_results: List[Dict], output_path: str) -> Optional[str]:
+    """Write processed results to the output file, returning its path or None on failure."""
+    # Write results to output file only if results were actually gathered.
     if processed_results:  # Check if list is not empty
         try:
-            with open(output_path, "w") as f:
+            with open_jsonl(output_path, "w") as f:
                 for result_item in processed_results:
                     f.write(json.dumps(result_item) + "\n")
             logger.info(f"Successfully wrote {len(processed_results)} results to {output_path}")
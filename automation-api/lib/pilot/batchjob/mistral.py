@@ -2,20 +2,19 @@
 
 import json
 import os
-import time
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 from mistralai import Mistral
 
 from lib.app_singleton import AppSingleton
 from lib.config import read_config
 
+from ..jsonl_io import open_jsonl, plain_jsonl_file
 from ..utils import generate_batch_id
 from .base import BaseBatchJob
-from .utils import post_process_response
+from .utils import get_num_samples, split_samples
 
 logger = AppSingleton().get_logger()
-config = read_config()
 
 # Statuses for batch processing
 _PROCESSING_STATUSES = {"QUEUED", "RUNNING", "CANCELLATION_REQUESTED"}
@@ -24,18 +23,21 @@ _TERMINAL_STATUSES = {"SUCCESS", "FAILED", "TIMEOUT_EXCEEDED", "CANCELLED"}
 
 def _get_client() -> Mistral:
     """Get authorized Mistral client."""
+    config = read_config()
     return Mistral(api_key=config["MISTRAL_API_KEY"])
 
 
-def _simplify_mistral_response(response_data: Dict[str, Any]) -> Dict[str, Any]:
+def _simplify_mistral_response(response_data: Dict[str, Any], num_samples: int = 1) -> List[Dict[str, Any]]:
     """
     Simplify Mistral batch response format to keep only essential information.
 
     Args:
         response_data: Raw response data from Mistral batch API
+        num_samples: Number of samples the request asked for
 
     Returns:
-        Simplified response dictionary containing only essential fields
+        Simplified response dictionaries containing only essential fields, one for
+        each sample when the request asked for several
     """
     try:
         status_code = response_data.get("response", {}).get("status_code", 500)
@@ -52,11 +54,11 @@ def _simplify_mistral_response(response_data: Dict[str, Any]) -> Dict[str, Any]:
         "error": None,
     }
 
-    # Extract content from choices if available
+    # Extract content from choices if available, requests for several samples have a choice for each
+    contents: List[Optional[str]] = []
     if status_code == 200:
         choices = response_data.get("response", {}).get("body", {}).get("choices", [])
-        if choices and len(choices) > 0:
-            simplified["content"] = choices[0]["message"]["content"]
+        contents = [choice["message"]["content"] for choice in sorted(choices, key=lambda x: x.get("index", 0))]
     else:
         error = response_data.get("error")
         if error:
@@ -65,10 +67,8 @@ def _simplify_mistral_response(response_data: Dict[str, Any]) -> Dict[str, Any]:
         else:
             simplified["error"] = f"Error: status code {status_code}"
 
-    # Post-process the response content
-    simplified["content"] = post_process_response(simplified["content"])
-
-    return simplified
+    # Post-process the content of each sample
+    return split_samples(simplified, contents, num_samples)
 
 
 class MistralBatchJob(BaseBatchJob):
@@ -112,14 +112,15 @@ class MistralBatchJob(BaseBatchJob):
                     self._batch_id = f.read().strip()
                     return self._batch_id
 
-            # Upload the file
-            batch_file = self._client.files.upload(
-                file={
-                    "file_name": os.path.basename(self.jsonl_path),
-                    "content": open(self.jsonl_path, "rb"),
-                },
-                purpose="batch",
-            )
+            # Upload the file, decompressed since the batch API only reads plain JSONL
+            with plain_jsonl_file(self.jsonl_path) as plain_path, open(plain_path, "rb") as content:
+                batch_file = self._client.files.upload(
+                    file={
+                        "file_name": os.path.basename(plain_path),
+                        "content": content,
+                    },
+                    purpose="batch",
+                )
 
             batch_id = generate_batch_id(self.jsonl_path)
 
@@ -215,15 +216,16 @@ class MistralBatchJob(BaseBatchJob):
                             f.write(chunk)
 
                 # Process and simplify both files
-                with open(output_file_path, "w", encoding="utf-8") as out_file:
+                num_samples = get_num_samples(self.jsonl_path)
+                with open_jsonl(output_file_path, "w") as out_file:
                     # Process successful responses
                     if os.path.exists(temp_output):
                         with open(temp_output, "r", encoding="utf-8") as raw_file:
                             for line in raw_file:
                                 try:
                                     response_data = json.loads(line)
-                                    simplified = _simplify_mistral_response(response_data)
-                                    out_file.write(json.dumps(simplified, ensure_ascii=False) + "\n")
+                                    for simplified in _simplify_mistral_response(response_data, num_samples):
+                                        out_file.write(json.dumps(simplified, ensure_ascii=False) + "\n")
                                 except json.JSONDecodeError as e:
                                     logger.error(f"Error processing line: {e}")
                                     continue
@@ -234,8 +236,8 @@ class MistralBatchJob(BaseBatchJob):
                             for line in error_file:
                                 try:
                                     response_data = json.loads(line)
-                                    simplified = _simplify_mistral_response(response_data)
-                                    out_file.write(json.dumps(simplified, ensure_ascii=False) + "\n")
+                                    for simplified in _simplify_mistral_response(response_data, num_samples):
+                                        out_file.write(json.dumps(simplified, ensure_ascii=False) + "\n")
                                 except json.JSONDecodeError as e:
                                     logger.error(f"Error processing error line: {e}")
                                     continue
@@ -288,7 +290,10 @@ class MistralBatchJob(BaseBatchJob):
                 elif status not in _PROCESSING_STATUSES:
                     logger.warning(f"Unexpected status: {status}")
 
-                time.sleep(poll_interval)
+                # Sleep until the next check, unless stop_waiting is called meanwhile
+                if self._stop_waiting.wait(poll_interval):
+                    logger.info(f"Stopped waiting for batch {self.batch_id}")
+                    return None
         except Exception as e:
             logger.error(f"Error while waiting for batch completion: {str(e)}")
             return None
@@ -2,39 +2,47 @@
 
 import json
 import os
-import time
-from typing import Any, Dict, Optional
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
 
 from openai import OpenAI
 
 from lib.app_singleton import AppSingleton
 from lib.config import read_config
 
+from ..jsonl_io import open_jsonl, plain_jsonl_file
 from ..utils import generate_batch_id
 from .base import BaseBatchJob
-from .utils import post_process_response
+from .utils import get_num_samples, split_samples
 
 logger = AppSingleton().get_logger()
-config = read_config()
 
 # Statuses that indicate the batch is still processing
 _PROCESSING_STATUSES = {"validating", "in_progress", "finalizing"}
 
 
-# Provider-specific configurations
-_PROVIDER_CONFIGS: Dict[str, Dict[str, Any]] = {
-    "alibaba": {
-        "api_key": config.get("DASHSCOPE_API_KEY", ""),
-        "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1",
+@lru_cache(maxsize=None)
+def _get_config() -> Dict[str, str]:
+    """Read the configuration on first use instead of at import time."""
+    return read_config()
+
+
+def _get_provider_configs() -> Dict[str, Dict[str, Any]]:
+    """Get provider-specific configurations."""
+    return {
+        "alibaba": {
+            "api_key": _get_config().get("DASHSCOPE_API_KEY", ""),
+            "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1",
+        }
     }
-}
 
 
 def _get_client(provider) -> OpenAI:
     """Get authorized OpenAI client with provider compatibility."""
-    if provider in _PROVIDER_CONFIGS:
-        return OpenAI(**_PROVIDER_CONFIGS[provider])
-    return OpenAI(api_key=config["OPENAI_API_KEY"])
+    provider_configs = _get_provider_configs()
+    if provider in provider_configs:
+        return OpenAI(**provider_configs[provider])
+    return OpenAI(api_key=_get_config()["OPENAI_API_KEY"])
 
 
 class OpenAIBatchJob(BaseBatchJob):
@@ -101,7 +109,9 @@ class OpenAIBatchJob(BaseBatchJob):
         Returns:
             str: Path to the downloaded results, or None if download failed
         """
-        return _download_batch_job_output(self._client, self.batch_id, self._output_path)
+        return _download_batch_job_output(
+            self._client, self.batch_id, self._output_path, get_num_samples(self.jsonl_path)
+        )
 
     def wait_for_completion(self, poll_interval: int = 30) -> Optional[str]:
         """
@@ -135,7 +145,10 @@ class OpenAIBatchJob(BaseBatchJob):
                 elif status not in _PROCESSING_STATUSES:
                     logger.warning(f"Unexpected status: {status}")
 
-                time.sleep(poll_interval)
+                # Sleep until the next check, unless stop_waiting is called meanwhile
+                if self._stop_waiting.wait(poll_interval):
+                    logger.info(f"Stopped waiting for batch {self.batch_id}")
+                    return None
         except Exception as e:
             logger.error(f"Error while waiting for batch completion: {str(e)}")
             return None
@@ -166,8 +179,9 @@ def _send_batch_file(client: OpenAI, jsonl_path: str, endpoint: str = "/v1/chat/
     Returns:
         The batch ID for tracking the request
     """
-    # Upload the JSONL file
-    batch_input_file = client.files.create(file=open(jsonl_path, "rb"), purpose="batch")
+    # Upload the JSONL file, decompressed since the batch API only reads plain JSONL
+    with plain_jsonl_file(jsonl_path) as plain_path, open(plain_path, "rb") as f:
+        batch_input_file = client.files.create(file=f, purpose="batch")
     batch_input_file_id = batch_input_file.id
 
     batch_id = generate_batch_id(jsonl_path)
@@ -201,15 +215,17 @@ def _check_batch_job_status(client: OpenAI, batch_id: str) -> str:
     return batch.status
 
 
-def _simplify_openai_response(response_data: Dict[str, Any]) -> Dict[str, Any]:
+def _simplify_openai_response(response_data: Dict[str, Any], num_samples: int = 1) -> List[Dict[str, Any]]:
     """
     Simplify OpenAI batch response format to keep only essential information.
 
     Args:
         response_data: Raw response data from OpenAI batch API
+        num_samples: Number of samples the request asked for
 
     Returns:
-        Simplified response dictionary containing only essential fields
+        Simplified response dictionaries containing only essential fields, one for
+        each sample when the request asked for several
     """
     try:
         status_code = response_data.get("response", {}).get("status_code", 500)
@@ -226,11 +242,11 @@ def _simplify_openai_response(response_data: Dict[str, Any]) -> Dict[str, Any]:
         "error": None,
     }
 
-    # Extract content from choices if available
+    # Extract content from choices if available, requests for several samples have a choice for each
+    contents: List[Optional[str]] = []
     if status_code == 200:
         choices = response_data.get("response", {}).get("body", {}).get("choices", [])
-        if choices and len(choices) > 0:
-            simplified["content"] = choices[0]["message"]["content"]
+        contents = [choice["message"]["content"] for choice in sorted(choices, key=lambda x: x.get("index", 0))]
     else:
         error = response_data.get("error")
         if error:
@@ -239,13 +255,11 @@ def _simplify_openai_response(response_data: Dict[str, Any]) -> Dict[str, Any]:
         else:
             simplified["error"] = f"Error: status code {status_code}"
 
-    # Post-process the response content
-    simplified["content"] = post_process_response(simplified["content"])
-
-    return simplified
+    # Post-process the content of each sample
+    return split_samples(simplified, contents, num_samples)
 
 
-def _download_batch_job_output(client: OpenAI, batch_id: str, output_path: str) -> Optional[str]:
+def _download_batch_job_output(client: OpenAI, batch_id: str, output_path: str, num_samples: int = 1) -> Optional[str]:
     """
     Download and simplify results for a completed batch job, including both successful
     responses and errors.
@@ -253,6 +267,7 @@ def _download_batch_job_output(client: OpenAI, batch_id: str, output_path: str)
     Args:
         batch_id: The batch ID to download results for
         output_path: Path to save results file
+        num_samples: Number of samples each request asked for
 
     Returns:
         Path to the downloaded results file if successful, None if batch not completed
@@ -278,15 +293,15 @@ def _download_batch_job_output(client: OpenAI, batch_id: str, output_path: str)
         logger.info("No error file found for this batch")
 
     # Process and combine both files
-    with open(output_path, "w", encoding="utf-8") as out_file:
+    with open_jsonl(output_path, "w") as out_file:
         # Process successful responses
         if os.path.exists(temp_output):
             with open(temp_output, "r", encoding="utf-8") as raw_file:
                 for line in raw_file:
                     try:
                         response_data = json.loads(line)
-                        simplified = _simplify_openai_response(response_data)
-                        out_file.write(json.dumps(simplified, ensure_ascii=False) + "\n")
+                        for simplified in _simplify_openai_response(response_data, num_samples):
+                            out_file.write(json.dumps(simplified, ensure_ascii=False) + "\n")
                     except json.JSONDecodeError as e:
                         logger.error(f"Error processing line: {e}")
                         continue
@@ -297,8 +312,8 @@ def _download_batch_job_output(client: OpenAI, batch_id: str, output_path: str)
                 for line in error_file:
                     try:
                         response_data = json.loads(line)
-                        simplified = _simplify_openai_response(response_data)
-                        out_file.write(json.dumps(simplified, ensure_ascii=False) + "\n")
+                        for simplified in _simplify_openai_response(response_data, num_samples):
+                            out_file.write(json.dumps(simplified, ensure_ascii=False) + "\n")
                     except json.JSONDecodeError as e:
                         logger.error(f"Error processing error line: {e}")
                         continue
@@ -1,7 +1,16 @@
 """Utility functions for batch job processing."""
 
+import json
+import logging
 import re
-from typing import Optional
+import time
+from typing import Any, Dict, List, Optional
+
+from ..custom_ids import repeat_id
+from ..jsonl_io import open_jsonl
+
+# Request parameters asking for several samples of a prompt in one request
+MULTI_SAMPLE_KEYS = ("n", "candidateCount")
 
 
 def post_process_response(content: Optional[str]) -> Optional[str]:
@@ -10,3 +19,113 @@ def post_process_response(content: Optional[str]) -> Optional[str]:
         # Remove thinking tags
         content = re.sub(r"<think>.*?</think>", "", content, flags=re.DOTALL)
     return content
+
+
+def get_request_num_samples(request: Dict[str, Any]) -> int:
+    """Get the number of samples a batch request asks for, in the OpenAI, Mistral or Vertex AI format."""
+    if "request" in request:  # Vertex format
+        params = request["request"].get("generationConfig") or {}
+    else:
+        params = request.get("body", {})
+    for key in MULTI_SAMPLE_KEYS:
+        if params.get(key):
+            return int(params[key])
+    return 1
+
+
+def get_num_samples(jsonl_path: str) -> int:
+    """
+    Get the number of samples the requests of a prompt file ask for.
+
+    All requests of a prompt file have the same parameters, so the first one is read.
+    """
+    with open_jsonl(jsonl_path) as f:
+        line = f.readline()
+    if not line.strip():
+        return 1
+    return get_request_num_samples(json.loads(line))
+
+
+def split_samples(
+    simplified: Dict[str, Any], contents: List[Optional[str]], num_samples: int = 1
+) -> List[Dict[str, Any]]:
+    """
+    Split a simplified response into one response for each sample of its request.
+
+    Requests asking for several samples (`n`, `candidateCount`) get all of them in one
+    response. Each sample becomes a response of its own, with the repeat index appended
+    to the custom_id. Samples missing from the response, e.g. because the request failed,
+    get a failed response so that they are retried. Responses of requests for a single
+    sample keep their custom_id.
+
+    Args:
+        simplified: Simplified response, its content is replaced by the samples
+        contents: Content of each sample, in the order of their index
+        num_samples: Number of samples the request asked for
+
+    Returns:
+        Simplified responses with post-processed content
+    """
+    num_samples = max(num_samples, len(contents))
+    if num_samples <= 1 or not simplified.get("custom_id"):
+        content = contents[0] if contents else simplified.get("content")
+        return [{**simplified, "content": post_process_response(content)}]
+
+    samples = []
+    for i in range(num_samples):
+        sample = {**simplified, "custom_id": repeat_id(simplified["custom_id"], i)}
+        if i < len(contents):
+            sample["content"] = post_process_response(contents[i])
+        else:
+            sample["content"] = None
+            if sample.get("status_code") in (200, None, ""):
+                sample["status_code"] = 500
+            sample["error"] = sample.get("error") or f"Error: sample {i} missing from the response"
+        samples.append(sample)
+    return samples
+
+
+class ProgressLogger:
+    """
+    Log the progress of a long running loop without a line per item.
+
+    A progress line is logged when `every` more items are done, or when `interval`
+    seconds passed since the last line, whichever comes first.
+    """
+
+    def __init__(self, logger: logging.Logger, total: int, every: int = 1000, interval: float = 30.0) -> None:
+        self._logger = logger
+        self._total = total
+        self._every = every
+        self._interval = interval
+        self._start = time.monotonic()
+        self._last_time = self._start
+        self._last_count = 0
+        self.done = 0
+        self.failed = 0
+
+    def update(self, succeeded: bool = True) -> None:
+        """Record a processed item, logging a progress line when it is due."""
+        self.done += 1
+        if not succeeded:
+            self.failed += 1
+
+        now = time.monotonic()
+        if self.done - self._last_count >= self._every or now - self._last_time >= self._interval:
+            self._log(now)
+
+    def finish(self) -> None:
+        """Log the final progress line, unless it was just logged."""
+        if self.done != self._last_count or self.done == 0:
+            self._log(time.monotonic())
+
+    def _log(self, now: float) -> None:
+        elapsed = now - self._start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        percent_done = 100 * self.done / self._total if self._total else 100.0
+        self._logger.info(
+            f"Progress: {percent_done:.1f}% ({self.done}/{self._total} processed, "
+            f"{self.failed} failed, {rate:.1f}/s)"
+        )
+        self._last_time = now
+        self._last_count = self.done
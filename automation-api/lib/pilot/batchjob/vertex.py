@@ -2,9 +2,8 @@
 
 import json
 import os
-import time
 from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 import polars as pl
 import vertexai
@@ -14,9 +13,10 @@ from vertexai.batch_prediction import BatchPredictionJob
 from lib.app_singleton import AppSingleton
 from lib.config import read_config
 
+from ..jsonl_io import open_jsonl, plain_jsonl_file, split_jsonl_extension
 from ..utils import get_batch_id_and_output_path
 from .base import BaseBatchJob
-from .utils import post_process_response
+from .utils import get_num_samples, split_samples
 
 logger = AppSingleton().get_logger()
 
@@ -58,7 +58,7 @@ class VertexBatchJob(BaseBatchJob):
         # find custom id mapping file
         # because vertex AI doesn't support custom id in the
         # request file, so we create a local file for custom id.
-        mapping_path = self._output_path.replace("-response.jsonl", "-prompt-mapping.csv")
+        mapping_path = f"{split_jsonl_extension(self.jsonl_path)[0]}-prompt-mapping.csv"
         if not os.path.exists(mapping_path):
             raise ValueError(f"Prompt mapping CSV file not found: {mapping_path}")
         self._custom_id_mapping = {}
@@ -147,6 +147,7 @@ class VertexBatchJob(BaseBatchJob):
             self.batch_id,
             self._output_path,
             self._custom_id_mapping,
+            get_num_samples(self.jsonl_path),
         )
 
     def wait_for_completion(self, poll_interval: int = 60) -> Optional[str]:
@@ -181,7 +182,10 @@ class VertexBatchJob(BaseBatchJob):
                 elif status not in _PROCESSING_STATUSES:
                     logger.warning(f"Unexpected status: {status}")
 
-                time.sleep(poll_interval)
+                # Sleep until the next check, unless stop_waiting is called meanwhile
+                if self._stop_waiting.wait(poll_interval):
+                    logger.info(f"Stopped waiting for batch {self.batch_id}")
+                    return None
         except Exception as e:
             logger.error(f"Error while waiting for batch completion: {str(e)}")
             return None
@@ -217,20 +221,22 @@ def _send_batch_file(
     Returns:
         The batch job resource name for tracking the request
     """
-    # Upload to GCS with timestamp folder
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = os.path.basename(jsonl_path)
-    blob_path = f"batch_prompts/{timestamp}/{filename}"
-
-    # Upload file
-    client = storage.Client()
-    bucket = client.bucket(gcs_bucket)
-    blob = bucket.blob(blob_path)
-    input_uri = f"gs://{gcs_bucket}/{blob_path}"
-
-    logger.info(f"Uploading {jsonl_path} to {input_uri}")
-    blob.upload_from_filename(jsonl_path, timeout=20 * 60)
-    logger.info("Upload complete")
+    # Vertex AI only reads plain JSONL, compressed prompt files are decompressed for the upload
+    with plain_jsonl_file(jsonl_path) as plain_path:
+        # Upload to GCS with timestamp folder
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = os.path.basename(plain_path)
+        blob_path = f"batch_prompts/{timestamp}/{filename}"
+
+        # Upload file
+        client = storage.Client()
+        bucket = client.bucket(gcs_bucket)
+        blob = bucket.blob(blob_path)
+        input_uri = f"gs://{gcs_bucket}/{blob_path}"
+
+        logger.info(f"Uploading {jsonl_path} to {input_uri}")
+        blob.upload_from_filename(plain_path, timeout=20 * 60)
+        logger.info("Upload complete")
 
     # Generate output URI
     output_uri = f"gs://{gcs_bucket}/batch_results"
@@ -262,16 +268,20 @@ def _check_batch_job_status(batch_id: str) -> str:
     return batch_job.state.name
 
 
-def _simplify_vertex_response(response_data: Dict[str, Any], custom_id: Optional[str] = None) -> Dict[str, Any]:
+def _simplify_vertex_response(
+    response_data: Dict[str, Any], custom_id: Optional[str] = None, num_samples: int = 1
+) -> List[Dict[str, Any]]:
     """
     Simplify Vertex AI batch response format to keep only essential information.
 
     Args:
         response_data: Raw response data from Vertex AI batch API
         custom_id: Custom ID to include in the response
+        num_samples: Number of candidates the request asked for
 
     Returns:
-        Simplified response dictionary containing only essential fields
+        Simplified response dictionaries containing only essential fields, one for
+        each candidate when the request asked for several
     """
     simplified = {
         "custom_id": custom_id,
@@ -280,22 +290,23 @@ def _simplify_vertex_response(response_data: Dict[str, Any], custom_id: Optional
         "error": None,
     }
 
+    contents: List[Optional[str]] = []
     try:
         candidates = response_data.get("response", {}).get("candidates", [])
-        if candidates and len(candidates) > 0:
-            content = candidates[0].get("content", {}).get("parts", [{}])[0].get("text")
-            simplified["content"] = content
+        for candidate in sorted(candidates, key=lambda x: x.get("index", 0)):
+            contents.append(candidate.get("content", {}).get("parts", [{}])[0].get("text"))
     except (KeyError, TypeError, IndexError) as e:
         # FIXME: should read error from the response_data.
         simplified["error"] = str(e)
+        contents = []
 
-    # Post-process the response content
-    simplified["content"] = post_process_response(simplified["content"])
-
-    return simplified
+    # Post-process the content of each candidate
+    return split_samples(simplified, contents, num_samples)
 
 
-def _process_and_simplify_results(input_path: str, output_path: str, custom_id_mapping: Dict[str, str]) -> None:
+def _process_and_simplify_results(
+    input_path: str, output_path: str, custom_id_mapping: Dict[str, str], num_samples: int = 1
+) -> None:
     """
     Process and simplify batch results from raw JSONL to simplified format.
 
@@ -303,10 +314,11 @@ def _process_and_simplify_results(input_path: str, output_path: str, custom_id_m
         input_path: Path to raw results JSONL file
         output_path: Path to save simplified results
         custom_id_mapping: Dictionary mapping request strings to custom IDs
+        num_samples: Number of candidates each request asked for
     """
     with (
         open(input_path, "r", encoding="utf-8") as raw_file,
-        open(output_path, "w", encoding="utf-8") as out_file,
+        open_jsonl(output_path, "w") as out_file,
     ):
         for i, line in enumerate(raw_file):
             try:
@@ -317,8 +329,8 @@ def _process_and_simplify_results(input_path: str, output_path: str, custom_id_m
                 if not custom_id:
                     logger.debug("would not find id for request:")
                     logger.debug(request_str)
-                simplified = _simplify_vertex_response(response_data, custom_id)
-                out_file.write(json.dumps(simplified, ensure_ascii=False) + "\n")
+                for simplified in _simplify_vertex_response(response_data, custom_id, num_samples):
+                    out_file.write(json.dumps(simplified, ensure_ascii=False) + "\n")
             except (json.JSONDecodeError, IndexError) as e:
                 logger.error(f"Error processing line {i}: {e}")
                 continue
@@ -328,6 +340,7 @@ def _download_batch_job_output(
     batch_id: str,
     output_path: str,
     custom_id_mapping: Dict[str, str],
+    num_samples: int = 1,
 ) -> Optional[str]:
     """
     Download and simplify results for a completed batch job.
@@ -338,6 +351,7 @@ def _download_batch_job_output(
         project_id: GCP project ID
         custom_id_mapping: Dictionary mapping request strings to custom IDs
         location: GCP region
+        num_samples: Number of candidates each request asked for
 
     Returns:
         Path to the downloaded results file if successful, None if batch not completed
@@ -374,7 +388,7 @@ def _download_batch_job_output(
     predictions_blob.download_to_filename(temp_output)
 
     # Process and simplify the results
-    _process_and_simplify_results(temp_output, output_path, custom_id_mapping)
+    _process_and_simplify_results(temp_output, output_path, custom_id_mapping, num_samples)
 
     # Clean up temporary file
     os.remove(temp_output)
@@ -0,0 +1,217 @@
+"""
+Compact custom_ids for batch requests.
+
+Readable custom_ids (`{model_config_id}-{question_id}-{variation_id}`, and `-{metric_id}`
+for evaluations) get long, and Anthropic caps custom_ids at 64 characters. Compact ids
+are fixed-length fnv64 hashes of the readable ids. The parts of each compact id are kept
+in a lookup table next to the prompt file, `{prompt file base}-custom-ids.parquet`.
+
+Repeated samples of a prompt have the repeat index appended to the custom_id of the
+prompt, readable or compact: `{custom_id}-rep{repeat_index}`.
+"""
+
+import os
+import re
+from glob import glob
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import polars as pl
+
+from lib.hash.fnv64hash import hash_dn
+from lib.pilot.jsonl_io import split_jsonl_extension
+from lib.pilot.parquet_io import ParquetChunkWriter
+
+ID_SALT = "gm-eval"
+
+# Words some older readable custom_ids have between their parts, e.g. `mc001-question-1-v1`
+READABLE_ID_FILLERS = ("question", "q", "eval")
+
+REPEAT_SEPARATOR = "-rep"
+_REPEAT_PATTERN = re.compile(rf"^(?P<base>.+){REPEAT_SEPARATOR}(?P<index>\d+)$")
+
+LOOKUP_SCHEMA = {
+    "custom_id": pl.Utf8,
+    "model_config_id": pl.Utf8,
+    "question_id": pl.Utf8,
+    "prompt_variation_id": pl.Utf8,
+    "metric_id": pl.Utf8,
+}
+
+
+def compact_id(readable_id: str) -> str:
+    """Get the 11 character compact id of a readable custom_id."""
+    custom_id = hash_dn(readable_id, ID_SALT)
+    # Hashes may contain "-", rehash the rare ones which end like the repeat index of a sample
+    while split_repeat_id(custom_id)[1] is not None:
+        custom_id = hash_dn(custom_id, ID_SALT)
+    return custom_id
+
+
+def repeat_id(custom_id: str, repeat_index: int) -> str:
+    """Get the custom_id of a repeated sample of a prompt."""
+    return f"{custom_id}{REPEAT_SEPARATOR}{repeat_index}"
+
+
+def split_repeat_id(custom_id: str) -> Tuple[str, Optional[int]]:
+    """
+    Split the repeat index from the custom_id of a sample.
+
+    Returns:
+        Tuple of (custom_id of the prompt, repeat index), the index is None for custom_ids without one
+    """
+    match = _REPEAT_PATTERN.match(custom_id)
+    if match is None:
+        return custom_id, None
+    return match.group("base"), int(match.group("index"))
+
+
+def split_readable_id(custom_id: str) -> List[str]:
+    """
+    Split a readable custom_id of a prompt, without repeat index, into its parts.
+
+    Returns:
+        [model_config_id, question_id, prompt_variation_id], and the metric_id for evaluations
+    """
+    return [part for part in custom_id.split("-") if part not in READABLE_ID_FILLERS]
+
+
+def split_repeat_id_columns(custom_ids: pl.Expr) -> Tuple[pl.Expr, pl.Expr]:
+    """
+    Split the repeat index from a column of custom_ids, like split_repeat_id does for one.
+
+    Returns:
+        Expressions of the custom_ids of the prompts, and of the repeat indexes, null for
+        custom_ids without one
+    """
+    base_ids = custom_ids.str.extract(_REPEAT_PATTERN.pattern, 1)
+    repeat_indexes = custom_ids.str.extract(_REPEAT_PATTERN.pattern, 2).cast(pl.Int64)
+    return pl.coalesce(base_ids, custom_ids), repeat_indexes
+
+
+def split_readable_id_column(custom_ids: pl.Expr) -> pl.Expr:
+    """Split a column of readable custom_ids into lists of their parts, like split_readable_id does for one."""
+    return custom_ids.str.split("-").list.eval(pl.element().filter(~pl.element().is_in(READABLE_ID_FILLERS)))
+
+
+def get_lookup_path(jsonl_path: str) -> str:
+    """Get the path of the custom_id lookup table of a prompt file."""
+    return f"{split_jsonl_extension(jsonl_path)[0]}-custom-ids.parquet"
+
+
+def build_lookup(rows: Dict[str, Iterable[Optional[str]]]) -> pl.DataFrame:
+    """
+    Build a custom_id lookup table, giving each row a compact id.
+
+    Args:
+        rows: Columns model_config_id, question_id and prompt_variation_id, and optionally metric_id
+
+    Returns:
+        DataFrame with the LOOKUP_SCHEMA columns
+
+    Raises:
+        ValueError: If two different rows get the same compact id
+    """
+    lookup = pl.DataFrame(rows).select(
+        [
+            (pl.col(name) if name in rows else pl.lit(None)).cast(dtype).alias(name)
+            for name, dtype in LOOKUP_SCHEMA.items()
+            if name != "custom_id"
+        ]
+    )
+    readable_ids = lookup.select(
+        pl.concat_str(
+            ["model_config_id", "question_id", "prompt_variation_id", "metric_id"], separator="-", ignore_nulls=True
+        )
+    ).to_series()
+    lookup = lookup.with_columns(pl.Series("custom_id", [compact_id(x) for x in readable_ids], dtype=pl.Utf8))
+
+    if lookup["custom_id"].n_unique() != readable_ids.n_unique():
+        raise ValueError("custom_id collision: two different requests got the same compact id")
+    return lookup.select(list(LOOKUP_SCHEMA))
+
+
+def build_question_lookup(model_config_id: str, question_ids: pl.Series, variation_ids: pl.Series) -> pl.DataFrame:
+    """
+    Build the custom_id lookup table of the question prompts of a model configuration.
+
+    Returns:
+        Lookup table with one row for each question and prompt variation
+    """
+    combinations = (
+        question_ids.cast(pl.Utf8)
+        .alias("question_id")
+        .to_frame()
+        .join(variation_ids.cast(pl.Utf8).alias("prompt_variation_id").to_frame(), how="cross")
+    )
+    return build_lookup(
+        {
+            "model_config_id": [model_config_id] * combinations.height,
+            "question_id": combinations["question_id"],
+            "prompt_variation_id": combinations["prompt_variation_id"],
+        }
+    )
+
+
+class LookupWriter(ParquetChunkWriter):
+    """
+    Write a custom_id lookup table chunk by chunk, without keeping it in memory.
+
+    The chunks are checked for collisions one by one by build_lookup, and the whole table
+    is checked again when the chunks are combined.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path, LOOKUP_SCHEMA)
+
+    def close(self) -> None:
+        """
+        Combine the chunks into the lookup table.
+
+        Raises:
+            ValueError: If two different rows of the table have the same compact id
+        """
+        super().close()
+
+        # Ids of different chunks may still collide
+        counts = (
+            pl.scan_parquet(self.path)
+            .select(
+                pl.col("custom_id").n_unique().alias("custom_ids"),
+                pl.struct([name for name in LOOKUP_SCHEMA if name != "custom_id"]).n_unique().alias("rows"),
+            )
+            .collect()
+        )
+        if counts["custom_ids"][0] != counts["rows"][0]:
+            raise ValueError("custom_id collision: two different requests got the same compact id")
+
+
+def build_eval_lookup(response_lookup: pl.DataFrame, metric_ids: pl.Series) -> pl.DataFrame:
+    """
+    Build the custom_id lookup table of the evaluations of responses with compact custom_ids.
+
+    Args:
+        response_lookup: Lookup table rows of the evaluated responses
+        metric_ids: IDs of the evaluation metrics
+
+    Returns:
+        Lookup table with one row for each response and metric, and a
+        response_custom_id column with the custom_id of the evaluated response
+    """
+    combinations = response_lookup.select(
+        pl.col("custom_id").alias("response_custom_id"), "model_config_id", "question_id", "prompt_variation_id"
+    ).join(metric_ids.cast(pl.Utf8).alias("metric_id").to_frame(), how="cross")
+    lookup = build_lookup({name: combinations[name] for name in LOOKUP_SCHEMA if name != "custom_id"})
+    return lookup.with_columns(combinations["response_custom_id"])
+
+
+def load_lookup(folder: str) -> Optional[pl.DataFrame]:
+    """
+    Load and combine all custom_id lookup tables in a folder.
+
+    Returns:
+        The combined lookup table, or None if the folder has none
+    """
+    paths = sorted(glob(os.path.join(folder, "*-custom-ids.parquet")))
+    if not paths:
+        return None
+    return pl.concat([pl.read_parquet(path) for path in paths]).unique(subset="custom_id", keep="last")
@@ -0,0 +1,85 @@
+"""
+Local cache of evaluator results, shared by experiments.
+
+Results are keyed by the hash of their evaluation request (see eval_updates), which covers
+the evaluated response text, the question and its options, the metric template and the
+evaluator model and parameters. An identical request in another experiment gets the cached
+result instead of being sent again.
+
+The cache is a folder of Parquet files with columns [request_hash, response], response
+being the JSON line of the result. Each update adds a file, so several processes can update
+the cache at the same time.
+"""
+
+import json
+import os
+import uuid
+from typing import Dict
+
+import polars as pl
+
+CACHE_SCHEMA = {"request_hash": pl.Utf8, "response": pl.Utf8}
+
+
+class EvalCache:
+    """Evaluator results keyed by request hash."""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    def _scan(self) -> pl.LazyFrame:
+        if not os.path.isdir(self.folder) or not any(name.endswith(".parquet") for name in os.listdir(self.folder)):
+            return pl.LazyFrame(schema=CACHE_SCHEMA)
+        return pl.scan_parquet(os.path.join(self.folder, "*.parquet"))
+
+    def lookup(self, request_hashes: Dict[str, str]) -> Dict[str, str]:
+        """
+        Look up the cached results of requests.
+
+        Args:
+            request_hashes: Mapping of custom_ids to their request hashes
+
+        Returns:
+            Mapping of custom_ids to the response lines of the cached results, with their custom_id
+        """
+        if not request_hashes:
+            return {}
+        requests = pl.DataFrame(
+            {"custom_id": list(request_hashes), "request_hash": list(request_hashes.values())},
+            schema={"custom_id": pl.Utf8, "request_hash": pl.Utf8},
+        )
+        cached = (
+            self._scan()
+            .filter(pl.col("request_hash").is_in(requests["request_hash"].unique()))
+            .unique(subset="request_hash", keep="any")
+            .collect()
+        )
+        hits = requests.join(cached, on="request_hash", how="inner", maintain_order="left")
+        return {
+            custom_id: json.dumps({**json.loads(response), "custom_id": custom_id}, ensure_ascii=False)
+            for custom_id, response in hits.select("custom_id", "response").iter_rows()
+        }
+
+    def add(self, results: Dict[str, str]) -> int:
+        """
+        Add results to the cache.
+
+        Args:
+            results: Mapping of request hashes to the response lines of their results
+
+        Returns:
+            Number of results which were not cached yet
+        """
+        new = pl.DataFrame(
+            {"request_hash": list(results), "response": list(results.values())}, schema=CACHE_SCHEMA
+        ).join(self._scan().select("request_hash").collect(), on="request_hash", how="anti")
+        if new.height == 0:
+            return 0
+
+        os.makedirs(self.folder, exist_ok=True)
+        # Write under a temporary name, so that other processes never read a partial file
+        name = uuid.uuid4().hex
+        temp_path = os.path.join(self.folder, f"{name}.tmp")
+        new.write_parquet(temp_path)
+        os.replace(temp_path, os.path.join(self.folder, f"{name}.parquet"))
+        return new.height
@@ -0,0 +1,311 @@
+"""
+Incremental evaluation: only send the evaluation prompts without an up-to-date result.
+
+Each evaluation prompts file gets a table of the hashes of its requests next to it,
+`{prompts file base}-request-hashes.parquet`. A result in the eval response file is kept
+when it has a valid score and the hash of its request didn't change since it was sent.
+
+The prompts without such a result are copied to a pending file in the `pending` folder
+next to the prompts file, which is sent instead of the whole prompts file. Identical
+requests are only copied once. The responses of the pending file are merged into the eval
+response file once they are downloaded, and copied to the custom_ids of identical requests.
+
+In a staged evaluation, the evaluators after the first stage only get the prompts the first
+stage evaluators don't agree on, see find_undecided_evals.
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import polars as pl
+
+from lib.app_singleton import AppSingleton
+from lib.pilot.eval_cache import EvalCache
+from lib.pilot.gm_eval.commands.merge import load_all_responses
+from lib.pilot.gm_eval.commands.retry import load_requests, remove_attempt_files, write_attempt_file, write_responses
+from lib.pilot.gm_eval.commands.split import is_failed_response
+from lib.pilot.gm_eval.state import hash_file, invalidate_outputs
+from lib.pilot.gm_eval.utils import get_response_path
+from lib.pilot.jsonl_io import split_jsonl_extension
+from lib.pilot.summarize_results import extract_score
+
+logger = AppSingleton().get_logger()
+
+PENDING_FOLDER = "pending"
+
+REQUEST_HASHES_SCHEMA = {"custom_id": pl.Utf8, "request_hash": pl.Utf8}
+
+
+def get_request_hashes_path(jsonl_path: str) -> str:
+    """Get the path of the request hash table of an evaluation prompts file."""
+    return f"{split_jsonl_extension(jsonl_path)[0]}-request-hashes.parquet"
+
+
+def get_pending_path(jsonl_path: str) -> str:
+    """Get the path of the pending file of an evaluation prompts file."""
+    # Pending files are short-lived like retry attempts, they are written uncompressed
+    pending_name = f"{split_jsonl_extension(os.path.basename(jsonl_path))[0]}.jsonl"
+    return os.path.join(os.path.dirname(jsonl_path), PENDING_FOLDER, pending_name)
+
+
+def hash_prompts(prompt_texts: Iterable[str]) -> List[bytes]:
+    """Hash the texts of prompts."""
+    return [hashlib.sha256(text.encode("utf-8")).digest() for text in prompt_texts]
+
+
+def hash_requests(request_envelope: str, prompt_hashes: Iterable[bytes]) -> List[str]:
+    """
+    Hash the requests of prompts to one evaluator.
+
+    Args:
+        request_envelope: A request of the evaluator rendered without custom_id and prompt, it
+            holds the model and its parameters
+        prompt_hashes: Hashes of the prompt texts, from hash_prompts
+
+    Returns:
+        Hex digests of the requests
+    """
+    envelope_hash = hashlib.sha256(request_envelope.encode("utf-8")).digest()
+    return [hashlib.sha256(envelope_hash + prompt_hash).hexdigest() for prompt_hash in prompt_hashes]
+
+
+def read_request_hashes(jsonl_path: str) -> Optional[pl.DataFrame]:
+    """Read the request hash table of an evaluation prompts file, None if it has none."""
+    path = get_request_hashes_path(jsonl_path)
+    if not os.path.isfile(path):
+        return None
+    return pl.read_parquet(path)
+
+
+def has_valid_score(response: Dict) -> bool:
+    """Check if an eval response succeeded and has a score summaries can read."""
+    return not is_failed_response(response) and extract_score(response.get("content")) != -1
+
+
+def merge_pending_responses(jsonl_path: str) -> int:
+    """
+    Merge the downloaded responses of the pending file of an evaluation prompts file into its response file.
+
+    Identical prompts are only sent once, so each result is also merged for the other custom_ids
+    with the same request, see prepare_pending_file.
+
+    Args:
+        jsonl_path: Path to the evaluation prompts file
+
+    Returns:
+        Number of merged responses, 0 when the pending file has no responses yet
+    """
+    pending_path = get_pending_path(jsonl_path)
+    pending_response_path = get_response_path(pending_path)
+    if not os.path.isfile(pending_response_path):
+        return 0
+
+    response_path = get_response_path(jsonl_path)
+    responses = load_all_responses([response_path]) if os.path.isfile(response_path) else {}
+    pending_responses = load_all_responses([pending_response_path])
+
+    # The request hash table is the one the pending file was written with, as pending responses
+    # are merged before the prompts are generated again
+    duplicates: Dict[str, str] = {}
+    hashes = read_request_hashes(jsonl_path)
+    if hashes is not None:
+        sent = pl.DataFrame({"sent_id": list(pending_responses)}, schema={"sent_id": pl.Utf8})
+        fan_out = (
+            sent.join(hashes, left_on="sent_id", right_on="custom_id", how="inner")
+            .join(hashes, on="request_hash", how="inner")
+            .filter(pl.col("custom_id") != pl.col("sent_id"))
+        )
+        for sent_id, custom_id in fan_out.select("sent_id", "custom_id").iter_rows():
+            if custom_id not in responses and custom_id not in pending_responses:
+                response = {**json.loads(pending_responses[sent_id]), "custom_id": custom_id}
+                duplicates[custom_id] = json.dumps(response, ensure_ascii=False)
+
+    # The new results replace outdated ones
+    write_responses({**responses, **duplicates, **pending_responses}, response_path)
+    remove_attempt_files(pending_path)
+    merged = len(pending_responses) + len(duplicates)
+    logger.info(f"Merged {merged} evaluation results into {response_path}")
+    return merged
+
+
+def _get_current_ids(hashes: pl.DataFrame, previous_hashes: Optional[pl.DataFrame]) -> Set[str]:
+    """Get the custom_ids whose request is the same as when their result was sent."""
+    # Results of prompts files generated before request hashes were recorded are all taken as up to date
+    if previous_hashes is None:
+        return set(hashes["custom_id"])
+    return set(hashes.join(previous_hashes, on=["custom_id", "request_hash"], how="inner")["custom_id"])
+
+
+def load_current_results(jsonl_path: str, previous_hashes: Optional[pl.DataFrame]) -> Dict[str, str]:
+    """
+    Load the results of an evaluation prompts file whose request didn't change since they were sent.
+
+    Args:
+        jsonl_path: Path to the evaluation prompts file, with its request hash table written
+        previous_hashes: Request hash table of the prompts file the results were sent with
+
+    Returns:
+        Mapping of custom_ids to response lines, including failed results
+    """
+    response_path = get_response_path(jsonl_path)
+    if not os.path.isfile(response_path):
+        return {}
+    current_ids = _get_current_ids(pl.read_parquet(get_request_hashes_path(jsonl_path)), previous_hashes)
+    return {
+        custom_id: line for custom_id, line in load_all_responses([response_path]).items() if custom_id in current_ids
+    }
+
+
+def prepare_pending_file(
+    jsonl_path: str,
+    previous_hashes: Optional[pl.DataFrame],
+    cache: Optional[EvalCache] = None,
+    ids: Optional[Set[str]] = None,
+) -> Optional[str]:
+    """
+    Find the evaluation prompts without an up-to-date result, and write them to a file to send.
+
+    Results in the response file whose request changed, or that have no valid score, are
+    dropped from it, so the response file only has results of the current requests. Cached
+    results of the other prompts are added to the response file. Of identical requests only
+    one is sent, merge_pending_responses copies its result to the others.
+
+    Args:
+        jsonl_path: Path to the evaluation prompts file, with its request hash table written
+        previous_hashes: Request hash table of the prompts file the results were sent with
+        cache: Evaluator results of other experiments
+        ids: custom_ids of the prompts to send if they have no result, all prompts when None
+
+    Returns:
+        Path to the file to send: the prompts file when no result is kept and all prompts are
+        different, the pending file otherwise, and None when all prompts have an up-to-date result
+    """
+    hashes = pl.read_parquet(get_request_hashes_path(jsonl_path))
+    response_path = get_response_path(jsonl_path)
+
+    current_ids = _get_current_ids(hashes, previous_hashes)
+    responses: Dict[str, str] = {}
+    if os.path.isfile(response_path):
+        responses = load_all_responses([response_path])
+    kept = {
+        custom_id: line
+        for custom_id, line in responses.items()
+        if custom_id in current_ids and has_valid_score(json.loads(line))
+    }
+    if len(kept) < len(responses):
+        logger.info(f"Dropping {len(responses) - len(kept)} outdated or failed results from {response_path}")
+    elif not responses and len(current_ids) < hashes.height:
+        # A batch of the outdated requests may still be in flight, don't resume it
+        invalidate_outputs([response_path])
+
+    # Results of the same requests in other experiments
+    cached: Dict[str, str] = {}
+    if cache is not None:
+        missing = {
+            custom_id: request_hash
+            for custom_id, request_hash in hashes.select("custom_id", "request_hash").iter_rows()
+            if custom_id not in kept
+        }
+        cached = cache.lookup(missing)
+        if missing:
+            print(
+                f"Evaluator cache: {len(cached)} of {len(missing)} evaluation prompts cached "
+                f"({len(cached) / len(missing):.0%} hit rate)"
+            )
+
+    if len(kept) < len(responses) or cached:
+        kept = {**kept, **cached}
+        if kept:
+            write_responses(kept, response_path)
+        else:
+            os.remove(response_path)
+
+    # Identical prompts, e.g. of identical responses, are only sent once. The last one is sent,
+    # as the prompt mapping of Vertex AI requests maps a prompt text to its last custom_id.
+    pending = hashes.filter(pl.col("custom_id").is_in(pl.Series(list(kept), dtype=pl.Utf8)).not_())
+    if ids is not None:
+        pending = pending.filter(pl.col("custom_id").is_in(pl.Series(list(ids), dtype=pl.Utf8)))
+    unique_pending = pending.unique(subset="request_hash", keep="last", maintain_order=True)
+    saved_calls = pending.height - unique_pending.height
+    if pending.height == 0:
+        if ids is None:
+            print(f"All {hashes.height} evaluation prompts in {jsonl_path} have up-to-date results")
+        return None
+    if saved_calls:
+        print(
+            f"Sending {unique_pending.height} unique evaluation prompts of {pending.height}, {saved_calls} calls saved"
+        )
+    if unique_pending.height == hashes.height:
+        return jsonl_path
+
+    pending_path = get_pending_path(jsonl_path)
+    os.makedirs(os.path.dirname(pending_path), exist_ok=True)
+    previous_pending = hash_file(pending_path)
+    write_attempt_file(load_requests(jsonl_path), unique_pending["custom_id"].to_list(), pending_path, jsonl_path)
+    if previous_pending and previous_pending != hash_file(pending_path):
+        # A batch of an older pending file may still be in flight, don't resume it
+        invalidate_outputs([get_response_path(pending_path)])
+
+    print(f"Kept {len(kept)} up-to-date evaluation results, {unique_pending.height} prompts to send in {pending_path}")
+    return pending_path
+
+
+def get_eval_score(response_line: str) -> int:
+    """Get the score of an eval response line, -1 when it failed or has no score summaries can read."""
+    response = json.loads(response_line)
+    return -1 if is_failed_response(response) else extract_score(response.get("content"))
+
+
+def find_undecided_evals(first_stage: List[Tuple[str, Optional[pl.DataFrame]]]) -> Set[str]:
+    """
+    Find the evaluations the first stage evaluators of a staged evaluation don't agree on.
+
+    When a majority of all evaluators gives the same valid score, the other evaluators can't
+    change the majority vote of summarize_results.calculate_final_score. So only evaluations
+    where a first stage evaluator has no valid score, or where their scores differ, need the
+    other evaluators.
+
+    Args:
+        first_stage: The evaluation prompts file of each first stage evaluator, with the request
+            hash table of its prompts file when its results were sent
+
+    Returns:
+        custom_ids of the evaluations with a result of every first stage evaluator, but not the
+        same valid score. Evaluations still waiting for a first stage result are left out.
+    """
+    results = [load_current_results(jsonl_path, previous_hashes) for jsonl_path, previous_hashes in first_stage]
+    if not results:
+        return set()
+    undecided = set()
+    for custom_id in set.intersection(*(set(evaluator_results) for evaluator_results in results)):
+        scores = {get_eval_score(evaluator_results[custom_id]) for evaluator_results in results}
+        if -1 in scores or len(scores) > 1:
+            undecided.add(custom_id)
+    return undecided
+
+
+def update_eval_cache(jsonl_path: str, cache: EvalCache) -> int:
+    """
+    Add the valid results of an evaluation prompts file to the evaluator cache.
+
+    Args:
+        jsonl_path: Path to the evaluation prompts file, with its request hash table written
+
+    Returns:
+        Number of results added to the cache
+    """
+    response_path = get_response_path(jsonl_path)
+    hashes = read_request_hashes(jsonl_path)
+    if hashes is None or not os.path.isfile(response_path):
+        return 0
+
+    # The response file only has results of the current requests, see prepare_pending_file
+    request_hashes = dict(hashes.select("custom_id", "request_hash").iter_rows())
+    results = {
+        request_hashes[custom_id]: line
+        for custom_id, line in load_all_responses([response_path]).items()
+        if custom_id in request_hashes and has_valid_score(json.loads(line))
+    }
+    return cache.add(results)
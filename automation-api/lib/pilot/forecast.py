@@ -0,0 +1,276 @@
+"""
+Forecast the input tokens, cost and batch shards of prompt files before sending them.
+
+Token counts use the o200k_base tiktoken encoding for every model, so they are estimates
+for models with other tokenizers. Prices come from the price list bundled with litellm.
+"""
+
+import importlib.util
+import json
+import math
+import os
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from lib.app_singleton import AppSingleton
+from lib.pilot.batchjob.utils import get_request_num_samples
+from lib.pilot.gm_eval.utils import get_model_id_from_config_id, get_provider_method_from_model_id
+from lib.pilot.jsonl_io import open_jsonl
+
+logger = AppSingleton().get_logger()
+
+TOKEN_ENCODING = "o200k_base"
+
+# Rough characters per token, used when tiktoken is not available
+CHARS_PER_TOKEN = 4
+
+# Batch APIs of these providers cost half of the regular price when no batch price is listed
+BATCH_DISCOUNT = 0.5
+
+
+class BatchLimits(NamedTuple):
+    """Limits of one batch of a provider's batch API. None means no limit."""
+
+    max_requests: Optional[int]
+    max_bytes: Optional[int]
+
+
+# Limits of a single batch by provider method, LiteLLM sends requests one by one and has none
+BATCH_LIMITS: Dict[str, BatchLimits] = {
+    "openai": BatchLimits(max_requests=50_000, max_bytes=200 * 1024 * 1024),
+    "anthropic": BatchLimits(max_requests=100_000, max_bytes=256 * 1024 * 1024),
+    "mistral": BatchLimits(max_requests=1_000_000, max_bytes=None),
+    "vertex": BatchLimits(max_requests=200_000, max_bytes=None),
+}
+
+# Request parameters giving the maximum number of output tokens, by JSONL format
+MAX_OUTPUT_TOKENS_KEYS = ["max_completion_tokens", "max_tokens", "maxOutputTokens", "max_output_tokens"]
+
+
+class Forecast(NamedTuple):
+    """Token, cost and shard forecast of a prompt file."""
+
+    path: str
+    num_requests: int
+    num_bytes: int
+    total_tokens: int
+    min_tokens: int
+    mean_tokens: float
+    p95_tokens: int
+    max_tokens: int
+    max_output_tokens: Optional[int]
+    input_cost: Optional[float]
+    max_output_cost: Optional[float]
+    num_shards: int
+    shard_size: int
+
+
+def get_request_text(request: Dict[str, Any]) -> str:
+    """Get the prompt text of an OpenAI, Mistral or Vertex AI batch request."""
+    if "request" in request:  # Vertex format
+        contents = request["request"]["contents"]
+        return "\n".join(part.get("text", "") for content in contents for part in content["parts"])
+    texts = []
+    for message in request["body"]["messages"]:
+        content = message["content"]
+        if isinstance(content, list):  # Content blocks, e.g. with prompt cache markers
+            texts.append("".join(block.get("text", "") for block in content))
+        else:
+            texts.append(str(content))
+    return "\n".join(texts)
+
+
+def get_max_output_tokens(request: Dict[str, Any]) -> Optional[int]:
+    """Get the maximum number of output tokens set in a request, if any."""
+    if "request" in request:  # Vertex format
+        params = request["request"].get("generationConfig") or {}
+    else:
+        params = request["body"]
+    for key in MAX_OUTPUT_TOKENS_KEYS:
+        if params.get(key) is not None:
+            return int(params[key])
+    return None
+
+
+def count_tokens(texts: List[str], num_threads: Optional[int] = None) -> List[int]:
+    """
+    Count the tokens of texts with tiktoken, encoding them in parallel threads.
+
+    Falls back to a characters based estimate when tiktoken or its encoding is not available.
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        return [math.ceil(len(text) / CHARS_PER_TOKEN) for text in texts]
+    tokens = encoding.encode_ordinary_batch(texts, num_threads=num_threads or os.cpu_count() or 1)
+    return [len(x) for x in tokens]
+
+
+@lru_cache
+def _get_encoding() -> Any:
+    # litellm bundles the tiktoken encodings, use them instead of downloading
+    litellm_spec = importlib.util.find_spec("litellm")
+    if litellm_spec is not None and litellm_spec.submodule_search_locations:
+        bundled = os.path.join(litellm_spec.submodule_search_locations[0], "litellm_core_utils", "tokenizers")
+        os.environ.setdefault("TIKTOKEN_CACHE_DIR", bundled)
+
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        logger.warning(f"tiktoken is not available ({e}), estimating {CHARS_PER_TOKEN} characters per token")
+        return None
+
+
+@lru_cache
+def _load_model_prices() -> Dict[str, Dict[str, Any]]:
+    # Read litellm's bundled price list directly, importing litellm is slow and fetches prices online
+    litellm_spec = importlib.util.find_spec("litellm")
+    if litellm_spec is None or not litellm_spec.submodule_search_locations:
+        return {}
+    path = os.path.join(litellm_spec.submodule_search_locations[0], "model_prices_and_context_window_backup.json")
+    if not os.path.isfile(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_token_prices(model_id: str, mode: str = "batch") -> Optional[Dict[str, float]]:
+    """
+    Get the input and output price per token of a model.
+
+    Args:
+        model_id: Model ID, with or without provider prefix
+        mode: "batch" applies the batch price, or the batch discount when no batch price is listed
+
+    Returns:
+        Dictionary with input and output prices, or None if the model has no listed price
+    """
+    prices = _load_model_prices()
+    candidates = [model_id, model_id.split("/", 1)[-1], model_id.split("/")[-1]]
+    info = next((prices[c] for c in candidates if c in prices), None)
+    if info is None or info.get("input_cost_per_token") is None:
+        return None
+
+    input_price = info["input_cost_per_token"]
+    output_price = info.get("output_cost_per_token") or 0.0
+    if mode == "batch":
+        input_price = info.get("input_cost_per_token_batches") or input_price * BATCH_DISCOUNT
+        output_price = info.get("output_cost_per_token_batches") or output_price * BATCH_DISCOUNT
+    return {"input": input_price, "output": output_price}
+
+
+def recommend_shards(num_requests: int, num_bytes: int, limits: Optional[BatchLimits]) -> int:
+    """Get the number of batches needed to send a prompt file within the batch limits of a provider."""
+    if limits is None or num_requests == 0:
+        return 1
+    shards = 1
+    if limits.max_requests:
+        shards = max(shards, math.ceil(num_requests / limits.max_requests))
+    if limits.max_bytes:
+        shards = max(shards, math.ceil(num_bytes / limits.max_bytes))
+    return shards
+
+
+def forecast_file(path: str, model_id: Optional[str] = None, method: str = "openai", mode: str = "batch") -> Forecast:
+    """
+    Forecast the tokens, cost and batch shards of a prompt file.
+
+    Args:
+        path: Path to the JSONL prompt file
+        model_id: Model ID used to look up prices, no cost is forecast without it
+        method: Provider method the file is sent with, for the batch limits
+        mode: Processing mode, "batch" or "litellm"
+
+    Returns:
+        Forecast of the file
+    """
+    texts = []
+    max_output_tokens = []
+    num_samples = []
+    num_bytes = 0
+    with open_jsonl(path) as f:
+        for line in f:
+            num_bytes += len(line.encode("utf-8"))
+            request = json.loads(line)
+            texts.append(get_request_text(request))
+            max_output_tokens.append(get_max_output_tokens(request))
+            num_samples.append(get_request_num_samples(request))
+
+    tokens = sorted(count_tokens(texts))
+    total_tokens = sum(tokens)
+    output_limits = [x for x in max_output_tokens if x is not None]
+    # Requests for several samples (n, candidateCount) get up to the max tokens for each sample
+    sample_output_limits = [x * n for x, n in zip(max_output_tokens, num_samples) if x is not None]
+    total_output_limit = sum(sample_output_limits) if sample_output_limits else None
+
+    input_cost = max_output_cost = None
+    prices = get_token_prices(model_id, mode) if model_id else None
+    if prices is not None:
+        input_cost = total_tokens * prices["input"]
+        if total_output_limit is not None:
+            max_output_cost = total_output_limit * prices["output"]
+
+    limits = BATCH_LIMITS.get(method) if mode == "batch" else None
+    num_shards = recommend_shards(len(tokens), num_bytes, limits)
+
+    return Forecast(
+        path=path,
+        num_requests=len(tokens),
+        num_bytes=num_bytes,
+        total_tokens=total_tokens,
+        min_tokens=tokens[0] if tokens else 0,
+        mean_tokens=total_tokens / len(tokens) if tokens else 0.0,
+        p95_tokens=tokens[min(len(tokens) - 1, int(len(tokens) * 0.95))] if tokens else 0,
+        max_tokens=tokens[-1] if tokens else 0,
+        max_output_tokens=max(output_limits) if output_limits else None,
+        input_cost=input_cost,
+        max_output_cost=max_output_cost,
+        num_shards=num_shards,
+        shard_size=math.ceil(len(tokens) / num_shards) if tokens else 0,
+    )
+
+
+def format_forecast(forecast: Forecast, model_id: Optional[str] = None) -> str:
+    """Format a forecast as a short human readable report."""
+    lines = [
+        f"Forecast for {forecast.path}" + (f" ({model_id})" if model_id else ""),
+        f"  requests: {forecast.num_requests:,} ({forecast.num_bytes / 1024 / 1024:.1f} MB)",
+        f"  input tokens: {forecast.total_tokens:,} total, per request min {forecast.min_tokens:,} / "
+        f"mean {forecast.mean_tokens:,.0f} / p95 {forecast.p95_tokens:,} / max {forecast.max_tokens:,}",
+    ]
+    if forecast.input_cost is None:
+        lines.append("  cost: unknown, no price listed for the model")
+    else:
+        cost = f"  cost: ${forecast.input_cost:,.2f} input"
+        if forecast.max_output_cost is not None:
+            cost += f", up to ${forecast.max_output_cost:,.2f} output (max {forecast.max_output_tokens:,} tokens)"
+        lines.append(cost)
+    if forecast.num_shards > 1:
+        lines.append(
+            f"  shards: {forecast.num_shards} batches of up to {forecast.shard_size:,} requests "
+            "to stay within the provider's batch limits"
+        )
+    else:
+        lines.append("  shards: fits in a single batch")
+    return "\n".join(lines)
+
+
+def forecast_model_config(jsonl_path: str, model_config_id: str, mode: Optional[str] = None) -> Forecast:
+    """
+    Forecast a prompt file of a model configuration, using the model's prices and provider batch limits.
+
+    Args:
+        jsonl_path: Path to the JSONL prompt file, in the experiment directory
+        model_config_id: Model configuration ID of the prompts
+        mode: Processing mode, "batch" (default) or "litellm"
+
+    Returns:
+        Forecast of the file
+    """
+    mode = mode or "batch"
+    full_model_id = get_model_id_from_config_id(jsonl_path, model_config_id, keep_provider_prefix=True)
+    method = "litellm" if mode == "litellm" or not full_model_id else get_provider_method_from_model_id(full_model_id)
+    forecast = forecast_file(jsonl_path, full_model_id, method, mode)
+    print(format_forecast(forecast, full_model_id))
+    return forecast
@@ -1,15 +1,57 @@
 import argparse
 import json
 import logging
+import multiprocessing
 import os
+import string
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from enum import Enum
-from typing import Dict, List, Tuple
+from itertools import islice, repeat
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Union
 
 import polars as pl
 
 from lib.app_singleton import AppSingleton
-from lib.pilot.gm_eval.utils import transform_model_id
-from lib.pilot.send_batch_prompt import process_batch
+from lib.pilot.batchjob.base import BaseBatchJob
+from lib.pilot.custom_ids import (
+    LOOKUP_SCHEMA,
+    REPEAT_SEPARATOR,
+    build_eval_lookup,
+    get_lookup_path,
+    load_lookup,
+    split_readable_id_column,
+    split_repeat_id_columns,
+)
+from lib.pilot.eval_cache import EvalCache
+from lib.pilot.eval_updates import (
+    REQUEST_HASHES_SCHEMA,
+    find_undecided_evals,
+    get_request_hashes_path,
+    hash_prompts,
+    hash_requests,
+    merge_pending_responses,
+    prepare_pending_file,
+    read_request_hashes,
+    update_eval_cache,
+)
+from lib.pilot.forecast import MAX_OUTPUT_TOKENS_KEYS, count_tokens
+from lib.pilot.generate_prompts import (
+    DEFAULT_CHUNK_SIZE,
+    PROMPT_FIELDS,
+    build_mistral_request,
+    build_openai_request,
+    build_vertex_request,
+    filter_language,
+    render_template,
+)
+from lib.pilot.gm_eval.utils import extract_language_from_filename, get_response_path, transform_model_id
+from lib.pilot.jsonl_io import open_jsonl, split_jsonl_extension
+from lib.pilot.parquet_io import ParquetChunkWriter
+from lib.pilot.request_renderer import RequestRenderer
+from lib.pilot.send_batch_prompt import create_batch_job, process_batches
+from lib.pilot.summarize_results import GRADE_FIELD, GRADE_SCORES
 
 
 class JsonlFormat(Enum):
@@ -18,6 +60,41 @@ class JsonlFormat(Enum):
     MISTRAL = "mistral"
 
 
+# Columns of the responses read from a response file
+RESPONSE_SCHEMA = {"custom_id": pl.Utf8, "content": pl.Utf8}
+
+# Columns of the responses spilled to disk to read them sorted by question
+RESPONSE_SPILL_SCHEMA = {**RESPONSE_SCHEMA, "question_index": pl.UInt32, "line_index": pl.UInt32}
+
+# Columns of a prompt row split into a cacheable prefix and the rest, which starts with the evaluated response
+CACHED_PROMPT_FIELDS = ["prompt_id", "prompt_prefix", "prompt_suffix"]
+
+# Anthropic doesn't cache prompt prefixes shorter than this (2048 tokens for Haiku models)
+MIN_CACHED_PREFIX_TOKENS = 1024
+
+# Columns available as fields in evaluation prompt templates
+EVAL_TEMPLATE_FIELDS = [
+    "raw_output",
+    "question_text",
+    "option_a",
+    "option_a_correctness",
+    "option_b",
+    "option_b_correctness",
+    "option_c",
+    "option_c_correctness",
+]
+
+# Output token limit of structured-output evaluators, the JSON grade takes less than 10 tokens
+STRUCTURED_OUTPUT_MAX_TOKENS = 32
+
+# JSON schema of the responses of structured-output evaluators
+GRADE_SCHEMA = {
+    "type": "object",
+    "properties": {GRADE_FIELD: {"type": "string", "enum": list(GRADE_SCORES)}},
+    "required": [GRADE_FIELD],
+    "additionalProperties": False,
+}
+
 logger = AppSingleton().get_logger()
 logger.setLevel(logging.DEBUG)
 
@@ -106,7 +183,7 @@ def combine_questions_with_options_and_correctness(
         column_mapping[f"correctness_of_answer_option_{letter}"] = f"option_{letter.lower()}_correctness"
 
     # Join with questions dataframe and rename columns
-    combined = questions.join(options_pivot, on=["question_id", "language"], how="inner").rename(
+    combined = questions.join(options_pivot, on=["question_id", "language"], how="inner", maintain_order="left").rename(
         {"published_version_of_question": "question_text", **column_mapping}
     )
 
@@ -125,148 +202,518 @@ def combine_questions_with_options_and_correctness(
     )
 
 
-def read_responses(response_file: str) -> Dict[str, str]:
+def read_response_chunks(response_file: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pl.DataFrame]:
     """
-    Read response JSONL file and extract responses with their IDs.
+    Read a response JSONL file a chunk of lines at a time.
 
     Args:
         response_file: Path to response JSONL file
+        chunk_size: Number of lines per chunk
 
     Returns:
-        Dictionary mapping question_prompt_ids to response texts
+        Iterator of DataFrames with columns [custom_id, content] in the order of the file,
+        without responses that have no content
     """
-    responses = {}
-    with open(response_file, "r", encoding="utf-8") as f:
-        for line in f:
-            data = json.loads(line)
-            content = data.get("content")
-            if content is None:
-                logger.debug(f"empty content: {line}")
-                continue
+    with open_jsonl(response_file) as f:
+        while lines := list(islice(f, chunk_size)):
+            custom_ids = []
+            contents = []
+            for line in lines:
+                data = json.loads(line)
+                content = data.get("content")
+                if content is None:
+                    logger.debug(f"empty content: {line}")
+                    continue
+
+                custom_ids.append(data.get("custom_id", ""))
+                contents.append(content)
+            yield pl.DataFrame({"custom_id": custom_ids, "content": contents}, schema=RESPONSE_SCHEMA)
+
+
+def read_responses(
+    response_file: str,
+    questions: pl.DataFrame,
+    spill_path: str,
+    id_lookup: Optional[pl.DataFrame] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[pl.DataFrame]:
+    """
+    Read the responses of a response file in chunks of whole questions, in the order of the questions.
 
-            custom_id = data.get("custom_id", "")
-            responses[custom_id] = content
+    The responses are spilled to a Parquet file sorted by question, which is read back a chunk
+    at a time, so only a few chunks of response texts are in memory even for large files.
 
-    return responses
+    Args:
+        response_file: Path to response JSONL file
+        questions: DataFrame with a question_id column, in the order to read the responses in
+        spill_path: Path to write the sorted responses to, removed by the caller
+        id_lookup: custom_id lookup table of the responses with compact custom_ids
+        chunk_size: Approximate number of responses per chunk
 
+    Returns:
+        Iterator of DataFrames with columns [custom_id, content], in the order of the file within
+        a question. All responses to a question are in the same chunk, responses to other questions
+        and without content are left out.
+    """
+    question_indexes = questions.select(pl.col("question_id").cast(pl.Utf8)).with_row_index("question_index")
+
+    # Spill the responses with the position of their question, and sort them by it out of memory
+    unsorted_path = f"{spill_path}.unsorted"
+    line_offset = 0
+    with ParquetChunkWriter(unsorted_path, RESPONSE_SPILL_SCHEMA) as writer:
+        for chunk in read_response_chunks(response_file, chunk_size):
+            chunk = chunk.with_row_index("line_index", offset=line_offset)
+            line_offset += chunk.height
+            writer.write(parse_response_ids(chunk, id_lookup).join(question_indexes, on="question_id", how="inner"))
+    pl.scan_parquet(unsorted_path).sort("question_index", "line_index").sink_parquet(spill_path)
+    os.remove(unsorted_path)
+
+    # Read the sorted responses back, moving the responses of the last question of a chunk to the next one
+    num_responses = pl.scan_parquet(spill_path).select(pl.len()).collect().item()
+    carried = pl.DataFrame(schema=RESPONSE_SPILL_SCHEMA)
+    for offset in range(0, num_responses, chunk_size):
+        chunk = pl.concat([carried, pl.scan_parquet(spill_path).slice(offset, chunk_size).collect()])
+        if offset + chunk_size < num_responses:
+            last_question = pl.col("question_index") == chunk["question_index"][-1]
+            carried = chunk.filter(last_question)
+            chunk = chunk.filter(~last_question)
+        if chunk.height > 0:
+            yield chunk.select(list(RESPONSE_SCHEMA))
+
+
+def parse_response_ids(responses: pl.DataFrame, id_lookup: Optional[pl.DataFrame] = None) -> pl.DataFrame:
+    """
+    Parse the custom_ids of responses into the question they answer.
 
-def generate_eval_prompts(
-    questions_data: pl.DataFrame,
-    responses: Dict[str, str],
-    metrics: pl.DataFrame,
-    output_path: str,
+    The question of a compact custom_id is looked up in the lookup table, readable custom_ids
+    are split into their parts, so a question is only matched by its own id and not by
+    question ids which contain it.
+
+    Args:
+        responses: DataFrame with columns [custom_id, content]
+        id_lookup: custom_id lookup table of the responses with compact custom_ids
+
+    Returns:
+        The responses with a question, with columns base_id (custom_id of the prompt), repeat_index
+        (null for custom_ids without one), question_id and compact (whether base_id is a compact id)
+    """
+    base_ids, repeat_indexes = split_repeat_id_columns(pl.col("custom_id"))
+    parsed = responses.with_columns(base_ids.alias("base_id"), repeat_indexes.alias("repeat_index"))
+
+    if id_lookup is None:
+        id_lookup = pl.DataFrame(schema=LOOKUP_SCHEMA)
+    parsed = parsed.join(
+        id_lookup.select(pl.col("custom_id").alias("base_id"), pl.col("question_id").alias("compact_question_id")),
+        on="base_id",
+        how="left",
+        maintain_order="left",
+    )
+
+    parts = split_readable_id_column(pl.col("base_id"))
+    parsed = parsed.with_columns(
+        pl.col("compact_question_id").is_not_null().alias("compact"),
+        pl.coalesce(
+            "compact_question_id", pl.when(parts.list.len() >= 3).then(parts.list.get(1, null_on_oob=True))
+        ).alias("question_id"),
+    )
+
+    unparsed = parsed.filter(pl.col("question_id").is_null())
+    for custom_id in unparsed["custom_id"]:
+        logger.debug(f"custom_id without question: {custom_id}")
+    return parsed.filter(pl.col("question_id").is_not_null()).drop("compact_question_id")
+
+
+def get_structured_output_parameters(
+    provider: str, format: JsonlFormat, model_parameters: dict, mode: str = "batch"
+) -> dict:
+    """
+    Add the parameters constraining an evaluator to answer with a JSON grade, see GRADE_SCHEMA.
+
+    Args:
+        provider: Provider of the evaluator from evaluators.csv
+        format: JSONL format of the evaluation prompts
+        model_parameters: Parameters of the evaluator, an output token limit set there only
+            applies when it is below STRUCTURED_OUTPUT_MAX_TOKENS
+        mode: Processing mode, "batch" or "litellm"
+
+    Returns:
+        The parameters of the evaluator with the structured output parameters
+    """
+    if format == JsonlFormat.VERTEX:
+        # Vertex AI takes an OpenAPI schema, without additionalProperties
+        structured = {
+            "responseMimeType": "application/json",
+            "responseSchema": {key: value for key, value in GRADE_SCHEMA.items() if key != "additionalProperties"},
+            "maxOutputTokens": STRUCTURED_OUTPUT_MAX_TOKENS,
+        }
+    elif provider == "anthropic" and mode != "litellm":
+        # The Anthropic batch API has no response format, a forced tool call gives the JSON
+        structured = {
+            "tools": [{"name": GRADE_FIELD, "description": "Record the grade", "input_schema": GRADE_SCHEMA}],
+            "tool_choice": {"type": "tool", "name": GRADE_FIELD},
+            "max_tokens": STRUCTURED_OUTPUT_MAX_TOKENS,
+        }
+    else:
+        # OpenAI reasoning models only take max_completion_tokens, LiteLLM translates max_tokens
+        max_tokens_key = "max_completion_tokens" if provider == "openai" and mode != "litellm" else "max_tokens"
+        structured = {
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": GRADE_FIELD, "strict": True, "schema": GRADE_SCHEMA},
+            },
+            max_tokens_key: STRUCTURED_OUTPUT_MAX_TOKENS,
+        }
+
+    # The limit goes in the key of the structured output parameters, whichever key the sheet used
+    max_tokens_key = next(key for key in structured if key in MAX_OUTPUT_TOKENS_KEYS)
+    limits = [model_parameters[key] for key in MAX_OUTPUT_TOKENS_KEYS if model_parameters.get(key) is not None]
+    structured[max_tokens_key] = min([STRUCTURED_OUTPUT_MAX_TOKENS, *limits])
+    parameters = {key: value for key, value in model_parameters.items() if key not in MAX_OUTPUT_TOKENS_KEYS}
+    return {**structured, **parameters}
+
+
+class EvalPromptFileSpec(NamedTuple):
+    """The evaluation prompts file of one evaluator."""
+
+    evaluator_id: str
+    jsonl_path: str
+    # Prompt mapping CSV, for formats whose requests have no custom_id (Vertex AI)
+    mapping_path: Optional[str]
+    build_request: Callable[[dict], dict]
+    # Builds requests from rows with CACHED_PROMPT_FIELDS, for evaluators with prompt cache markers
+    build_cached_request: Optional[Callable[[dict], dict]] = None
+
+
+def build_cached_openai_request(row: dict, model: str, model_parameters: dict) -> dict:
+    """
+    Build an OpenAI format request whose prompt prefix is marked for Anthropic prompt caching.
+
+    The prompt is split into two text blocks, the prefix shared by all responses to a question
+    with a cache_control marker, and the rest starting with the evaluated response.
+    """
+    request = build_openai_request({"prompt_id": row["prompt_id"], "prompt_text": ""}, model, model_parameters)
+    request["body"]["messages"][0]["content"] = [
+        {"type": "text", "text": row["prompt_prefix"], "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": row["prompt_suffix"]},
+    ]
+    return request
+
+
+def get_eval_prompt_file_spec(
+    jsonl_path: str,
+    evaluator_id: str,
     model: str,
     model_parameters: dict,
     format: JsonlFormat,
-) -> List[Tuple[str, str]]:
+    cache_markers: bool = False,
+) -> EvalPromptFileSpec:
     """
-    Generate evaluation prompts for each response and metric.
+    Describe the evaluation prompts file of an evaluator in the given JSONL format.
 
     Args:
-        questions_data: DataFrame with question and option data
-        responses: Dictionary of response texts keyed by question_prompt_id
-        metrics: DataFrame with evaluation metric templates
-        output_path: Path to save output JSONL file
+        jsonl_path: Path to save the evaluation prompts JSONL file
+        evaluator_id: Evaluator ID from evaluators.csv
         model: Model to use for evaluation
         model_parameters: parameters to the eval model
         format: json format to use
+        cache_markers: Mark the prompt prefix before the evaluated response for prompt
+            caching, only supported in the OpenAI format (used for Anthropic)
+    """
+    if format == JsonlFormat.OPENAI:
+        return EvalPromptFileSpec(
+            evaluator_id,
+            jsonl_path,
+            None,
+            lambda row: build_openai_request(row, model, model_parameters),
+            (lambda row: build_cached_openai_request(row, model, model_parameters)) if cache_markers else None,
+        )
+    elif format == JsonlFormat.MISTRAL:
+        return EvalPromptFileSpec(
+            evaluator_id, jsonl_path, None, lambda row: build_mistral_request(row, model_parameters)
+        )
+    else:  # Vertex format
+        mapping_path = f"{split_jsonl_extension(jsonl_path)[0]}-prompt-mapping.csv"
+        return EvalPromptFileSpec(
+            evaluator_id, jsonl_path, mapping_path, lambda row: build_vertex_request(row, model_parameters)
+        )
+
+
+def get_template_prefix(template: str, field: str = "raw_output") -> Optional[str]:
+    """
+    Get the part of a str.format template before the first use of a field.
+
+    Returns:
+        The template of the prefix, None when the template doesn't use the field
+    """
+    prefix = []
+    for literal, field_name, format_spec, conversion in string.Formatter().parse(template):
+        prefix.append(literal.replace("{", "{{").replace("}", "}}"))
+        if field_name == field:
+            return "".join(prefix)
+        if field_name is not None:
+            conversion_part = f"!{conversion}" if conversion else ""
+            format_part = f":{format_spec}" if format_spec else ""
+            prefix.append(f"{{{field_name}{conversion_part}{format_part}}}")
+    return None
+
+
+def get_cache_layout_template(template: str, field: str = "raw_output") -> str:
+    """
+    Reorder a str.format template so that the lines using a field come last.
+
+    Moving the evaluated response to the end of a metric prompt puts all static parts of it
+    (instructions, question and options) into the prefix the responses to a question share.
+
+    Returns:
+        The reordered template, the template itself when no line or every line uses the field
+    """
+    lines = template.rstrip("\n").split("\n")
+    uses_field = [any(name == field for _, name, _, _ in string.Formatter().parse(line)) for line in lines]
+    if not any(uses_field) or all(uses_field):
+        return template
+    static_lines = [line for line, uses in zip(lines, uses_field) if not uses]
+    field_lines = [line for line, uses in zip(lines, uses_field) if uses]
+    return "\n".join(static_lines + field_lines)
+
+
+def generate_eval_prompts(
+    questions_data: pl.DataFrame,
+    responses: Union[pl.DataFrame, Iterable[pl.DataFrame]],
+    metrics: pl.DataFrame,
+    specs: List[EvalPromptFileSpec],
+    id_lookup: Optional[pl.DataFrame] = None,
+    min_cached_prefix_tokens: int = MIN_CACHED_PREFIX_TOKENS,
+) -> int:
+    """
+    Generate evaluation prompts for each response and metric, for several evaluators in one pass.
+
+    The evaluation prompts are the same for every evaluator, so each prompt is rendered once
+    and written to the files of all evaluators. Responses are processed a chunk at a time, see
+    read_responses.
+
+    Evaluations of responses with compact custom_ids get compact custom_ids too, which are
+    saved with their parts in a lookup table next to each output file. The hashes of the
+    requests are saved next to each output file too, see eval_updates. Evaluations of repeated
+    samples keep the repeat index of the sample at the end of their custom_id.
+
+    For evaluators with prompt cache markers, the part of each prompt before the evaluated
+    response, which all responses to a question share, is sent as a separate cached block.
+    Prompts with an empty prefix or rest are sent whole, as providers reject empty blocks, and
+    so are prompts whose prefix is too short to be cached.
+
+    Args:
+        questions_data: DataFrame with question and option data
+        responses: DataFrame with columns [custom_id, content], or chunks of them with all responses
+            to a question in the same chunk
+        metrics: DataFrame with evaluation metric templates
+        specs: Evaluation prompts files of each evaluator
+        id_lookup: custom_id lookup table of the responses with compact custom_ids
+        min_cached_prefix_tokens: Minimum number of tokens of a prefix to mark it for caching
+
+    Returns:
+        Number of evaluation prompts written to each file
     """
-    prompt_id_mapping = []
-
-    with open(output_path, "w", encoding="utf-8") as f:
-        for metric_row in metrics.iter_rows(named=True):
-            prompt_template = metric_row["prompt"]
-            metric_id = metric_row["name"]
-
-            for question_row in questions_data.iter_rows(named=True):
-                question_id = question_row["question_id"]
-
-                # Get all responses for this question
-                question_responses = {
-                    prompt_id: text for prompt_id, text in responses.items() if f"-{question_id}-" in prompt_id
-                }
-
-                for prompt_id, response_text in question_responses.items():
-                    # Format the evaluation prompt
-                    eval_prompt = prompt_template.format(
-                        raw_output=response_text,
-                        question_text=question_row["question_text"],
-                        option_a=question_row["option_a"],
-                        option_a_correctness=question_row["option_a_correctness"],
-                        option_b=question_row["option_b"],
-                        option_b_correctness=question_row["option_b_correctness"],
-                        option_c=question_row["option_c"],
-                        option_c_correctness=question_row["option_c_correctness"],
+    if isinstance(responses, pl.DataFrame):
+        responses = [responses]
+    questions = questions_data.with_columns(pl.col("question_id").cast(pl.Utf8)).with_row_index("question_index")
+
+    count = 0
+    split_count = cached_count = 0
+    with ExitStack() as stack:
+        jsonl_files = [stack.enter_context(open_jsonl(spec.jsonl_path, "w")) for spec in specs]
+        mapping_files = [
+            stack.enter_context(open(spec.mapping_path, "w", encoding="utf-8")) if spec.mapping_path else None
+            for spec in specs
+        ]
+        hash_writers = [
+            stack.enter_context(ParquetChunkWriter(get_request_hashes_path(spec.jsonl_path), REQUEST_HASHES_SCHEMA))
+            for spec in specs
+        ]
+        # Lookup tables of the compact custom_ids of evaluations
+        lookup_writers = []
+        if id_lookup is not None:
+            lookup_writers = [
+                stack.enter_context(ParquetChunkWriter(get_lookup_path(spec.jsonl_path), LOOKUP_SCHEMA))
+                for spec in specs
+            ]
+        # Serialise the parts shared by all requests once, only the custom_id and prompt change per line
+        renderers = [RequestRenderer(spec.build_request, PROMPT_FIELDS) for spec in specs]
+        cached_renderers = [
+            RequestRenderer(spec.build_cached_request, CACHED_PROMPT_FIELDS) if spec.build_cached_request else None
+            for spec in specs
+        ]
+        envelopes = [
+            (cached_renderer or renderer).render(dict.fromkeys(PROMPT_FIELDS + CACHED_PROMPT_FIELDS, ""))
+            for renderer, cached_renderer in zip(renderers, cached_renderers)
+        ]
+        for mapping_file in mapping_files:
+            if mapping_file is not None:
+                mapping_file.write("prompt_id,prompt_text\n")
+
+        for chunk in responses:
+            # Retried responses replace the earlier ones with the same custom_id
+            chunk_responses = parse_response_ids(
+                chunk.unique(subset="custom_id", keep="last", maintain_order=True), id_lookup
+            ).with_row_index("response_index")
+
+            # Give the evaluations of responses with compact custom_ids compact ids too
+            eval_lookup = pl.DataFrame(
+                schema={"response_custom_id": pl.Utf8, "metric_id": pl.Utf8, "custom_id": pl.Utf8}
+            )
+            compact_responses = chunk_responses.filter(pl.col("compact"))
+            if compact_responses.height > 0 and id_lookup is not None:
+                response_lookup = id_lookup.filter(pl.col("custom_id").is_in(compact_responses["base_id"].unique()))
+                eval_lookup = build_eval_lookup(response_lookup, metrics["name"])
+                for lookup_writer in lookup_writers:
+                    lookup_writer.write(eval_lookup)
+
+            # One row for each response to a question, all responses of the first question come first
+            evaluated = (
+                chunk_responses.join(questions, on="question_id", how="inner")
+                .sort(["question_index", "response_index"])
+                .with_columns(pl.col("content").alias("raw_output"))
+            )
+
+            # The cross product of the responses and metrics, rendering each metric's template over the chunk
+            for metric_id, prompt_template in metrics.select(pl.col("name").cast(pl.Utf8), "prompt").iter_rows():
+                compact_ids = eval_lookup.filter(pl.col("metric_id") == metric_id).select(
+                    pl.col("response_custom_id").alias("base_id"), pl.col("custom_id").alias("compact_eval_id")
+                )
+                readable_id = pl.concat_str(["base_id", pl.lit(f"-{metric_id}")]).str.replace_all(
+                    "-question-", "-", literal=True
+                )
+                eval_id = pl.when(pl.col("compact")).then(pl.col("compact_eval_id")).otherwise(readable_id)
+                metric_responses = evaluated.join(compact_ids, on="base_id", how="left", maintain_order="left")
+                prompts = metric_responses.select(
+                    pl.when(pl.col("repeat_index").is_null())
+                    .then(eval_id)
+                    .otherwise(pl.concat_str([eval_id, pl.lit(REPEAT_SEPARATOR), pl.col("repeat_index").cast(pl.Utf8)]))
+                    .alias("prompt_id"),
+                    render_template(prompt_template, metric_responses, EVAL_TEMPLATE_FIELDS).alias("prompt_text"),
+                )
+
+                # Readable custom_ids: anthropic expects custom ids less than 64 chars.
+                # Generate the prompts with compact ids to avoid it.
+                if (prompts["prompt_id"].str.len_chars() > 64).any():
+                    raise ValueError("custom_id too long, generate the prompts with --compact-ids")
+
+                # Split the prompts before the evaluated response for evaluators with prompt cache markers
+                prefix_template = get_template_prefix(prompt_template)
+                split = False
+                if prefix_template is not None and any(cached_renderers):
+                    split = True
+                    prefixes = render_template(prefix_template, metric_responses, EVAL_TEMPLATE_FIELDS)
+                    prompts = prompts.with_columns(
+                        prefixes.alias("prompt_prefix"),
+                        pl.col("prompt_text").str.slice(prefixes.str.len_chars()).alias("prompt_suffix"),
                     )
+                    # The responses to a question share their prefix, count the tokens of each prefix once
+                    unique_prefixes = prompts["prompt_prefix"].unique()
+                    prefix_tokens = pl.DataFrame(
+                        {"prompt_prefix": unique_prefixes, "prefix_tokens": count_tokens(unique_prefixes.to_list())}
+                    )
+                    prompts = prompts.join(prefix_tokens, on="prompt_prefix", how="left", maintain_order="left")
+                    prompts = prompts.with_columns(
+                        (
+                            (pl.col("prompt_prefix") != "")
+                            & (pl.col("prompt_suffix") != "")
+                            & (pl.col("prefix_tokens") >= min_cached_prefix_tokens)
+                        ).alias("cached")
+                    )
+                    split_count += prompts.height
+                    cached_count += int(prompts["cached"].sum())
+
+                # Write the rendered prompts to the files of all evaluators, with the hashes of their requests
+                rows = prompts.to_dicts()
+                prompt_hashes = hash_prompts(prompts["prompt_text"])
+                for renderer, cached_renderer, envelope, jsonl_file, mapping_file, hash_writer in zip(
+                    renderers, cached_renderers, envelopes, jsonl_files, mapping_files, hash_writers
+                ):
+                    if split and cached_renderer is not None:
+                        lines = (cached_renderer.render(row) if row["cached"] else renderer.render(row) for row in rows)
+                    else:
+                        lines = (renderer.render(row) for row in rows)
+                    jsonl_file.writelines(f"{line}\n" for line in lines)
+                    if mapping_file is not None:
+                        prompts.select(PROMPT_FIELDS).write_csv(mapping_file, include_header=False)
+                    hash_writer.write(
+                        pl.DataFrame(
+                            {"custom_id": prompts["prompt_id"], "request_hash": hash_requests(envelope, prompt_hashes)},
+                            schema=REQUEST_HASHES_SCHEMA,
+                        )
+                    )
+                count += prompts.height
+
+    if split_count > 0:
+        print(
+            f"Prompt caching: {cached_count} of {split_count} evaluation prompts have a prefix of at least "
+            f"{min_cached_prefix_tokens} tokens and are marked for caching"
+        )
+    return count
+
+
+def get_eval_prompts_path(base_path: str, response_file: str, evaluator_id: str) -> str:
+    """
+    Get the path of the evaluation prompts file for a response file and evaluator.
+
+    Args:
+        base_path: Base directory of the experiment
+        response_file: Path to response JSONL file
+        evaluator_id: Evaluator ID from evaluators.csv
+
+    Returns:
+        Path to the evaluation prompts JSONL file, compressed like the response file
+    """
+    response_basename, ext = split_jsonl_extension(os.path.basename(response_file))
+    evaluator_name = evaluator_id.split("/")[-1].replace(".", "-")
+    return os.path.join(base_path, f"{response_basename}-eval-prompts-{evaluator_name}{ext}")
+
+
+class EvalPromptFile(NamedTuple):
+    """An evaluation prompts file and how to send it."""
+
+    path: str
+    method: str
+    model_id: str
+    # File with the prompts that have no up-to-date result, None when all have one
+    send_path: Optional[str]
+    # False for the evaluators of a staged evaluation which only get undecided evaluations
+    first_stage: bool = True
+
+
+def write_eval_prompt_files(
+    base_path: str,
+    response_file: str,
+    mode: str = "batch",
+    eval_cache: Optional[str] = None,
+    prompt_caching: bool = False,
+    staged: bool = False,
+    structured_output: bool = False,
+) -> List[EvalPromptFile]:
+    """
+    Write the evaluation prompts of a response file for each evaluator.
+
+    Responses of a language shard are only evaluated against the questions of its language.
+    Results of earlier runs are kept when their requests didn't change, and only the other
+    prompts are sent, see eval_updates.
+
+    In a staged evaluation, the first evaluators in evaluators.csv, a majority of them, form
+    the first stage. The other evaluators only get the evaluations the first stage evaluators
+    have results for but don't agree on, which gives the same majority votes as sending all.
+
+    Args:
+        base_path: Base directory containing ai_eval_sheets folder
+        response_file: Path to response JSONL file
+        mode: Processing mode, "batch" or "litellm"
+        eval_cache: Folder of the evaluator cache shared by experiments, None to not use one
+        prompt_caching: Put the evaluated response at the end of the metric prompts, and mark the
+            prefix shared by the responses to a question for prompt caching for Anthropic evaluators
+        staged: Only send the evaluations the first stage evaluators don't agree on to the others
+        structured_output: Constrain the evaluators to answer with a JSON grade
 
-                    # FIXME: anthropic expect custom id less than 64 chars.
-                    # We should just update the generate_prompt.py to use shorter
-                    # custom_id and no need to do it here.
-                    custom_id = f"{prompt_id}-{metric_id}".replace("-question-", "-")
-                    if len(custom_id) > 64:
-                        raise ValueError("custom_id too long")
-                    prompt_id_mapping.append((custom_id, eval_prompt))
-
-                    if format == JsonlFormat.OPENAI:
-                        # Create evaluation request object for OpenAI
-                        eval_request = {
-                            "model": model,
-                            "messages": [{"role": "user", "content": eval_prompt}],
-                            **model_parameters,
-                        }
-
-                        # Create the full request object with custom ID
-                        request_obj = {
-                            "custom_id": custom_id,
-                            "method": "POST",
-                            "url": "/v1/chat/completions",
-                            "body": eval_request,
-                        }
-                    elif format == JsonlFormat.MISTRAL:
-                        # Create evaluation request object for Mistral
-                        request_obj = {
-                            "custom_id": custom_id,
-                            "body": {"messages": [{"role": "user", "content": eval_prompt}], **model_parameters},
-                        }
-                    else:  # Vertex format
-                        request_obj = {
-                            "request": {
-                                "contents": [
-                                    {
-                                        "role": "user",
-                                        "parts": [{"text": eval_prompt}],
-                                    }
-                                ],
-                                "generationConfig": model_parameters,
-                                "safety_settings": [
-                                    {
-                                        "category": "HARM_CATEGORY_HARASSMENT",
-                                        "threshold": "BLOCK_ONLY_HIGH",
-                                    },
-                                    {
-                                        "category": "HARM_CATEGORY_HATE_SPEECH",
-                                        "threshold": "BLOCK_ONLY_HIGH",
-                                    },
-                                    {
-                                        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                                        "threshold": "BLOCK_ONLY_HIGH",
-                                    },
-                                    {
-                                        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                                        "threshold": "BLOCK_ONLY_HIGH",
-                                    },
-                                ],
-                            }
-                        }
-
-                    # Write to output file
-                    json_line = json.dumps(request_obj, ensure_ascii=False)
-                    f.write(f"{json_line}\n")
-
-    return prompt_id_mapping
-
-
-def main(base_path, response_file, send, wait, mode="batch"):
+    Returns:
+        The evaluation prompts file of each evaluator
+    """
     # Construct input paths
     sheets_dir = os.path.join(base_path, "ai_eval_sheets")
     questions_path = os.path.join(sheets_dir, "questions.csv")
@@ -274,24 +721,26 @@ def main(base_path, response_file, send, wait, mode="batch"):
     metrics_path = os.path.join(sheets_dir, "metrics.csv")
     evaluators_path = os.path.join(sheets_dir, "evaluators.csv")
 
-    # Read input files
-    questions = pl.read_csv(questions_path)
-    question_options = pl.read_csv(question_options_path)
+    # Read input files, keeping the questions of the language of a shard
+    language = extract_language_from_filename(response_file)
+    questions = filter_language(pl.read_csv(questions_path), language)
+    question_options = filter_language(pl.read_csv(question_options_path), language)
     metrics = pl.read_csv(metrics_path)
     evaluators = pl.read_csv(evaluators_path)
+    if prompt_caching:
+        metrics = metrics.with_columns(pl.col("prompt").map_elements(get_cache_layout_template, return_dtype=pl.Utf8))
 
     # Combine questions with options and correctness
     combined_questions = combine_questions_with_options_and_correctness(questions, question_options)
 
-    # Read responses
-    responses = read_responses(response_file)
+    # The lookup table of compact custom_ids, if the prompts have one
+    id_lookup = load_lookup(base_path)
 
-    # Generate prompts for each evaluator
+    specs = []
+    methods = []
     for evaluator in evaluators.iter_rows(named=True):
         # Generate output path based on response file and evaluator
-        response_basename = os.path.splitext(os.path.basename(response_file))[0]
-        evaluator_id = evaluator["evaluator_id"].split("/")[-1].replace(".", "-")
-        output_path = os.path.join(base_path, f"{response_basename}-eval-prompts-{evaluator_id}.jsonl")
+        output_path = get_eval_prompts_path(base_path, response_file, evaluator["evaluator_id"])
         model_parameters = json.loads(evaluator["parameters"])
 
         # Override JSONL format for litellm mode
@@ -299,51 +748,168 @@ def main(base_path, response_file, send, wait, mode="batch"):
             jsonl_format = JsonlFormat.OPENAI
         else:
             jsonl_format = JsonlFormat(evaluator["jsonl_format"])
+        if structured_output:
+            model_parameters = get_structured_output_parameters(
+                evaluator["provider"], jsonl_format, model_parameters, mode
+            )
 
         # Transform model ID based on mode
         model_id = transform_model_id(evaluator["evaluator_id"], mode=mode)
-
-        # Generate evaluation prompts
-        prompt_id_mapping = generate_eval_prompts(
-            combined_questions,
-            responses,
-            metrics,
-            output_path,
-            model=model_id,
-            model_parameters=model_parameters,
-            format=jsonl_format,
+        # Other providers cache prompt prefixes without markers
+        cache_markers = prompt_caching and evaluator["provider"] == "anthropic"
+        specs.append(
+            get_eval_prompt_file_spec(
+                output_path, evaluator["evaluator_id"], model_id, model_parameters, jsonl_format, cache_markers
+            )
         )
 
-        print(f"Generated evaluation prompts for {evaluator['evaluator_id']} in {output_path}")
+        # Override method for litellm mode
+        methods.append(("litellm" if mode == "litellm" else evaluator["provider"], model_id))
+
+    # Merge the results of earlier runs which were downloaded but not merged yet, and
+    # remember which requests they were sent with
+    cache = EvalCache(eval_cache) if eval_cache else None
+    previous_hashes = []
+    for spec in specs:
+        merge_pending_responses(spec.jsonl_path)
+        if cache is not None:
+            update_eval_cache(spec.jsonl_path, cache)
+        previous_hashes.append(read_request_hashes(spec.jsonl_path))
+
+    # Generate the evaluation prompts of all evaluators at once, reading the responses a chunk at a time
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(response_file) or ".") as spill_dir:
+        responses = read_responses(
+            response_file, combined_questions, os.path.join(spill_dir, "responses.parquet"), id_lookup
+        )
+        count = generate_eval_prompts(combined_questions, responses, metrics, specs, id_lookup=id_lookup)
+
+    # Decide which evaluations need the evaluators after the first stage, before failed
+    # results of the first stage are dropped from their response files
+    first_stage_size = len(specs) // 2 + 1 if staged else len(specs)
+    undecided = None
+    if first_stage_size < len(specs):
+        undecided = find_undecided_evals(
+            [(spec.jsonl_path, hashes) for spec, hashes in zip(specs, previous_hashes)][:first_stage_size]
+        )
 
-        # Save prompt ID mapping if using Vertex format
-        if jsonl_format == JsonlFormat.VERTEX:
-            mapping_df = pl.DataFrame(
-                {
-                    "prompt_id": [x[0] for x in prompt_id_mapping],
-                    "prompt_text": [x[1] for x in prompt_id_mapping],
-                }
+    eval_files = []
+    for index, (spec, (method, model_id), hashes) in enumerate(zip(specs, methods, previous_hashes)):
+        print(f"Generated {count} evaluation prompts for {spec.evaluator_id} in {spec.jsonl_path}")
+        if spec.mapping_path:
+            print(f"Generated prompt ID mapping in {spec.mapping_path}")
+        first_stage = index < first_stage_size
+        if first_stage:
+            send_path = prepare_pending_file(spec.jsonl_path, hashes, cache)
+        else:
+            print(f"Staged evaluation: {len(undecided or ())} of {count} evaluations need {spec.evaluator_id}")
+            send_path = prepare_pending_file(spec.jsonl_path, hashes, cache, undecided)
+        eval_files.append(EvalPromptFile(spec.jsonl_path, method, model_id, send_path, first_stage))
+
+    return eval_files
+
+
+def send_eval_files(
+    eval_files: List[EvalPromptFile], wait: bool, processes: int = 1, eval_cache: Optional[str] = None
+) -> None:
+    """Send the evaluation prompts files with prompts to send, and merge their downloaded results."""
+    # Batch jobs are collected so that all evaluators are sent together
+    batch_jobs: List[BaseBatchJob] = []
+    for eval_file in eval_files:
+        if eval_file.send_path is None:
+            continue
+        batch_jobs.append(
+            create_batch_job(
+                jsonl_file=eval_file.send_path,
+                method=eval_file.method,
+                processes=processes,
+                model_id=eval_file.model_id,
             )
-            mapping_path = output_path.replace(".jsonl", "-prompt-mapping.csv")
-            mapping_df.write_csv(mapping_path)
-            print(f"Generated prompt ID mapping in {mapping_path}")
-
-        # Send prompts immediately if requested
-        if send:
-            method = evaluator["provider"]
-
-            # Override method for litellm mode
-            if mode == "litellm":
-                method = "litellm"
-
-            # Process the batch
-            print(f"Sending prompts for {evaluator['evaluator_id']}...")
-            process_batch(
-                jsonl_file=output_path,
-                method=method,
-                model_id=model_id,
-                wait=wait,
+        )
+
+    # Send prompts for all evaluators at once, and wait for them together if requested
+    if batch_jobs:
+        print(f"Sending prompts for {len(batch_jobs)} evaluators...")
+        process_batches(batch_jobs, wait=wait, processes=processes)
+
+    # Merge the downloaded results of pending files into the eval response files
+    for eval_file in eval_files:
+        merge_pending_responses(eval_file.path)
+        if eval_cache:
+            update_eval_cache(eval_file.path, EvalCache(eval_cache))
+
+
+def main(
+    base_path,
+    response_file,
+    send,
+    wait,
+    mode="batch",
+    processes=1,
+    eval_cache=None,
+    prompt_caching=False,
+    staged=False,
+    structured_output=False,
+):
+    """
+    Generate the evaluation prompts of one or more response files, and send them if requested.
+
+    Several response files, e.g. the language shards of an experiment, are processed in
+    parallel worker processes. With an evaluator cache folder, cached results are used
+    instead of sending their prompts, and new results are added to the cache.
+
+    In a staged evaluation, the evaluations the first stage evaluators don't agree on are
+    sent to the other evaluators as soon as the first stage results are available: in the
+    same run when waiting for the results, otherwise in the next run.
+    """
+    response_files = [response_file] if isinstance(response_file, str) else list(response_file)
+
+    if processes > 1 and len(response_files) > 1:
+        # polars runs its own thread pool, forking the parent after it started can deadlock
+        with ProcessPoolExecutor(
+            max_workers=min(processes, len(response_files)), mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            results = list(
+                executor.map(
+                    write_eval_prompt_files,
+                    repeat(base_path),
+                    response_files,
+                    repeat(mode),
+                    repeat(eval_cache),
+                    repeat(prompt_caching),
+                    repeat(staged),
+                    repeat(structured_output),
+                )
             )
+    else:
+        results = [
+            write_eval_prompt_files(base_path, path, mode, eval_cache, prompt_caching, staged, structured_output)
+            for path in response_files
+        ]
+
+    eval_files = [x for eval_files in results for x in eval_files]
+    send_eval_files(eval_files if send else [], wait, processes, eval_cache)
+    if not send:
+        return
+
+    # The first stage results are downloaded, send the evaluations they don't agree on to the others
+    if staged and (wait or mode == "litellm"):
+        cache = EvalCache(eval_cache) if eval_cache else None
+        second_stage = []
+        for group in results:
+            first_stage = [(x.path, read_request_hashes(x.path)) for x in group if x.first_stage]
+            others = [x for x in group if not x.first_stage]
+            if not others:
+                continue
+            undecided = find_undecided_evals(first_stage)
+            for eval_file in others:
+                print(f"Staged evaluation: {len(undecided)} evaluations need {eval_file.path}")
+                send_path = prepare_pending_file(eval_file.path, read_request_hashes(eval_file.path), cache, undecided)
+                response_path = get_response_path(eval_file.path)
+                if send_path is None and not os.path.isfile(response_path):
+                    # The first stage decided all evaluations, an empty response file marks the evaluator as done
+                    open_jsonl(response_path, "w").close()
+                second_stage.append(eval_file._replace(send_path=send_path))
+        send_eval_files(second_stage, wait, processes, eval_cache)
 
 
 if __name__ == "__main__":
@@ -351,7 +917,8 @@ if __name__ == "__main__":
     parser.add_argument(
         "response_file",
         type=str,
-        help="Path to response JSONL file",
+        nargs="+",
+        help="Paths to response JSONL files, e.g. the language shards of an experiment",
     )
     parser.add_argument(
         "--base-path",
@@ -376,6 +943,45 @@ if __name__ == "__main__":
         action="store_true",
         help="Wait for eval results",
     )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of processes generating the prompts of several response files, and shared by "
+        "all evaluators in litellm mode (default: 1)",
+    )
+    parser.add_argument(
+        "--eval-cache",
+        type=str,
+        help="Folder of an evaluator result cache shared by experiments, e.g. ~/.cache/gm-eval/evals",
+    )
+    parser.add_argument(
+        "--prompt-caching",
+        action="store_true",
+        help="Put the evaluated response at the end of the metric prompts and mark the prefix before it for "
+        "prompt caching (Anthropic evaluators)",
+    )
+    parser.add_argument(
+        "--staged",
+        action="store_true",
+        help="Only send the evaluations the first evaluators don't agree on to the other evaluators",
+    )
+    parser.add_argument(
+        "--structured-output",
+        action="store_true",
+        help="Constrain the evaluators to answer with a JSON grade, with a small output token limit",
+    )
     args = parser.parse_args()
 
-    main(args.base_path, args.response_file, args.send, args.wait, args.mode)
+    main(
+        args.base_path,
+        args.response_file,
+        args.send,
+        args.wait,
+        args.mode,
+        args.processes,
+        args.eval_cache,
+        args.prompt_caching,
+        args.staged,
+        args.structured_output,
+    )
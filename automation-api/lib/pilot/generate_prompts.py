@@ -1,12 +1,22 @@
 import argparse
 import json
+import multiprocessing
 import os
+import string
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from enum import Enum
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
 import polars as pl
 
 from lib.app_singleton import AppSingleton
-from lib.pilot.gm_eval.utils import transform_model_id
+from lib.pilot.custom_ids import REPEAT_SEPARATOR, LookupWriter, build_lookup, get_lookup_path
+from lib.pilot.gm_eval.state import get_input_hashes
+from lib.pilot.gm_eval.utils import detect_provider_from_model_id, get_language_shard_path, transform_model_id
+from lib.pilot.jsonl_io import COMPRESSION_EXTENSIONS, get_jsonl_extension, open_jsonl, split_jsonl_extension
+from lib.pilot.parquet_io import ParquetChunkWriter
+from lib.pilot.request_renderer import RequestRenderer
 
 
 class JsonlFormat(Enum):
@@ -17,6 +27,51 @@ class JsonlFormat(Enum):
 
 logger = AppSingleton().get_logger()
 
+# Number of question-prompt combinations rendered and written at once
+DEFAULT_CHUNK_SIZE = 10000
+
+# Columns of a prompt row that vary between requests
+PROMPT_FIELDS = ["prompt_id", "prompt_text"]
+
+# Columns of the prompt table of an experiment, the provider prompt files are rendered from it
+PROMPT_STORE_SCHEMA = {
+    "prompt_id": pl.Utf8,
+    "question_id": pl.Utf8,
+    "variation_id": pl.Utf8,
+    "language": pl.Utf8,
+    "text": pl.Utf8,
+}
+
+# Sheets the prompt texts are rendered from, their hashes are recorded with the prompt table
+PROMPT_SHEETS = ["questions.csv", "question_options.csv", "prompt_variations.csv"]
+
+# Request parameters asking for several samples of a prompt in one request, by provider.
+# Prompts for other providers are repeated as separate requests.
+MULTI_SAMPLE_PARAMETERS = {"openai": "n", "mistral": "n", "vertex": "candidateCount", "vertex_ai": "candidateCount"}
+
+
+def normalize_language(language: pl.Expr) -> pl.Expr:
+    """Write language tags with a hyphen, the sheets use both en-US and en_US."""
+    return language.str.replace_all("_", "-", literal=True)
+
+
+def get_languages(questions: pl.DataFrame) -> List[str]:
+    """Get the languages of the questions, sorted."""
+    if "language" not in questions.columns:
+        raise ValueError("questions.csv has no language column")
+    return sorted(questions.select(normalize_language(pl.col("language")).drop_nulls().unique()).to_series().to_list())
+
+
+def filter_language(frame: pl.DataFrame, language: Optional[str]) -> pl.DataFrame:
+    """
+    Keep the rows of a language, sheets without a language column apply to all languages.
+
+    Language tags are compared with hyphens, so rows tagged en_US are kept for en-US.
+    """
+    if language is None or "language" not in frame.columns:
+        return frame
+    return frame.filter(normalize_language(pl.col("language")) == language.replace("_", "-"))
+
 
 def ensure_complete_options(question_options: pl.DataFrame) -> pl.DataFrame:
     """
@@ -85,8 +140,8 @@ def combine_questions_with_options(questions: pl.DataFrame, question_options: pl
         aggregate_function="first",
     )
 
-    # Join with questions dataframe
-    combined = questions.join(options_pivot, on=["question_id", "language"], how="inner")
+    # Join with questions dataframe, keeping the order of the questions
+    combined = questions.join(options_pivot, on=["question_id", "language"], how="inner", maintain_order="left")
 
     # Rename columns to option_a, option_b, option_c
     combined = combined.rename(
@@ -99,200 +154,269 @@ def combine_questions_with_options(questions: pl.DataFrame, question_options: pl
     )
 
     # Select and order final columns
-    return combined.select(["question_id", "question_text", "option_a", "option_b", "option_c"])
+    return combined.select(["question_id", "language", "question_text", "option_a", "option_b", "option_c"])
+
+
+# Question columns available as fields in question templates
+QUESTION_TEMPLATE_FIELDS = ["question_text", "option_a", "option_b", "option_c"]
+
+_formatter = string.Formatter()
+
+
+def compile_template(template: str, fields: List[str]) -> Optional[pl.Expr]:
+    """
+    Compile a str.format template into a polars string expression over columns.
+
+    Args:
+        template: Template with named fields, e.g. "{question_text}\nA. {option_a}"
+        fields: Column names the template fields may refer to
+
+    Returns:
+        Expression concatenating the template literals and columns, or None when the
+        template uses format specs, conversions or fields that are not columns
+    """
+    parts = []
+    for literal, field_name, format_spec, conversion in _formatter.parse(template):
+        if literal:
+            parts.append(pl.lit(literal))
+        if field_name is None:
+            continue
+        if format_spec or conversion or field_name not in fields:
+            return None
+        # str.format renders missing values as "None"
+        parts.append(pl.col(field_name).cast(pl.Utf8).fill_null("None"))
+
+    if not parts:
+        return pl.lit("")
+    return pl.concat_str(parts)
+
+
+def render_template(template: str, frame: pl.DataFrame, fields: List[str]) -> pl.Series:
+    """
+    Render a str.format template for every row of a DataFrame.
+
+    Args:
+        template: Template with named fields
+        frame: DataFrame with the template fields as columns
+        fields: Column names passed to the template
+
+    Returns:
+        Series with the rendered text of each row
+    """
+    expr = compile_template(template, fields)
+    if expr is not None:
+        # with_columns broadcasts templates without fields to every row
+        return frame.with_columns(expr.alias("text")).get_column("text")
+
+    # Fall back to str.format for templates the expression can't express
+    return pl.Series(
+        "text",
+        [template.format(**row) for row in frame.select(fields).iter_rows(named=True)],
+        dtype=pl.Utf8,
+    )
 
 
 def generate_question_prompt_combinations(questions: pl.DataFrame, prompt_variations: pl.DataFrame) -> pl.DataFrame:
     """
     Generate all combinations of questions and prompt variations.
 
+    Each variation's templates are rendered over the whole question columns at once,
+    giving the same texts as calling str.format on each combination.
+
     Args:
         questions: DataFrame with columns [question_id, question_text, option_a, option_b, option_c]
         prompt_variations: DataFrame with columns [variation_id, question_template, question_prompt_template]
 
     Returns:
-        DataFrame with columns [question_prompt_id, question_prompt_text]
+        DataFrame with columns [prompt_id, prompt_text], ordered by question and then variation
     """
-    # Create all combinations using cross join
-    combinations = questions.join(prompt_variations, how="cross")
+    question_values = questions.select(
+        pl.col("question_id").cast(pl.Utf8).fill_null("None"), *QUESTION_TEMPLATE_FIELDS
+    ).with_row_index("question_index")
 
-    # Convert to dictionaries for simpler string formatting
-    combinations_dicts = combinations.to_dicts()
-
-    # Process each combination
-    processed = []
-    for combo in combinations_dicts:
+    rendered = []
+    for variation_index, variation in enumerate(prompt_variations.iter_rows(named=True)):
         # First format step: format question_template with question text and options
-        formatted_question = combo["question_template"].format(
-            question_text=combo["question_text"],
-            option_a=combo["option_a"],
-            option_b=combo["option_b"],
-            option_c=combo["option_c"],
-        )
+        formatted_question = render_template(
+            variation["question_template"], question_values, QUESTION_TEMPLATE_FIELDS
+        ).alias("question")
 
         # Second format step: format question_prompt_template with formatted_question
-        question_prompt_text = combo["question_prompt_template"].format(question=formatted_question)
-
-        # Create the prompt ID and text
-        question_prompt_id = f"{combo['question_id']}-{combo['variation_id']}"
-        processed.append(
-            {
-                "prompt_id": question_prompt_id,
-                "prompt_text": question_prompt_text,
-            }
+        question_prompt_text = render_template(
+            variation["question_prompt_template"], formatted_question.to_frame(), ["question"]
+        )
+
+        rendered.append(
+            question_values.select(
+                "question_index",
+                pl.lit(variation_index).alias("variation_index"),
+                (pl.col("question_id") + f"-{variation['variation_id']}").alias("prompt_id"),
+                question_prompt_text.alias("prompt_text"),
+            )
         )
 
-    # Create final DataFrame and return
-    return pl.DataFrame(processed)
+    if not rendered:
+        return pl.DataFrame(schema={"prompt_id": pl.Utf8, "prompt_text": pl.Utf8})
 
+    # Keep the order of the cross join: all variations of the first question come first
+    return pl.concat(rendered).sort(["question_index", "variation_index"]).select(["prompt_id", "prompt_text"])
 
-def convert_to_jsonl_openai(
-    df: pl.DataFrame,
-    output_path: str,
-    model: str,
-    model_parameters: dict,
-    id_prefix: str = "",
-) -> None:
-    """
-    Convert a DataFrame of prompts to OpenAI JSONL format for batch processing.
 
-    Args:
-        df: DataFrame with columns [question_prompt_id, question_prompt_text]
-        output_path: Path to save JSONL file
-        model: OpenAI model to use
-        max_tokens: Maximum tokens to generate
-        temperature: Sampling temperature
-    """
-    with open(output_path, "w", encoding="utf-8") as f:
-        for row in df.iter_rows(named=True):
-            request_body = {
-                "model": model,
-                "messages": [
-                    {"role": "user", "content": row["prompt_text"]},
-                ],
-                **model_parameters,
-            }
-
-            request_obj = {
-                "custom_id": f"{id_prefix}{row['prompt_id']}",
-                "method": "POST",
-                "url": "/v1/chat/completions",
-                "body": request_body,
-            }
-
-            # Use json.dumps to ensure proper JSON formatting and UTF-8 encoding
-            json_line = json.dumps(request_obj, ensure_ascii=False)
-            f.write(f"{json_line}\n")
-
-
-def convert_to_jsonl_mistral(
-    df: pl.DataFrame,
-    output_path: str,
-    model_parameters: dict,
-    id_prefix: str = "",
-) -> None:
+def iter_question_prompt_combinations(
+    questions: pl.DataFrame, prompt_variations: pl.DataFrame, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[pl.DataFrame]:
     """
-    Convert a DataFrame of prompts to Mistral JSONL format for batch processing.
+    Generate the combinations of questions and prompt variations in chunks.
 
-    Args:
-        df: DataFrame with columns [question_prompt_id, question_prompt_text]
-        output_path: Path to save JSONL file
-        model_parameters: Parameters for the model
-        id_prefix: Prefix to add to custom_id
-    """
-    with open(output_path, "w", encoding="utf-8") as f:
-        for row in df.iter_rows(named=True):
-            # Create the body with messages and parameters
-            body = {
-                "messages": [
-                    {"role": "user", "content": row["prompt_text"]},
-                ],
-                **model_parameters,
-            }
+    Chunks hold all variations of a slice of the questions, so they come in the same
+    order as generate_question_prompt_combinations and only one chunk is in memory at a time.
 
-            # Create the request object
-            request_obj = {
-                "custom_id": f"{id_prefix}{row['prompt_id']}",
-                "body": body,
-            }
+    Args:
+        questions: DataFrame with columns [question_id, question_text, option_a, option_b, option_c]
+        prompt_variations: DataFrame with columns [variation_id, question_template, question_prompt_template]
+        chunk_size: Approximate number of combinations per chunk
 
-            # Use json.dumps to ensure proper JSON formatting and UTF-8 encoding
-            json_line = json.dumps(request_obj, ensure_ascii=False)
-            f.write(f"{json_line}\n")
+    Yields:
+        DataFrames with columns [prompt_id, prompt_text]
+    """
+    for chunk in iter_prompt_table_chunks(questions, prompt_variations, chunk_size):
+        yield chunk.select(["prompt_id", "prompt_text"])
 
 
-def convert_to_jsonl_vertex(df: pl.DataFrame, output_path: str, model_parameters: dict) -> None:
+def iter_prompt_table_chunks(
+    questions: pl.DataFrame, prompt_variations: pl.DataFrame, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[pl.DataFrame]:
     """
-    Convert a DataFrame of prompts to Vertex AI JSONL format for batch processing.
+    Generate the combinations of questions and prompt variations in chunks, with the parts of their ids.
 
     Args:
-        df: DataFrame with columns [question_prompt_id, question_prompt_text]
-        output_path: Path to save JSONL file
-        temperature: Temperature setting for generation
-        id_prefix: Prefix to add to custom_id
-    """
-    with open(output_path, "w", encoding="utf-8") as f:
-        for row in df.iter_rows(named=True):
-            request_obj = {
-                "request": {
-                    "contents": [
-                        {
-                            "role": "user",
-                            "parts": [{"text": row["prompt_text"]}],
-                        }
-                    ],
-                    "generationConfig": model_parameters,
-                    "safety_settings": [
-                        {
-                            "category": "HARM_CATEGORY_HARASSMENT",
-                            "threshold": "BLOCK_ONLY_HIGH",
-                        },
-                        {
-                            "category": "HARM_CATEGORY_HATE_SPEECH",
-                            "threshold": "BLOCK_ONLY_HIGH",
-                        },
-                        {
-                            "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                            "threshold": "BLOCK_ONLY_HIGH",
-                        },
-                        {
-                            "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                            "threshold": "BLOCK_ONLY_HIGH",
-                        },
-                    ],
+        questions: DataFrame with columns [question_id, language, question_text, option_a, option_b, option_c]
+        prompt_variations: DataFrame with columns [variation_id, question_template, question_prompt_template]
+        chunk_size: Approximate number of combinations per chunk
+
+    Yields:
+        DataFrames with columns [prompt_id, prompt_text, question_id, variation_id, language]
+    """
+    variation_ids = prompt_variations.select(pl.col("variation_id").cast(pl.Utf8))
+    questions_per_chunk = max(1, chunk_size // max(1, prompt_variations.height))
+    for offset in range(0, questions.height, questions_per_chunk):
+        chunk_questions = questions.slice(offset, questions_per_chunk)
+        prompts = generate_question_prompt_combinations(chunk_questions, prompt_variations)
+        # The cross join has the order of the prompts: all variations of the first question come first
+        ids = chunk_questions.select(
+            pl.col("question_id").cast(pl.Utf8),
+            (pl.col("language") if "language" in chunk_questions.columns else pl.lit(None))
+            .cast(pl.Utf8)
+            .alias("language"),
+        ).join(variation_ids, how="cross")
+        yield pl.concat([prompts, ids.select(["question_id", "variation_id", "language"])], how="horizontal")
+
+
+def build_openai_request(row: dict, model: str, model_parameters: dict, id_prefix: str = "") -> dict:
+    """Build the OpenAI batch request of a prompt row with columns [prompt_id, prompt_text]."""
+    request_body = {
+        "model": model,
+        "messages": [
+            {"role": "user", "content": row["prompt_text"]},
+        ],
+        **model_parameters,
+    }
+
+    return {
+        "custom_id": f"{id_prefix}{row['prompt_id']}",
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": request_body,
+    }
+
+
+def build_mistral_request(row: dict, model_parameters: dict, id_prefix: str = "") -> dict:
+    """Build the Mistral batch request of a prompt row with columns [prompt_id, prompt_text]."""
+    # Create the body with messages and parameters
+    body = {
+        "messages": [
+            {"role": "user", "content": row["prompt_text"]},
+        ],
+        **model_parameters,
+    }
+
+    return {
+        "custom_id": f"{id_prefix}{row['prompt_id']}",
+        "body": body,
+    }
+
+
+def build_vertex_request(row: dict, model_parameters: dict) -> dict:
+    """Build the Vertex AI batch request of a prompt row with columns [prompt_id, prompt_text]."""
+    return {
+        "request": {
+            "contents": [
+                {
+                    "role": "user",
+                    "parts": [{"text": row["prompt_text"]}],
                 }
-            }
+            ],
+            "generationConfig": model_parameters,
+            "safety_settings": [
+                {
+                    "category": "HARM_CATEGORY_HARASSMENT",
+                    "threshold": "BLOCK_ONLY_HIGH",
+                },
+                {
+                    "category": "HARM_CATEGORY_HATE_SPEECH",
+                    "threshold": "BLOCK_ONLY_HIGH",
+                },
+                {
+                    "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+                    "threshold": "BLOCK_ONLY_HIGH",
+                },
+                {
+                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+                    "threshold": "BLOCK_ONLY_HIGH",
+                },
+            ],
+        }
+    }
 
-            # Use json.dumps to ensure proper JSON formatting and UTF-8 encoding
-            json_line = json.dumps(request_obj, ensure_ascii=False)
-            f.write(f"{json_line}\n")
 
+def repeat_prompts(prompts: pl.DataFrame, repeat_times: int) -> pl.DataFrame:
+    """
+    Repeat each prompt, appending the repeat index to the prompt_id of each copy.
 
-def main(base_path, model_config_id, jsonl_format, mode=None):
-    # Construct input paths
-    sheets_dir = os.path.join(base_path, "ai_eval_sheets")
-    questions_path = os.path.join(sheets_dir, "questions.csv")
-    question_options_path = os.path.join(sheets_dir, "question_options.csv")
-    prompt_variations_path = os.path.join(sheets_dir, "prompt_variations.csv")
-    model_configurations_path = os.path.join(sheets_dir, "gen_ai_model_configs.csv")
+    Args:
+        prompts: DataFrame with columns [prompt_id, prompt_text]
+        repeat_times: Number of copies of each prompt
 
-    # Read input files
-    questions = pl.read_csv(questions_path)
-    question_options = pl.read_csv(question_options_path)
-    prompt_template_variations = pl.read_csv(prompt_variations_path)
-    model_configurations = pl.read_csv(model_configurations_path)
+    Returns:
+        DataFrame with columns [prompt_id, prompt_text], the copies of a prompt next to each other
+    """
+    return (
+        prompts.with_columns(pl.lit(list(range(repeat_times))).alias("repeat_index"))
+        .explode("repeat_index")
+        .select(
+            pl.concat_str(["prompt_id", pl.lit(REPEAT_SEPARATOR), pl.col("repeat_index").cast(pl.Utf8)]).alias(
+                "prompt_id"
+            ),
+            "prompt_text",
+        )
+    )
 
-    # Print experiment size information
-    print(f"Number of questions: {questions.height}")
-    print(f"Number of prompt templates: {prompt_template_variations.height}")
-    print(f"Total combinations: {questions.height * prompt_template_variations.height}")
 
-    # Combine questions with options
-    combined_questions = combine_questions_with_options(questions, question_options)
+def get_model_config_parameters(
+    model_configurations: pl.DataFrame, model_config_id: str, jsonl_format: str, mode: Optional[str] = None
+) -> Tuple[str, dict]:
+    """
+    Get the model ID and parameters of a model configuration.
 
-    # Generate question-prompt combinations
-    question_prompts = generate_question_prompt_combinations(combined_questions, prompt_template_variations)
+    Args:
+        model_configurations: Content of gen_ai_model_configs.csv
+        model_config_id: Model configuration ID
+        jsonl_format: JSONL format the prompts are written in
+        mode: Processing mode ("batch" or "litellm"), takes precedence over jsonl_format
 
+    Returns:
+        Tuple of (model ID for the mode or format, model parameters)
+    """
     # Find and validate model configuration
     model_config = model_configurations.filter(pl.col("model_config_id") == model_config_id)
 
@@ -309,6 +433,7 @@ def main(base_path, model_config_id, jsonl_format, mode=None):
     model_parameters = model_config["model_parameters"][0]
 
     # parse the parameters
+    params = {}
     if model_parameters is not None:
         try:
             params = json.loads(model_parameters)
@@ -317,43 +442,439 @@ def main(base_path, model_config_id, jsonl_format, mode=None):
             logger.warning(f"Could not parse model_parameters: {model_parameters}")
             params = {}
 
+    return model_id, params
+
+
+def get_repeat_settings(
+    model_configurations: pl.DataFrame, model_config_id: str, mode: Optional[str] = None
+) -> Tuple[dict, int]:
+    """
+    Get how the repeated samples of a model configuration are requested.
+
+    Providers with a multi-sample parameter return all samples of a prompt in one response.
+    Other providers, and all of them in litellm mode, get a request for each sample.
+
+    Args:
+        model_configurations: Content of gen_ai_model_configs.csv
+        model_config_id: Model configuration ID
+        mode: Processing mode ("batch" or "litellm")
+
+    Returns:
+        Tuple of (request parameters asking for several samples, number of requests per prompt)
+    """
+    if "repeat_times" not in model_configurations.columns:
+        return {}, 1
+
+    model_config = model_configurations.filter(pl.col("model_config_id") == model_config_id)
+    repeat_times = model_config["repeat_times"][0]
+    # repeat_times is -1 when it is not set in the AI eval spreadsheet
+    if repeat_times is None or int(repeat_times) <= 1:
+        return {}, 1
+
+    provider, _ = detect_provider_from_model_id(model_config["model_id"][0])
+    parameter = MULTI_SAMPLE_PARAMETERS.get(provider)
+    if mode == "litellm" or parameter is None:
+        return {}, int(repeat_times)
+    return {parameter: int(repeat_times)}, 1
+
+
+class PromptFileSpec(NamedTuple):
+    """The prompt files of one model configuration."""
+
+    model_config_id: str
+    jsonl_path: str
+    # Prompt mapping CSV, for formats whose requests have no custom_id (Vertex AI)
+    mapping_path: Optional[str]
+    build_request: Callable[[dict], dict]
+    # Number of requests of each prompt, for repeated samples the provider can't return in one request
+    repeat_requests: int = 1
+
+
+def get_prompt_file_spec(
+    base_path: str,
+    model_configurations: pl.DataFrame,
+    model_config_id: str,
+    jsonl_format: str,
+    mode: Optional[str],
+    compression: Optional[str] = None,
+    compact_ids: bool = False,
+    language: Optional[str] = None,
+) -> PromptFileSpec:
+    """
+    Describe the prompt files of a model configuration in the given JSONL format and compression.
+
+    The files of a language shard have the language appended to their name.
+    """
+    model_id, params = get_model_config_parameters(model_configurations, model_config_id, jsonl_format, mode)
+    sample_params, repeat_requests = get_repeat_settings(model_configurations, model_config_id, mode)
+    params = {**params, **sample_params}
+    # Use model_config_id as prefix, compact ids are complete custom_ids already
+    id_prefix = "" if compact_ids else f"{model_config_id}-"
+
     # Save as JSONL file in selected format with model config prefix
-    jsonl_output_path = os.path.join(base_path, f"{model_config_id}-question_prompts.jsonl")
+    jsonl_output_path = os.path.join(base_path, f"{model_config_id}-question_prompts{get_jsonl_extension(compression)}")
+    if language is not None:
+        jsonl_output_path = get_language_shard_path(jsonl_output_path, language)
 
-    # Convert to appropriate JSONL format
     if JsonlFormat(jsonl_format) == JsonlFormat.OPENAI:
-        convert_to_jsonl_openai(
-            question_prompts,
+        return PromptFileSpec(
+            model_config_id,
             jsonl_output_path,
-            model=model_id,
-            model_parameters=params,
-            id_prefix=f"{model_config_id}-",  # Use model_config_id as prefix
+            None,
+            lambda row: build_openai_request(row, model_id, params, id_prefix),
+            repeat_requests,
         )
     elif JsonlFormat(jsonl_format) == JsonlFormat.MISTRAL:
-        convert_to_jsonl_mistral(
-            question_prompts,
+        return PromptFileSpec(
+            model_config_id,
             jsonl_output_path,
-            model_parameters=params,
-            id_prefix=f"{model_config_id}-",  # Use model_config_id as prefix
+            None,
+            lambda row: build_mistral_request(row, params, id_prefix),
+            repeat_requests,
         )
     else:  # Vertex format
-        convert_to_jsonl_vertex(
-            question_prompts,
+        csv_output_path = f"{split_jsonl_extension(jsonl_output_path)[0]}-prompt-mapping.csv"
+        return PromptFileSpec(
+            model_config_id,
             jsonl_output_path,
-            model_parameters=params,
+            csv_output_path,
+            lambda row: build_vertex_request(row, params),
+            repeat_requests,
         )
-        csv_output_path = os.path.join(
-            base_path,
-            f"{model_config_id}-question_prompts-prompt-mapping.csv",
+
+
+def generate_prompts_for_configs(
+    base_path: str,
+    jsonl_formats: Dict[str, str],
+    mode: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    compression: Optional[str] = None,
+    compact_ids: bool = False,
+    language: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    Generate the prompt files of several model configurations in one pass.
+
+    The prompt texts are the same for every model configuration, so they are rendered
+    once and each chunk is written to the files of all configurations.
+
+    Args:
+        base_path: Base directory containing ai_eval_sheets folder
+        jsonl_formats: Mapping of model configuration IDs to their JSONL formats
+        mode: Processing mode ("batch" or "litellm") the prompts are for
+        chunk_size: Number of prompts rendered and written at once
+        compression: Compression of the JSONL files ("gzip" or "zstd"), None for plain JSONL
+        compact_ids: Use fixed-length hashed custom_ids, saved with their parts in a lookup table
+            next to each JSONL file
+        language: Only generate the prompts of this language, in language shard files
+
+    Returns:
+        Mapping of model configuration IDs to their JSONL file paths
+    """
+    combined_questions, prompt_template_variations = read_prompt_sheets(base_path, language)
+    model_configurations = pl.read_csv(os.path.join(base_path, "ai_eval_sheets", "gen_ai_model_configs.csv"))
+
+    # Validate all model configurations before writing any file
+    specs = [
+        get_prompt_file_spec(
+            base_path, model_configurations, model_config_id, jsonl_format, mode, compression, compact_ids, language
         )
-        # Add the ID prefix to the custom_id in the csv
-        question_prompts = question_prompts.with_columns(
-            pl.col("prompt_id").map_elements(lambda x: f"{model_config_id}-{x}").alias("prompt_id")
+        for model_config_id, jsonl_format in jsonl_formats.items()
+    ]
+
+    # Generate question-prompt combinations in chunks, which are written as they are rendered
+    chunks = iter_prompt_table_chunks(combined_questions, prompt_template_variations, chunk_size)
+    write_prompt_files(specs, chunks, compact_ids)
+
+    return {spec.model_config_id: spec.jsonl_path for spec in specs}
+
+
+def read_prompt_sheets(base_path: str, language: Optional[str] = None) -> Tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Read the questions, with their options, and the prompt variations of an experiment.
+
+    Args:
+        base_path: Base directory containing ai_eval_sheets folder
+        language: Only keep the rows of this language
+
+    Returns:
+        Tuple of (questions combined with their options, prompt variations)
+    """
+    # Construct input paths
+    sheets_dir = os.path.join(base_path, "ai_eval_sheets")
+    questions_path = os.path.join(sheets_dir, "questions.csv")
+    question_options_path = os.path.join(sheets_dir, "question_options.csv")
+    prompt_variations_path = os.path.join(sheets_dir, "prompt_variations.csv")
+
+    # Read input files, keeping the rows of the language of a shard
+    questions = filter_language(pl.read_csv(questions_path), language)
+    question_options = filter_language(pl.read_csv(question_options_path), language)
+    prompt_template_variations = filter_language(pl.read_csv(prompt_variations_path), language)
+    if language is not None:
+        if questions.height == 0:
+            raise ValueError(f"No questions in language {language}")
+        print(f"Language: {language}")
+
+    # Print experiment size information
+    print(f"Number of questions: {questions.height}")
+    print(f"Number of prompt templates: {prompt_template_variations.height}")
+    print(f"Total combinations: {questions.height * prompt_template_variations.height}")
+
+    # Combine questions with options
+    return combine_questions_with_options(questions, question_options), prompt_template_variations
+
+
+def write_prompt_files(specs: List[PromptFileSpec], chunks: Iterable[pl.DataFrame], compact_ids: bool = False) -> int:
+    """
+    Write the prompt files of several model configurations, one chunk of prompts at a time.
+
+    Args:
+        specs: Prompt files of each model configuration
+        chunks: DataFrames with columns [prompt_id, prompt_text, question_id, variation_id]
+        compact_ids: Use fixed-length hashed custom_ids, saved with their parts in a lookup table
+            next to each JSONL file
+
+    Returns:
+        Number of prompts written to each file
+    """
+    count = 0
+    with ExitStack() as stack:
+        jsonl_files = [stack.enter_context(open_jsonl(spec.jsonl_path, "w")) for spec in specs]
+        # The compact custom_ids of each chunk are written to the lookup tables with the chunk
+        lookup_writers = [
+            stack.enter_context(LookupWriter(get_lookup_path(spec.jsonl_path))) if compact_ids else None
+            for spec in specs
+        ]
+        mapping_files = [
+            stack.enter_context(open(spec.mapping_path, "w", encoding="utf-8")) if spec.mapping_path else None
+            for spec in specs
+        ]
+        renderers = [RequestRenderer(spec.build_request, PROMPT_FIELDS) for spec in specs]
+        for mapping_file in mapping_files:
+            if mapping_file is not None:
+                mapping_file.write("prompt_id,prompt_text\n")
+
+        for chunk in chunks:
+            prompts = chunk.select(["prompt_id", "prompt_text"])
+            rows = prompts.to_dicts()
+            for spec, lookup_writer, renderer, jsonl_file, mapping_file in zip(
+                specs, lookup_writers, renderers, jsonl_files, mapping_files
+            ):
+                spec_chunk, spec_rows = prompts, rows
+                if lookup_writer is not None:
+                    lookup = build_lookup(
+                        {
+                            "model_config_id": [spec.model_config_id] * chunk.height,
+                            "question_id": chunk["question_id"],
+                            "prompt_variation_id": chunk["variation_id"],
+                        }
+                    )
+                    lookup_writer.write(lookup)
+                    spec_chunk = spec_chunk.with_columns(lookup["custom_id"].alias("prompt_id"))
+                if spec.repeat_requests > 1:
+                    spec_chunk = repeat_prompts(spec_chunk, spec.repeat_requests)
+                if spec_chunk is not prompts:
+                    spec_rows = spec_chunk.to_dicts()
+
+                jsonl_file.writelines(f"{renderer.render(row)}\n" for row in spec_rows)
+
+                if mapping_file is not None:
+                    # Add the ID prefix to the custom_id in the csv
+                    mapping = spec_chunk
+                    if lookup_writer is None:
+                        mapping = spec_chunk.with_columns(
+                            (pl.lit(f"{spec.model_config_id}-") + pl.col("prompt_id")).alias("prompt_id")
+                        )
+                    mapping.write_csv(mapping_file, include_header=False)
+            count += chunk.height
+
+    for spec in specs:
+        if compact_ids:
+            print(f"Saved custom_id lookup to {get_lookup_path(spec.jsonl_path)}")
+        if spec.mapping_path:
+            print(f"Saved prompt mapping to {spec.mapping_path}")
+        if spec.repeat_requests > 1:
+            print(f"Saved {count} prompts, {spec.repeat_requests} requests each, to {spec.jsonl_path}")
+        else:
+            print(f"Saved {count} prompts to {spec.jsonl_path}")
+
+    return count
+
+
+def get_prompt_store_path(base_path: str, language: Optional[str] = None) -> str:
+    """Get the path of the prompt table of an experiment, or of one of its language shards."""
+    name = "question_prompts" if language is None else f"question_prompts-{language}"
+    return os.path.join(base_path, f"{name}.parquet")
+
+
+def get_prompt_sheet_hashes(base_path: str) -> Dict[str, str]:
+    """Get the content hashes of the sheets the prompts of an experiment are rendered from."""
+    sheets_dir = os.path.join(base_path, "ai_eval_sheets")
+    return get_input_hashes({name: os.path.join(sheets_dir, name) for name in PROMPT_SHEETS})
+
+
+def get_prompt_store_hashes_path(path: str) -> str:
+    """Get the path of the sheet hashes recorded with a prompt table."""
+    return f"{os.path.splitext(path)[0]}-sheet-hashes.json"
+
+
+def is_prompt_store_current(base_path: str, language: Optional[str] = None) -> bool:
+    """Check that the prompt table of an experiment, or of a language shard, was rendered from the current sheets."""
+    path = get_prompt_store_path(base_path, language)
+    hashes_path = get_prompt_store_hashes_path(path)
+    if not os.path.isfile(path) or not os.path.isfile(hashes_path):
+        return False
+    with open(hashes_path, "r", encoding="utf-8") as f:
+        return json.load(f) == get_prompt_sheet_hashes(base_path)
+
+
+def write_prompt_store(base_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE, language: Optional[str] = None) -> str:
+    """
+    Render the question prompts of an experiment once, into its prompt table.
+
+    The prompt texts are the same for every model configuration, so the table holds
+    them once, and the prompt files of a model configuration are rendered from it
+    when they are needed, see render_prompts_from_store. The hashes of the sheets are
+    saved next to the table, so a table of outdated sheets is not used.
+
+    Args:
+        base_path: Base directory containing ai_eval_sheets folder
+        chunk_size: Number of prompts rendered and written at once
+        language: Only render the prompts of this language, in a language shard of the table
+
+    Returns:
+        Path to the prompt table
+    """
+    sheet_hashes = get_prompt_sheet_hashes(base_path)
+    combined_questions, prompt_template_variations = read_prompt_sheets(base_path, language)
+    path = get_prompt_store_path(base_path, language)
+
+    count = 0
+    with ParquetChunkWriter(path, PROMPT_STORE_SCHEMA) as writer:
+        for chunk in iter_prompt_table_chunks(combined_questions, prompt_template_variations, chunk_size):
+            writer.write(chunk.rename({"prompt_text": "text"}))
+            count += chunk.height
+    with open(get_prompt_store_hashes_path(path), "w", encoding="utf-8") as f:
+        json.dump(sheet_hashes, f, indent=2, sort_keys=True)
+
+    print(f"Saved {count} prompts to {path}")
+    return path
+
+
+def iter_prompt_store(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pl.DataFrame]:
+    """
+    Read a prompt table in chunks.
+
+    Yields:
+        DataFrames with columns [prompt_id, prompt_text, question_id, variation_id, language]
+    """
+    num_prompts = pl.scan_parquet(path).select(pl.len()).collect().item()
+    for offset in range(0, num_prompts, chunk_size):
+        yield pl.scan_parquet(path).slice(offset, chunk_size).collect().rename({"text": "prompt_text"})
+
+
+def render_prompts_from_store(
+    base_path: str,
+    jsonl_formats: Dict[str, str],
+    mode: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    compression: Optional[str] = None,
+    compact_ids: bool = False,
+    language: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    Render the prompt files of model configurations from the prompt table of the experiment.
+
+    Gives the same files as generate_prompts_for_configs, without rendering the prompt
+    templates again.
+
+    Args:
+        base_path: Base directory containing the prompt table and ai_eval_sheets folder
+        jsonl_formats: Mapping of model configuration IDs to their JSONL formats
+        mode: Processing mode ("batch" or "litellm") the prompts are for
+        chunk_size: Number of prompts read and written at once
+        compression: Compression of the JSONL files ("gzip" or "zstd"), None for plain JSONL
+        compact_ids: Use fixed-length hashed custom_ids, saved with their parts in a lookup table
+            next to each JSONL file
+        language: Render the language shard of the prompt table, in language shard files
+
+    Returns:
+        Mapping of model configuration IDs to their JSONL file paths
+    """
+    path = get_prompt_store_path(base_path, language)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Prompt table not found: {path}")
+    model_configurations = pl.read_csv(os.path.join(base_path, "ai_eval_sheets", "gen_ai_model_configs.csv"))
+
+    specs = [
+        get_prompt_file_spec(
+            base_path, model_configurations, model_config_id, jsonl_format, mode, compression, compact_ids, language
         )
-        question_prompts.write_csv(csv_output_path)
-        print(f"Saved prompt mapping to {csv_output_path}")
+        for model_config_id, jsonl_format in jsonl_formats.items()
+    ]
+    write_prompt_files(specs, iter_prompt_store(path, chunk_size), compact_ids)
+
+    return {spec.model_config_id: spec.jsonl_path for spec in specs}
+
+
+def generate_prompts_by_language(
+    base_path: str,
+    jsonl_formats: Dict[str, str],
+    mode: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    compression: Optional[str] = None,
+    compact_ids: bool = False,
+    languages: Optional[List[str]] = None,
+    processes: int = 1,
+) -> Dict[str, List[str]]:
+    """
+    Generate the prompt files of several model configurations as one shard per language.
 
-    print(f"Saved {len(question_prompts)} prompts to {jsonl_output_path}")
+    Each language is rendered in a worker process and written to its own files, e.g.
+    `mc001-question_prompts-en-US.jsonl`, which are sent as separate batches. The custom_ids
+    don't include the language, so the shards must not be concatenated. Passing languages
+    only (re)generates the shards of those languages.
+
+    Args:
+        base_path: Base directory containing ai_eval_sheets folder
+        jsonl_formats: Mapping of model configuration IDs to their JSONL formats
+        mode: Processing mode ("batch" or "litellm") the prompts are for
+        chunk_size: Number of prompts rendered and written at once
+        compression: Compression of the JSONL files ("gzip" or "zstd"), None for plain JSONL
+        compact_ids: Use fixed-length hashed custom_ids, with a lookup table next to each shard
+        languages: Languages to generate, all languages of questions.csv if None
+        processes: Number of worker processes rendering languages in parallel
+
+    Returns:
+        Mapping of model configuration IDs to the paths of their shards, in the order of the languages
+    """
+    if languages is None:
+        languages = get_languages(pl.read_csv(os.path.join(base_path, "ai_eval_sheets", "questions.csv")))
+    shard_args = [(base_path, jsonl_formats, mode, chunk_size, compression, compact_ids, x) for x in languages]
+
+    if processes > 1 and len(languages) > 1:
+        # polars runs its own thread pool, forking the parent after it started can deadlock
+        with ProcessPoolExecutor(
+            max_workers=min(processes, len(languages)), mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            results = list(executor.map(generate_prompts_for_configs, *zip(*shard_args)))
+    else:
+        results = [generate_prompts_for_configs(*args) for args in shard_args]
+
+    return {model_config_id: [paths[model_config_id] for paths in results] for model_config_id in jsonl_formats}
+
+
+def main(
+    base_path: str,
+    model_config_id: str,
+    jsonl_format: str,
+    mode: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    compression: Optional[str] = None,
+    compact_ids: bool = False,
+) -> None:
+    """Generate the prompt file of a single model configuration."""
+    generate_prompts_for_configs(base_path, {model_config_id: jsonl_format}, mode, chunk_size, compression, compact_ids)
 
 
 if __name__ == "__main__":
@@ -367,8 +888,9 @@ if __name__ == "__main__":
     parser.add_argument(
         "--model-config-id",
         type=str,
+        nargs="+",
         required=True,
-        help="ID of the model configuration to use",
+        help="IDs of the model configurations to use",
     )
     parser.add_argument(
         "--jsonl-format",
@@ -377,6 +899,58 @@ if __name__ == "__main__":
         default=JsonlFormat.OPENAI.value,
         help="Format of JSONL output (openai, vertex, or mistral)",
     )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help=f"Number of prompts rendered and written at once (default: {DEFAULT_CHUNK_SIZE})",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        choices=list(COMPRESSION_EXTENSIONS),
+        help="Compress the JSONL output (default: plain JSONL)",
+    )
+    parser.add_argument(
+        "--compact-ids",
+        action="store_true",
+        help="Use fixed-length hashed custom_ids, with a lookup table of their parts",
+    )
+    parser.add_argument(
+        "--by-language",
+        action="store_true",
+        help="Write a shard of the prompt files for each language",
+    )
+    parser.add_argument(
+        "--language",
+        type=str,
+        nargs="+",
+        help="Only write the shards of these languages (implies --by-language)",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of worker processes rendering language shards in parallel (default: 1)",
+    )
     args = parser.parse_args()
 
-    main(args.base_path, args.model_config_id, args.jsonl_format)
+    jsonl_formats = {model_config_id: args.jsonl_format for model_config_id in args.model_config_id}
+    if args.by_language or args.language:
+        generate_prompts_by_language(
+            args.base_path,
+            jsonl_formats,
+            chunk_size=args.chunk_size,
+            compression=args.compression,
+            compact_ids=args.compact_ids,
+            languages=args.language,
+            processes=args.processes,
+        )
+    else:
+        generate_prompts_for_configs(
+            args.base_path,
+            jsonl_formats,
+            chunk_size=args.chunk_size,
+            compression=args.compression,
+            compact_ids=args.compact_ids,
+        )
@@ -9,7 +9,18 @@ from typing import List, Optional
 
 from lib.app_singleton import AppSingleton
 from lib.pilot.gm_eval import __version__
-from lib.pilot.gm_eval.commands import download, evaluate, generate, merge, run, send, send_file, split, summarize
+from lib.pilot.gm_eval.commands import (
+    download,
+    evaluate,
+    generate,
+    merge,
+    retry,
+    run,
+    send,
+    send_file,
+    split,
+    summarize,
+)
 
 
 def setup_logging(debug: bool = False) -> None:
@@ -84,6 +95,12 @@ def create_parser() -> argparse.ArgumentParser:
     )
     merge.add_arguments(merge_parser)
 
+    # Retry command
+    retry_parser = subparsers.add_parser(
+        "retry", help="Resend failed and missing requests and merge them into the response file"
+    )
+    retry.add_arguments(retry_parser)
+
     return parser
 
 
@@ -128,6 +145,8 @@ def main(args: Optional[List[str]] = None) -> int:
         return split.handle(parsed_args)
     elif parsed_args.command == "merge":
         return merge.handle(parsed_args)
+    elif parsed_args.command == "retry":
+        return retry.handle(parsed_args)
     else:
         parser.print_help()
         return 1
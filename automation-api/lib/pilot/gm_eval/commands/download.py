@@ -6,7 +6,6 @@ import argparse
 import os
 from datetime import datetime
 
-from lib.pilot.generate_experiment import save_sheets_as_csv
 from lib.pilot.gm_eval.utils import ensure_directory, logger
 
 
@@ -65,6 +64,9 @@ def handle(args: argparse.Namespace) -> int:
             with open(args.filter_prompts) as f:
                 prompt_variation_ids = {line.strip() for line in f if line.strip()}
 
+        # Imported here, the spreadsheet clients are slow to load and only needed by this command
+        from lib.pilot.generate_experiment import save_sheets_as_csv
+
         ensure_directory(args.output_dir)
         saved_files = save_sheets_as_csv(
             args.output_dir, question_ids=question_ids, prompt_variation_ids=prompt_variation_ids
@@ -19,7 +19,8 @@ def add_arguments(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
         "response_file",
         type=str,
-        help="Path to response JSONL file",
+        nargs="+",
+        help="Paths to response JSONL files, e.g. the language shards of an experiment",
     )
     parser.add_argument(
         "--base-path",
@@ -44,6 +45,38 @@ def add_arguments(parser: argparse.ArgumentParser) -> None:
         action="store_true",
         help="Wait for eval results",
     )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of processes generating the prompts of several response files, and shared by "
+        "all evaluators in litellm mode (default: 1)",
+    )
+    parser.add_argument(
+        "--eval-cache",
+        type=str,
+        help="Folder of an evaluator result cache shared by experiments, e.g. ~/.cache/gm-eval/evals. "
+        "Cached results are used instead of sending their prompts, and new results are added to it",
+    )
+    parser.add_argument(
+        "--prompt-caching",
+        action="store_true",
+        help="Put the evaluated response at the end of the metric prompts, and send the part before it as a "
+        "separate block with a cache_control marker, so Anthropic evaluators can reuse it (other providers cache "
+        "prefixes without markers)",
+    )
+    parser.add_argument(
+        "--staged",
+        action="store_true",
+        help="Staged evaluation: send the evaluation prompts to a majority of the evaluators first, and "
+        "only the evaluations they don't agree on, or couldn't be scored, to the other evaluators",
+    )
+    parser.add_argument(
+        "--structured-output",
+        action="store_true",
+        help="Constrain the evaluators to answer with a JSON grade, using the structured output parameters "
+        "of their provider and a small output token limit (unless their parameters set one)",
+    )
 
 
 def handle(args: argparse.Namespace) -> int:
@@ -57,10 +90,11 @@ def handle(args: argparse.Namespace) -> int:
         Exit code (0 for success, non-zero for failure)
     """
     try:
-        # Check if the response file exists
-        if not os.path.isfile(args.response_file):
-            logger.error(f"Response file not found: {args.response_file}")
-            return 1
+        # Check if the response files exist
+        for response_file in args.response_file:
+            if not os.path.isfile(response_file):
+                logger.error(f"Response file not found: {response_file}")
+                return 1
 
         # Check if ai_eval_sheets directory exists
         sheets_dir = os.path.join(args.base_path, "ai_eval_sheets")
@@ -70,7 +104,19 @@ def handle(args: argparse.Namespace) -> int:
             return 1
 
         # Run the generate eval prompts main function
-        generate_eval_prompts_main(args.base_path, args.response_file, args.send, args.wait, args.mode)
+        eval_cache = os.path.expanduser(args.eval_cache) if args.eval_cache else None
+        generate_eval_prompts_main(
+            args.base_path,
+            args.response_file,
+            args.send,
+            args.wait,
+            args.mode,
+            args.processes,
+            eval_cache,
+            args.prompt_caching,
+            args.staged,
+            args.structured_output,
+        )
 
         return 0
     except Exception as e:
@@ -4,10 +4,29 @@ Generate command for the gm-eval CLI tool.
 
 import argparse
 import os
+from typing import Dict, List, Optional
 
-from lib.pilot.generate_prompts import JsonlFormat
-from lib.pilot.generate_prompts import main as generate_prompts_main
-from lib.pilot.gm_eval.utils import ensure_directory, logger
+import polars as pl
+
+from lib.pilot.forecast import forecast_model_config
+from lib.pilot.generate_prompts import (
+    DEFAULT_CHUNK_SIZE,
+    JsonlFormat,
+    generate_prompts_by_language,
+    generate_prompts_for_configs,
+    get_languages,
+    render_prompts_from_store,
+    write_prompt_store,
+)
+from lib.pilot.gm_eval.utils import (
+    detect_provider_from_model_id,
+    ensure_directory,
+    get_default_output_path,
+    get_jsonl_format_from_provider,
+    get_model_id_from_config_id,
+    logger,
+)
+from lib.pilot.jsonl_io import COMPRESSION_EXTENSIONS
 
 
 def add_arguments(parser: argparse.ArgumentParser) -> None:
@@ -26,16 +45,112 @@ def add_arguments(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
         "--model-config-id",
         type=str,
-        required=True,
-        help="ID of the model configuration to use",
+        nargs="+",
+        help="IDs of the model configurations to use, prompts are rendered once for all of them "
+        "(required unless --prompt-store is set)",
     )
     parser.add_argument(
         "--jsonl-format",
         type=str,
         choices=[f.value for f in JsonlFormat],
-        default=JsonlFormat.OPENAI.value,
-        help="Format of JSONL output (openai, vertex, or mistral)",
+        help="Format of JSONL output (openai, vertex, or mistral). Detected from each model's provider if not set",
+    )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        choices=["batch", "litellm"],
+        help="Processing mode the prompts are for (default: derived from the JSONL format)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help=f"Number of prompts rendered and written at once (default: {DEFAULT_CHUNK_SIZE})",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        choices=list(COMPRESSION_EXTENSIONS),
+        help="Compress the prompt files, responses and evaluation files follow (default: plain JSONL)",
+    )
+    parser.add_argument(
+        "--compact-ids",
+        action="store_true",
+        help="Use fixed-length hashed custom_ids, with a lookup table of their parts next to each prompt file",
+    )
+    parser.add_argument(
+        "--forecast",
+        action="store_true",
+        help="Print the input tokens, estimated cost and batch shards of each generated prompt file",
+    )
+    parser.add_argument(
+        "--by-language",
+        action="store_true",
+        help="Write a shard of each prompt file for each language, e.g. mc001-question_prompts-en-US.jsonl",
+    )
+    parser.add_argument(
+        "--language",
+        type=str,
+        nargs="+",
+        help="Only write the shards of these languages (implies --by-language)",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of worker processes rendering language shards in parallel (default: 1)",
     )
+    parser.add_argument(
+        "--prompt-store",
+        action="store_true",
+        help="Write the prompts once to question_prompts.parquet. The prompt files of the given model "
+        "configurations are rendered from it, the others are rendered by gm-eval send",
+    )
+
+
+def detect_jsonl_format(base_path: str, model_config_id: str, mode: Optional[str] = None) -> Optional[str]:
+    """
+    Detect the JSONL format of a model configuration from its provider.
+
+    Args:
+        base_path: Base directory containing ai_eval_sheets folder
+        model_config_id: Model configuration ID
+        mode: Processing mode, litellm mode always uses the openai format
+
+    Returns:
+        JSONL format, or None if the model configuration is not found
+    """
+    if mode == "litellm":
+        return JsonlFormat.OPENAI.value
+
+    prompt_path = get_default_output_path(model_config_id, base_path)
+    full_model_id = get_model_id_from_config_id(prompt_path, model_config_id, keep_provider_prefix=True)
+    if not full_model_id:
+        return None
+
+    provider, _ = detect_provider_from_model_id(full_model_id)
+    return get_jsonl_format_from_provider(provider)
+
+
+def _generate_from_prompt_store(args: argparse.Namespace, jsonl_formats: Dict[str, str]) -> Dict[str, List[str]]:
+    """Write the prompt table, or its language shards, and render the prompt files of the model configurations."""
+    languages: List[Optional[str]] = [None]
+    if args.language:
+        languages = list(args.language)
+    elif args.by_language:
+        languages = list(get_languages(pl.read_csv(os.path.join(args.base_path, "ai_eval_sheets", "questions.csv"))))
+
+    shard_paths: Dict[str, List[str]] = {model_config_id: [] for model_config_id in jsonl_formats}
+    for language in languages:
+        write_prompt_store(args.base_path, args.chunk_size, language)
+        if not jsonl_formats:
+            continue
+        paths = render_prompts_from_store(
+            args.base_path, jsonl_formats, args.mode, args.chunk_size, args.compression, args.compact_ids, language
+        )
+        for model_config_id, path in paths.items():
+            shard_paths[model_config_id].append(path)
+    return shard_paths
 
 
 def handle(args: argparse.Namespace) -> int:
@@ -50,9 +165,11 @@ def handle(args: argparse.Namespace) -> int:
     """
     try:
         base_path = args.base_path
-        model_config_id = args.model_config_id
-        jsonl_format = args.jsonl_format
+        model_config_ids = args.model_config_id or []
         mode = args.mode
+        chunk_size = args.chunk_size
+        compression = args.compression
+        compact_ids = args.compact_ids
 
         # Ensure the base path exists
         ensure_directory(base_path)
@@ -64,8 +181,34 @@ def handle(args: argparse.Namespace) -> int:
             logger.error("Please run the 'download' command first")
             return 1
 
-        # Run the generate prompts main function
-        generate_prompts_main(base_path, model_config_id, jsonl_format, mode)
+        if not model_config_ids and not args.prompt_store:
+            logger.error("--model-config-id is required unless --prompt-store is set")
+            return 1
+
+        jsonl_formats = {}
+        for model_config_id in model_config_ids:
+            jsonl_format = args.jsonl_format or detect_jsonl_format(base_path, model_config_id, mode)
+            if jsonl_format is None:
+                logger.error(f"Could not find model configuration for {model_config_id}")
+                return 1
+            logger.info(f"Using {jsonl_format} format for {model_config_id}")
+            jsonl_formats[model_config_id] = jsonl_format
+
+        # Render the prompts once and write the files of all model configurations
+        if args.prompt_store:
+            shard_paths = _generate_from_prompt_store(args, jsonl_formats)
+        elif args.by_language or args.language:
+            shard_paths = generate_prompts_by_language(
+                base_path, jsonl_formats, mode, chunk_size, compression, compact_ids, args.language, args.processes
+            )
+        else:
+            paths = generate_prompts_for_configs(base_path, jsonl_formats, mode, chunk_size, compression, compact_ids)
+            shard_paths = {model_config_id: [path] for model_config_id, path in paths.items()}
+
+        if args.forecast:
+            for model_config_id, model_paths in shard_paths.items():
+                for path in model_paths:
+                    forecast_model_config(path, model_config_id, mode)
 
         return 0
     except Exception as e:
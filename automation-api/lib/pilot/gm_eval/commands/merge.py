@@ -7,7 +7,9 @@ import json
 import os
 from typing import Dict
 
-from lib.pilot.gm_eval.utils import logger
+from lib.pilot.custom_ids import split_repeat_id
+from lib.pilot.gm_eval.utils import extract_language_from_filename, logger
+from lib.pilot.jsonl_io import open_jsonl
 
 
 def add_arguments(parser: argparse.ArgumentParser) -> None:
@@ -27,7 +29,7 @@ def load_all_responses(file_paths: list[str]) -> Dict[str, str]:
     """Load all responses into a dictionary indexed by custom_id."""
     merged_data = {}
     for file_path in file_paths:
-        with open(file_path, "r", encoding="utf-8") as f:
+        with open_jsonl(file_path) as f:
             for line in f:
                 try:
                     data = json.loads(line)
@@ -37,6 +39,12 @@ def load_all_responses(file_paths: list[str]) -> Dict[str, str]:
                 except json.JSONDecodeError:
                     logger.warning(f"Failed to parse line in {file_path}: {line.strip()}")
                     continue
+
+    # The samples of a multi-sample request replace the failed response of the request
+    for custom_id in list(merged_data):
+        base_id, repeat_index = split_repeat_id(custom_id)
+        if repeat_index is not None:
+            merged_data.pop(base_id, None)
     return merged_data
 
 
@@ -57,13 +65,19 @@ def handle(args: argparse.Namespace) -> int:
                 logger.error(f"Input file not found: {file_path}")
                 return 1
 
+        # A question has the same custom_ids in every language shard, their responses would replace each other
+        languages = {language for language in map(extract_language_from_filename, args.files) if language}
+        if len(languages) > 1:
+            logger.error(f"Can't merge files of different language shards: {', '.join(sorted(languages))}")
+            return 1
+
         # Load all responses (later files override earlier ones)
         merged_data = load_all_responses(args.files)
         if not merged_data:
             logger.warning("No valid responses found in any input files")
 
         # Write merged output
-        with open(args.output, "w", encoding="utf-8") as out_file:
+        with open_jsonl(args.output, "w") as out_file:
             for line in merged_data.values():
                 out_file.write(line + "\n")
 
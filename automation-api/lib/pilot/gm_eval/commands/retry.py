@@ -0,0 +1,246 @@
+"""
+Retry command for the gm-eval CLI tool. Resends failed and missing requests until all of them succeed.
+
+Each attempt combines the split, send and merge steps: requests whose responses failed or are
+missing are written to an attempt file, sent, and the responses are merged back into the
+canonical response file.
+"""
+
+import argparse
+import json
+import os
+from typing import Dict, List, Optional
+
+import polars as pl
+
+from lib.pilot.custom_ids import split_repeat_id
+from lib.pilot.gm_eval.commands.merge import load_all_responses
+from lib.pilot.gm_eval.commands.split import is_failed_response
+from lib.pilot.gm_eval.utils import get_response_path, logger, resolve_model_id_for_file
+from lib.pilot.jsonl_io import open_jsonl, split_jsonl_extension
+from lib.pilot.send_batch_prompt import PROVIDER_CLASSES, process_batch
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add command-specific arguments to the parser.
+
+    Args:
+        parser: Argument parser to add arguments to
+    """
+    parser.add_argument(
+        "--requests",
+        type=str,
+        required=True,
+        help="Path to original JSONL requests file",
+    )
+    parser.add_argument(
+        "--responses",
+        type=str,
+        help="Path to the canonical JSONL responses file (default: requests filename with '-response' suffix)",
+    )
+    parser.add_argument(
+        "--method",
+        type=str,
+        required=True,
+        choices=list(PROVIDER_CLASSES.keys()),
+        help="LLM provider to use for processing",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=3,
+        help="Maximum number of retry attempts (default: 3)",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of processes to use (default: 1)",
+    )
+    parser.add_argument(
+        "--provider",
+        type=str,
+        help="Custom provider name (e.g., alibaba)",
+    )
+    parser.add_argument(
+        "--model-id",
+        type=str,
+        help="Model ID to use (required for vertex AI and mistral)",
+    )
+    parser.add_argument(
+        "--timeout-hours",
+        type=int,
+        help="Number of hours after which the job should expire (default: 24, max: 168)",
+    )
+
+
+def _get_mapping_path(jsonl_path: str) -> str:
+    """Get the Vertex AI prompt mapping CSV path of a requests file."""
+    return f"{split_jsonl_extension(jsonl_path)[0]}-prompt-mapping.csv"
+
+
+def load_requests(requests_path: str) -> Dict[str, str]:
+    """
+    Load requests into a dictionary of request lines indexed by custom_id.
+
+    Vertex AI requests have no custom_id, so it is looked up from the prompt
+    mapping CSV next to the requests file.
+
+    Args:
+        requests_path: Path to the JSONL requests file
+
+    Returns:
+        Dictionary mapping custom_ids to request lines
+    """
+    text_to_id: Optional[Dict[str, str]] = None
+    mapping_path = _get_mapping_path(requests_path)
+    if os.path.isfile(mapping_path):
+        mapping = pl.read_csv(mapping_path)
+        text_to_id = dict(zip(mapping["prompt_text"], mapping["prompt_id"]))
+
+    requests = {}
+    with open_jsonl(requests_path) as f:
+        for line in f:
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Failed to parse request line: {line.strip()}")
+                continue
+
+            custom_id = request.get("custom_id")
+            if not custom_id and text_to_id is not None:
+                prompt_text = request["request"]["contents"][0]["parts"][0]["text"]
+                custom_id = text_to_id.get(prompt_text)
+            if custom_id:
+                requests[custom_id] = line.rstrip("\n")
+    return requests
+
+
+def get_ids_to_retry(request_ids: List[str], responses: Dict[str, str]) -> List[str]:
+    """
+    Find the requests which have to be sent again.
+
+    Args:
+        request_ids: custom_ids of all requests
+        responses: Response lines indexed by custom_id
+
+    Returns:
+        custom_ids of requests that failed or have no response at all
+    """
+    # Requests for several samples have a response for each sample instead of their own
+    sample_lines: Dict[str, List[str]] = {}
+    for response_id, line in responses.items():
+        base_id, repeat_index = split_repeat_id(response_id)
+        if repeat_index is not None:
+            sample_lines.setdefault(base_id, []).append(line)
+
+    ids_to_retry = []
+    for custom_id in request_ids:
+        lines = [responses[custom_id]] if custom_id in responses else sample_lines.get(custom_id, [])
+        if not lines or any(is_failed_response(json.loads(line)) for line in lines):
+            ids_to_retry.append(custom_id)
+    return ids_to_retry
+
+
+def write_attempt_file(requests: Dict[str, str], ids: List[str], attempt_path: str, requests_path: str) -> None:
+    """Write the requests to retry, and their prompt mapping for Vertex AI requests."""
+    with open(attempt_path, "w", encoding="utf-8") as f:
+        for custom_id in ids:
+            f.write(requests[custom_id] + "\n")
+
+    mapping_path = _get_mapping_path(requests_path)
+    if os.path.isfile(mapping_path):
+        pl.read_csv(mapping_path).filter(pl.col("prompt_id").is_in(ids)).write_csv(_get_mapping_path(attempt_path))
+
+
+def write_responses(responses: Dict[str, str], responses_path: str) -> None:
+    """Replace the canonical response file with the merged responses."""
+    # Keep the extension, so that the temporary file is compressed like the response file
+    base, ext = split_jsonl_extension(responses_path)
+    temp_path = f"{base}-temp{ext}"
+    with open_jsonl(temp_path, "w") as f:
+        for line in responses.values():
+            f.write(line + "\n")
+    os.replace(temp_path, responses_path)
+
+
+def remove_attempt_files(attempt_path: str) -> None:
+    """Remove the request, response and mapping files of a merged attempt."""
+    for path in [attempt_path, get_response_path(attempt_path), _get_mapping_path(attempt_path)]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def handle(args: argparse.Namespace) -> int:
+    """
+    Handle the retry command.
+
+    Args:
+        args: Parsed command-line arguments
+
+    Returns:
+        Exit code (0 when all requests succeeded, non-zero otherwise)
+    """
+    try:
+        if not os.path.isfile(args.requests):
+            logger.error(f"Requests file not found: {args.requests}")
+            return 1
+
+        # Set default responses path if not provided
+        if not args.responses:
+            args.responses = get_response_path(args.requests)
+            logger.info(f"Using default responses path: {args.responses}")
+
+        model_id = args.model_id
+        if model_id is None:
+            model_id = resolve_model_id_for_file(args.requests, args.method)
+
+        requests = load_requests(args.requests)
+        # Attempt files are short-lived, they are written uncompressed
+        base_path = split_jsonl_extension(args.requests)[0]
+
+        for attempt in range(1, args.max_retries + 1):
+            responses = load_all_responses([args.responses]) if os.path.isfile(args.responses) else {}
+            ids_to_retry = get_ids_to_retry(list(requests), responses)
+            if not ids_to_retry:
+                logger.info(f"All {len(requests)} requests succeeded")
+                return 0
+
+            logger.info(f"Attempt {attempt}/{args.max_retries}: retrying {len(ids_to_retry)} requests")
+            attempt_path = f"{base_path}-retry{attempt}.jsonl"
+            write_attempt_file(requests, ids_to_retry, attempt_path, args.requests)
+
+            process_batch(
+                attempt_path,
+                args.method,
+                True,  # Always wait, the responses are merged right after
+                args.processes,
+                args.provider,
+                model_id,
+                args.timeout_hours,
+            )
+
+            attempt_response_path = get_response_path(attempt_path)
+            if not os.path.isfile(attempt_response_path):
+                logger.warning(f"Attempt {attempt} produced no responses")
+                continue
+
+            # Later files override earlier ones, so retried responses replace the failed ones
+            response_files = [args.responses] if os.path.isfile(args.responses) else []
+            merged = load_all_responses(response_files + [attempt_response_path])
+            write_responses(merged, args.responses)
+            remove_attempt_files(attempt_path)
+
+        responses = load_all_responses([args.responses]) if os.path.isfile(args.responses) else {}
+        remaining = get_ids_to_retry(list(requests), responses)
+        if remaining:
+            logger.error(f"{len(remaining)} requests still failed after {args.max_retries} retries")
+            return 1
+
+        logger.info(f"All {len(requests)} requests succeeded")
+        return 0
+
+    except Exception as e:
+        logger.error(f"Error retrying requests: {str(e)}")
+        return 1
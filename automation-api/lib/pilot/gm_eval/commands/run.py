@@ -7,14 +7,31 @@ This command runs the experiment workflow in sequence:
 3. Send the batch to a provider
 4. Generate and send evaluation prompts
 
+Steps 2-4 are incremental: each step records content hashes of its inputs in the
+experiment directory and is rerun only when the inputs changed or its outputs are missing.
+
 Use 'gm-eval summarize' command separately when all experiments are complete.
 """
 
 import argparse
 import os
 from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple
+
+import polars as pl
 
+from lib.pilot.generate_eval_prompts import get_eval_prompts_path
+from lib.pilot.generate_prompts import DEFAULT_CHUNK_SIZE
 from lib.pilot.gm_eval.commands import download, evaluate, generate, send
+from lib.pilot.gm_eval.state import (
+    check_stage,
+    get_input_hashes,
+    hash_model_config,
+    invalidate_outputs,
+    load_state,
+    record_stage,
+    save_state,
+)
 from lib.pilot.gm_eval.utils import (
     detect_provider_from_model_id,
     ensure_directory,
@@ -24,6 +41,7 @@ from lib.pilot.gm_eval.utils import (
     get_response_path,
     logger,
 )
+from lib.pilot.jsonl_io import COMPRESSION_EXTENSIONS
 
 
 def add_arguments(parser: argparse.ArgumentParser) -> None:
@@ -89,6 +107,120 @@ def add_arguments(parser: argparse.ArgumentParser) -> None:
         action="store_true",
         help="Skip generating and sending evaluation prompts",
     )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        choices=list(COMPRESSION_EXTENSIONS),
+        help="Compress the prompt, response and evaluation JSONL files (default: plain JSONL)",
+    )
+    parser.add_argument(
+        "--compact-ids",
+        action="store_true",
+        help="Use fixed-length hashed custom_ids for prompts and evaluations",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rerun the generate, send and evaluate steps even if their inputs did not change",
+    )
+    parser.add_argument(
+        "--eval-cache",
+        type=str,
+        help="Folder of an evaluator result cache shared by experiments, e.g. ~/.cache/gm-eval/evals",
+    )
+    parser.add_argument(
+        "--prompt-caching",
+        action="store_true",
+        help="Put the evaluated response at the end of the evaluation prompts and mark the prefix before it "
+        "for prompt caching (Anthropic evaluators)",
+    )
+    parser.add_argument(
+        "--staged",
+        action="store_true",
+        help="Only send the evaluations the first evaluators don't agree on to the other evaluators",
+    )
+    parser.add_argument(
+        "--structured-output",
+        action="store_true",
+        help="Constrain the evaluators to answer with a JSON grade, with a small output token limit",
+    )
+
+
+class Stage(NamedTuple):
+    """A fingerprinted step of the run workflow."""
+
+    name: str
+    skip: bool
+    get_inputs: Callable[[], Dict[str, str]]
+    outputs: List[str]
+    # The step keeps the parts of its outputs that are still up to date itself, so they are
+    # not moved aside when its inputs change
+    incremental: bool = False
+
+
+def _get_stages(args: argparse.Namespace, jsonl_format: str, prompt_path: str, response_path: str) -> List[Stage]:
+    """Describe the generate, send and evaluate steps with their inputs and outputs."""
+    sheets_dir = os.path.join(args.output_dir, "ai_eval_sheets")
+
+    def sheet(name: str) -> str:
+        return os.path.join(sheets_dir, f"{name}.csv")
+
+    def generate_inputs() -> Dict[str, str]:
+        inputs = get_input_hashes(
+            {name: sheet(name) for name in ["questions", "question_options", "prompt_variations"]},
+            {"mode": args.mode, "jsonl_format": jsonl_format},
+        )
+        # Only fingerprint the id scheme when it is not the default, so existing experiments stay up to date
+        if args.compact_ids:
+            inputs["compact_ids"] = "true"
+        inputs["model_config"] = hash_model_config(sheets_dir, args.model_config_id)
+        return inputs
+
+    def send_inputs() -> Dict[str, str]:
+        return get_input_hashes({"prompts": prompt_path}, {"mode": args.mode})
+
+    def evaluate_inputs() -> Dict[str, str]:
+        return get_input_hashes(
+            {
+                "responses": response_path,
+                **{name: sheet(name) for name in ["questions", "question_options", "metrics", "evaluators"]},
+            },
+            {"mode": args.mode},
+        )
+
+    eval_response_paths = []
+    if os.path.isfile(sheet("evaluators")):
+        eval_response_paths = [
+            get_response_path(get_eval_prompts_path(args.output_dir, response_path, evaluator_id))
+            for evaluator_id in pl.read_csv(sheet("evaluators"))["evaluator_id"]
+        ]
+
+    return [
+        Stage("generate", args.skip_generate, generate_inputs, [prompt_path]),
+        Stage("send", args.skip_send, send_inputs, [response_path]),
+        Stage("evaluate", args.skip_evaluate, evaluate_inputs, eval_response_paths, incremental=True),
+    ]
+
+
+def _print_plan(stages: List[Stage], state: Dict[str, Dict[str, str]], model_config_id: str, force: bool) -> None:
+    """Print which steps will run. Steps after a running step are re-checked once it finishes."""
+    print("\n=== Plan ===")
+    running_upstream = None
+    for stage in stages:
+        if stage.skip:
+            status = f"skip (--skip-{stage.name})"
+        elif force:
+            status = "run (--force)"
+        elif running_upstream:
+            status = f"pending (re-checked after {running_upstream})"
+        else:
+            should_run, reason, _ = check_stage(
+                state, f"{stage.name}:{model_config_id}", stage.get_inputs(), stage.outputs
+            )
+            status = f"run ({reason})" if should_run else "skip (up to date)"
+            if should_run:
+                running_upstream = stage.name
+        print(f"  {stage.name}: {status}")
 
 
 def handle(args: argparse.Namespace) -> int:
@@ -121,7 +253,7 @@ def handle(args: argparse.Namespace) -> int:
             print("\n=== Step 1: Skipping download ===")
 
         # Get model configuration and detect provider/format
-        prompt_path = get_default_output_path(args.model_config_id, args.output_dir)
+        prompt_path = get_default_output_path(args.model_config_id, args.output_dir, args.compression)
         full_model_id = get_model_id_from_config_id(prompt_path, args.model_config_id, keep_provider_prefix=True)
 
         if not full_model_id:
@@ -138,59 +270,99 @@ def handle(args: argparse.Namespace) -> int:
 
         print(f"Detected provider: {provider}, format: {jsonl_format}")
 
-        # Step 2: Generate prompts
-        if not args.skip_generate:
-            print("\n=== Step 2: Generating prompts ===")
-            generate_args = argparse.Namespace(
-                base_path=args.output_dir,
-                model_config_id=args.model_config_id,
-                jsonl_format=jsonl_format,
-                mode=args.mode,
-            )
-            result = generate.handle(generate_args)
-            if result != 0:
-                return result
-        else:
-            print("\n=== Step 2: Skipping generate ===")
-
         # Get response path
         response_path = get_response_path(prompt_path)
 
-        # Step 3: Send prompts
-        if not args.skip_send:
-            print("\n=== Step 3: Sending prompts ===")
-
-            # Use the new mode-based send command
-            send_args = argparse.Namespace(
-                mode=args.mode,
-                model_config_id=args.model_config_id,
-                output_dir=args.output_dir,
-                wait=True,  # Always wait for send step
-                processes=args.processes,
-                timeout_hours=args.timeout_hours,
-                force_regenerate=False,  # Default to not force regenerate
-            )
-            result = send.handle(send_args)
-            if result != 0:
-                return result
-        else:
-            print("\n=== Step 3: Skipping send ===")
-
-        # Step 4: Generate and send evaluation prompts
-        if not args.skip_evaluate:
-            print("\n=== Step 4: Generating and sending evaluation prompts ===")
-            evaluate_args = argparse.Namespace(
-                response_file=response_path,
-                base_path=args.output_dir,
-                mode=args.mode,
-                send=True,  # Always send when running the full workflow
-                wait=args.wait,
-            )
-            result = evaluate.handle(evaluate_args)
+        stages = _get_stages(args, jsonl_format, prompt_path, response_path)
+        state = load_state(args.output_dir)
+        _print_plan(stages, state, args.model_config_id, args.force)
+
+        step_handlers: Dict[str, Callable[[], int]] = {
+            "generate": lambda: generate.handle(
+                argparse.Namespace(
+                    base_path=args.output_dir,
+                    model_config_id=[args.model_config_id],
+                    jsonl_format=jsonl_format,
+                    mode=args.mode,
+                    chunk_size=DEFAULT_CHUNK_SIZE,
+                    compression=args.compression,
+                    compact_ids=args.compact_ids,
+                    forecast=False,
+                    by_language=False,
+                    language=None,
+                    processes=1,
+                    prompt_store=False,
+                )
+            ),
+            # Always wait for send step, prompts are already generated by the generate step
+            "send": lambda: send.handle(
+                argparse.Namespace(
+                    mode=args.mode,
+                    model_config_id=args.model_config_id,
+                    output_dir=args.output_dir,
+                    wait=True,
+                    processes=args.processes,
+                    timeout_hours=args.timeout_hours,
+                    force_regenerate=False,
+                    forecast=False,
+                    compression=args.compression,
+                    compact_ids=args.compact_ids,
+                    language=None,
+                )
+            ),
+            # Always send when running the full workflow
+            "evaluate": lambda: evaluate.handle(
+                argparse.Namespace(
+                    response_file=[response_path],
+                    base_path=args.output_dir,
+                    mode=args.mode,
+                    send=True,
+                    wait=args.wait,
+                    processes=args.processes,
+                    eval_cache=args.eval_cache,
+                    prompt_caching=args.prompt_caching,
+                    staged=args.staged,
+                    structured_output=args.structured_output,
+                )
+            ),
+        }
+        step_titles = {
+            "generate": "Generating prompts",
+            "send": "Sending prompts",
+            "evaluate": "Generating and sending evaluation prompts",
+        }
+
+        # Steps 2-4: run each step whose inputs changed
+        for step_number, stage in enumerate(stages, start=2):
+            if stage.skip:
+                print(f"\n=== Step {step_number}: Skipping {stage.name} ===")
+                continue
+
+            stage_key = f"{stage.name}:{args.model_config_id}"
+            inputs = stage.get_inputs()
+            if args.force:
+                should_run, reason, outputs_stale = True, "--force", True
+            else:
+                should_run, reason, outputs_stale = check_stage(state, stage_key, inputs, stage.outputs)
+
+            if not should_run:
+                print(f"\n=== Step {step_number}: Skipping {stage.name} ({reason}) ===")
+                continue
+
+            print(f"\n=== Step {step_number}: {step_titles[stage.name]} ({reason}) ===")
+            if outputs_stale and not stage.incremental:
+                for path in invalidate_outputs(stage.outputs):
+                    logger.info(f"Moved outdated output aside: {path}")
+
+            result = step_handlers[stage.name]()
             if result != 0:
                 return result
-        else:
-            print("\n=== Step 4: Skipping evaluate ===")
+
+            # Only record steps which produced all their outputs, e.g. evaluation
+            # batches that were not waited for are checked again in the next run
+            if all(os.path.isfile(path) for path in stage.outputs):
+                record_stage(state, stage_key, inputs)
+                save_state(args.output_dir, state)
 
         print("\n=== Experiment completed successfully ===")
         print("\nTo summarize results after all experiments are complete, run:")
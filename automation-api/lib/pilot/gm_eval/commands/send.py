@@ -4,19 +4,31 @@ Enhanced with batch mode validation and auto-generate prompts functionality.
 """
 
 import argparse
+import glob
 import os
-
+from typing import Optional
+
+from lib.pilot.forecast import forecast_file, format_forecast
+from lib.pilot.generate_prompts import (
+    generate_prompts_by_language,
+    get_prompt_store_path,
+    is_prompt_store_current,
+    render_prompts_from_store,
+    write_prompt_store,
+)
 from lib.pilot.generate_prompts import main as generate_prompts_main
 from lib.pilot.gm_eval.utils import (
     detect_provider_from_model_id,
     get_default_output_path,
     get_jsonl_format_from_provider,
+    get_language_shard_path,
     get_model_id_from_config_id,
     get_provider_method_from_model_id,
     is_openai_compatible_provider,
     logger,
     transform_model_id,
 )
+from lib.pilot.jsonl_io import COMPRESSION_EXTENSIONS, find_jsonl_file
 from lib.pilot.send_batch_prompt import process_batch
 
 # Provider batch mode compatibility matrix
@@ -77,6 +89,27 @@ def add_arguments(parser: argparse.ArgumentParser) -> None:
         action="store_true",
         help="Force regeneration of prompts even if file exists",
     )
+    parser.add_argument(
+        "--forecast",
+        action="store_true",
+        help="Print the input tokens, estimated cost and batch shards of the prompts before sending",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        choices=list(COMPRESSION_EXTENSIONS),
+        help="Compression of the prompt file when it is generated or rendered from the prompt table",
+    )
+    parser.add_argument(
+        "--compact-ids",
+        action="store_true",
+        help="Use compact custom_ids when the prompt file is generated or rendered from the prompt table",
+    )
+    parser.add_argument(
+        "--language",
+        type=str,
+        help="Send the language shard of the prompts, e.g. en-US, of an experiment generated with --by-language",
+    )
 
 
 def validate_mode_compatibility(provider: str, mode: str) -> bool:
@@ -118,17 +151,31 @@ def get_suggested_mode(provider: str) -> str:
 
 
 def check_and_generate_prompts(
-    model_config_id: str, output_dir: str, provider: str, mode: str, force_regenerate: bool = False
+    model_config_id: str,
+    output_dir: str,
+    provider: str,
+    mode: str,
+    force_regenerate: bool = False,
+    compression: Optional[str] = None,
+    compact_ids: bool = False,
+    language: Optional[str] = None,
 ) -> str:
     """
     Check if prompts file exists and generate if needed.
 
+    Prompt files of experiments with a prompt table (gm-eval generate --prompt-store) are
+    rendered from the table, the others are generated from the AI eval sheets. A table
+    rendered from older sheets is written again first.
+
     Args:
         model_config_id: Model configuration ID
         output_dir: Output directory
         provider: Provider name
         mode: Processing mode
         force_regenerate: Force regeneration even if file exists
+        compression: Compression of a generated prompt file, None for plain JSONL
+        compact_ids: Use compact custom_ids in a generated prompt file
+        language: Use the language shard of the prompts, None for the prompts of all languages
 
     Returns:
         Path to the prompts file
@@ -136,7 +183,11 @@ def check_and_generate_prompts(
     Raises:
         Exception: If generation fails
     """
-    jsonl_file = get_default_output_path(model_config_id, output_dir)
+    # Use prompt files generated with compression too
+    prompt_path = get_default_output_path(model_config_id, output_dir, compression)
+    if language:
+        prompt_path = get_language_shard_path(prompt_path, language)
+    jsonl_file = find_jsonl_file(prompt_path)
 
     # Determine the correct JSONL format based on provider
     jsonl_format = get_jsonl_format_from_provider(provider)
@@ -144,7 +195,34 @@ def check_and_generate_prompts(
     # Check if we need to generate prompts
     should_generate = force_regenerate or not os.path.isfile(jsonl_file)
 
-    if should_generate:
+    store_path = get_prompt_store_path(output_dir, language)
+    if should_generate and not language and not os.path.isfile(store_path):
+        shard_stores = glob.glob(os.path.join(output_dir, "question_prompts-*.parquet"))
+        if shard_stores:
+            raise Exception(
+                f"The prompt table of {output_dir} is split by language ({len(shard_stores)} shards). "
+                "Please pass --language to send the prompts of one language."
+            )
+
+    if should_generate and os.path.isfile(store_path):
+        logger.info(f"Rendering prompts for {model_config_id} in {jsonl_format} format from the prompt table...")
+        try:
+            if not is_prompt_store_current(output_dir, language):
+                logger.info(f"AI eval sheets changed since {store_path} was written, writing it again...")
+                write_prompt_store(output_dir, language=language)
+            paths = render_prompts_from_store(
+                output_dir,
+                {model_config_id: jsonl_format},
+                mode,
+                compression=compression,
+                compact_ids=compact_ids,
+                language=language,
+            )
+            jsonl_file = paths[model_config_id]
+            logger.info(f"Successfully rendered prompts: {jsonl_file}")
+        except Exception as e:
+            raise Exception(f"Failed to render prompts: {str(e)}")
+    elif should_generate:
         logger.info(f"Generating prompts for {model_config_id} in {jsonl_format} format...")
 
         # Check if ai_eval_sheets directory exists
@@ -157,7 +235,24 @@ def check_and_generate_prompts(
 
         # Generate prompts using the existing generate command
         try:
-            generate_prompts_main(output_dir, model_config_id, jsonl_format, mode=mode)
+            if language:
+                generate_prompts_by_language(
+                    output_dir,
+                    {model_config_id: jsonl_format},
+                    mode,
+                    compression=compression,
+                    compact_ids=compact_ids,
+                    languages=[language],
+                )
+            else:
+                generate_prompts_main(
+                    output_dir,
+                    model_config_id,
+                    jsonl_format,
+                    mode=mode,
+                    compression=compression,
+                    compact_ids=compact_ids,
+                )
             logger.info(f"Successfully generated prompts: {jsonl_file}")
         except Exception as e:
             raise Exception(f"Failed to generate prompts: {str(e)}")
@@ -207,7 +302,14 @@ def handle(args: argparse.Namespace) -> int:
         # Auto-generate prompts if needed
         try:
             jsonl_file = check_and_generate_prompts(
-                args.model_config_id, args.output_dir, provider, args.mode, args.force_regenerate
+                args.model_config_id,
+                args.output_dir,
+                provider,
+                args.mode,
+                args.force_regenerate,
+                args.compression,
+                args.compact_ids,
+                args.language,
             )
         except Exception as e:
             logger.error(f"Error with prompts generation: {str(e)}")
@@ -226,6 +328,9 @@ def handle(args: argparse.Namespace) -> int:
         model_id_for_batch = transform_model_id(full_model_id, mode=args.mode)
         logger.info(f"Using model name for {args.mode} mode: {model_id_for_batch}")
 
+        if args.forecast:
+            print(format_forecast(forecast_file(jsonl_file, full_model_id, method, args.mode), full_model_id))
+
         # Determine provider name for OpenAI-compatible providers
         provider_name = None
         if is_openai_compatible_provider(provider):
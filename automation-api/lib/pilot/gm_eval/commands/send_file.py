@@ -6,11 +6,7 @@ This command sends a specific JSONL file to a provider.
 import argparse
 import os
 
-from lib.pilot.gm_eval.utils import (
-    extract_model_config_id_from_filename,
-    get_model_id_from_config_id,
-    logger,
-)
+from lib.pilot.gm_eval.utils import logger, resolve_model_id_for_file
 from lib.pilot.send_batch_prompt import PROVIDER_CLASSES, process_batch
 
 
@@ -79,18 +75,8 @@ def handle(args: argparse.Namespace) -> int:
 
         # If model_id is not provided and method is mistral or vertex, try to get it from the CSV file
         model_id = args.model_id
-        if model_id is None and args.method.lower() in ["mistral", "vertex"]:
-            # Extract model_config_id from the filename
-            model_config_id = extract_model_config_id_from_filename(args.jsonl_file)
-            if model_config_id:
-                # Look up the model_id in the CSV file
-                model_id = get_model_id_from_config_id(args.jsonl_file, model_config_id)
-                if model_id:
-                    logger.info(f"Using model_id '{model_id}' from config for {model_config_id}")
-                else:
-                    logger.warning(f"Could not find model_id for {model_config_id} in config file")
-            else:
-                logger.warning(f"Could not extract model_config_id from filename: {args.jsonl_file}")
+        if model_id is None:
+            model_id = resolve_model_id_for_file(args.jsonl_file, args.method)
 
         # Process the batch
         process_batch(
@@ -5,9 +5,10 @@ Split command for the gm-eval CLI tool. Extracts failed requests from original f
 import argparse
 import json
 import os
-from typing import Set
+from typing import Dict, Set
 
-from lib.pilot.gm_eval.utils import logger
+from lib.pilot.gm_eval.utils import get_response_path, logger
+from lib.pilot.jsonl_io import open_jsonl
 
 
 def add_arguments(parser: argparse.ArgumentParser) -> None:
@@ -26,15 +27,25 @@ def add_arguments(parser: argparse.ArgumentParser) -> None:
     parser.add_argument("--output", type=str, required=True, help="Path to output JSONL file for failed requests")
 
 
+def is_failed_response(response: Dict) -> bool:
+    """
+    Check if a response failed.
+
+    A response failed when it has an error or a status code other than 200. Vertex AI
+    responses have an empty status code when they succeed.
+    """
+    return bool(response.get("error")) or response.get("status_code", 200) not in (200, None, "")
+
+
 def _get_error_ids(responses_path: str) -> Set[str]:
     """Extract custom_ids from error responses."""
     error_ids = set()
 
-    with open(responses_path, "r", encoding="utf-8") as f:
+    with open_jsonl(responses_path) as f:
         for line in f:
             try:
                 response = json.loads(line)
-                if response.get("error") or response.get("status_code", 200) != 200:
+                if is_failed_response(response):
                     custom_id = response.get("custom_id")
                     if custom_id:
                         error_ids.add(custom_id)
@@ -63,8 +74,7 @@ def handle(args: argparse.Namespace) -> int:
 
         # Set default responses path if not provided
         if not args.responses:
-            base_path = os.path.splitext(args.requests)[0]
-            args.responses = f"{base_path}-response.jsonl"
+            args.responses = get_response_path(args.requests)
             logger.info(f"Using default responses path: {args.responses}")
 
         if not os.path.isfile(args.responses):
@@ -79,9 +89,7 @@ def handle(args: argparse.Namespace) -> int:
 
         # Write matching requests to output file
         count = 0
-        with open(args.output, "w", encoding="utf-8") as out_file, open(
-            args.requests, "r", encoding="utf-8"
-        ) as in_file:
+        with open_jsonl(args.output, "w") as out_file, open_jsonl(args.requests) as in_file:
             for line in in_file:
                 try:
                     request = json.loads(line)
@@ -0,0 +1,183 @@
+"""
+Input fingerprints for make-style incremental execution of the gm-eval workflow.
+
+Each stage of `gm-eval run` records content hashes of its inputs in a state file
+in the experiment directory. A stage is rerun only when its inputs changed since
+the last successful run, or when its outputs are missing.
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import polars as pl
+
+STATE_FILE = ".gm-eval-state.json"
+STALE_SUFFIX = ".stale"
+
+
+class StageStatus(NamedTuple):
+    """Result of checking a stage against its recorded fingerprints."""
+
+    should_run: bool
+    reason: str
+    outputs_stale: bool
+
+
+def hash_file(path: str) -> str:
+    """
+    Compute the content hash of a file.
+
+    Args:
+        path: Path to the file
+
+    Returns:
+        Hex digest of the file content, or an empty string if the file does not exist
+    """
+    if not os.path.isfile(path):
+        return ""
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_value(value: Any) -> str:
+    """Compute the hash of a JSON serialisable value."""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def hash_model_config(sheets_dir: str, model_config_id: str) -> str:
+    """
+    Compute the hash of a model configuration row in gen_ai_model_configs.csv.
+
+    Args:
+        sheets_dir: Path to the ai_eval_sheets directory
+        model_config_id: Model configuration ID
+
+    Returns:
+        Hash of the row, or an empty string if the config is not found
+    """
+    config_path = os.path.join(sheets_dir, "gen_ai_model_configs.csv")
+    if not os.path.isfile(config_path):
+        return ""
+
+    rows = pl.read_csv(config_path).filter(pl.col("model_config_id") == model_config_id).to_dicts()
+    if not rows:
+        return ""
+    return hash_value(rows[0])
+
+
+def load_state(directory: str) -> Dict[str, Dict[str, str]]:
+    """Load the recorded stage fingerprints of an experiment directory."""
+    state_path = os.path.join(directory, STATE_FILE)
+    if not os.path.isfile(state_path):
+        return {}
+    with open(state_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(directory: str, state: Dict[str, Dict[str, str]]) -> None:
+    """Save the stage fingerprints of an experiment directory."""
+    state_path = os.path.join(directory, STATE_FILE)
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def get_changed_inputs(state: Dict[str, Dict[str, str]], stage_key: str, inputs: Dict[str, str]) -> List[str]:
+    """
+    Compare the inputs of a stage with the recorded fingerprints.
+
+    Args:
+        state: Recorded fingerprints, as returned by load_state
+        stage_key: Key of the stage, e.g. "generate:mc049"
+        inputs: Mapping of input names to their current hashes
+
+    Returns:
+        Names of the inputs that differ from the recorded ones (all inputs if the
+        stage was never recorded)
+    """
+    recorded = state.get(stage_key)
+    if recorded is None:
+        return sorted(inputs)
+    return sorted(name for name, digest in inputs.items() if recorded.get(name) != digest)
+
+
+def check_stage(
+    state: Dict[str, Dict[str, str]], stage_key: str, inputs: Dict[str, str], outputs: List[str]
+) -> StageStatus:
+    """
+    Decide whether a stage needs to run.
+
+    Outputs are only considered stale when the stage was recorded before with different
+    inputs. Outputs of a stage that was never recorded are left for the stage itself to
+    reuse or overwrite, as in a run without fingerprints.
+
+    Args:
+        state: Recorded fingerprints
+        stage_key: Key of the stage
+        inputs: Mapping of input names to their current hashes
+        outputs: Paths of the files the stage produces
+
+    Returns:
+        StageStatus of the stage
+    """
+    if stage_key not in state:
+        return StageStatus(True, "no recorded run", False)
+
+    changed = get_changed_inputs(state, stage_key, inputs)
+    if changed:
+        return StageStatus(True, f"inputs changed: {', '.join(changed)}", True)
+
+    missing = [os.path.basename(path) for path in outputs if not os.path.isfile(path)]
+    if missing:
+        return StageStatus(True, f"outputs missing: {', '.join(missing)}", False)
+
+    return StageStatus(False, "up to date", False)
+
+
+def record_stage(state: Dict[str, Dict[str, str]], stage_key: str, inputs: Dict[str, str]) -> None:
+    """Record the inputs of a successfully completed stage."""
+    state[stage_key] = dict(inputs)
+
+
+def invalidate_outputs(outputs: List[str]) -> List[str]:
+    """
+    Move stale outputs aside so they are not reused by the next run of a stage.
+
+    Pending batch markers (`.processing` files) of the outputs are moved as well,
+    otherwise a batch job of the outdated inputs would be resumed.
+
+    Args:
+        outputs: Paths of the outdated output files
+
+    Returns:
+        Paths of the files that were moved
+    """
+    moved = []
+    for path in outputs:
+        for stale_path in (path, f"{path}.processing"):
+            if os.path.isfile(stale_path):
+                os.replace(stale_path, f"{stale_path}{STALE_SUFFIX}")
+                moved.append(stale_path)
+    return moved
+
+
+def get_input_hashes(paths: Dict[str, str], extra: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+    """
+    Build the input fingerprints of a stage.
+
+    Args:
+        paths: Mapping of input names to file paths
+        extra: Mapping of input names to other values (e.g. the processing mode)
+
+    Returns:
+        Mapping of input names to hashes
+    """
+    inputs = {name: hash_file(path) for name, path in paths.items()}
+    for name, value in (extra or {}).items():
+        inputs[name] = hash_value(value)
+    return inputs
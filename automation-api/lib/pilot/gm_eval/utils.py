@@ -10,9 +10,13 @@ from typing import Optional, Tuple
 import pandas as pd
 
 from lib.app_singleton import AppSingleton
+from lib.pilot.jsonl_io import get_jsonl_extension, split_jsonl_extension
 
 logger = AppSingleton().get_logger()
 
+# Language tags in the names of language shard files, e.g. "en-US" or "zh-Hans-CN"
+LANGUAGE_TAG_PATTERN = r"[a-z]{2,3}(?:-[A-Z][a-z]{3})?(?:-(?:[A-Z]{2}|[0-9]{3}))?"
+
 
 def ensure_directory(directory: Optional[str] = None) -> Path:
     """
@@ -32,18 +36,19 @@ def ensure_directory(directory: Optional[str] = None) -> Path:
     return path
 
 
-def get_default_output_path(model_config_id: str, base_path: str = ".") -> str:
+def get_default_output_path(model_config_id: str, base_path: str = ".", compression: Optional[str] = None) -> str:
     """
     Get the default output path for a model config.
 
     Args:
         model_config_id: Model configuration ID
         base_path: Base directory path
+        compression: Compression of the file ("gzip" or "zstd"), None for plain JSONL
 
     Returns:
         Path to the output file
     """
-    return os.path.join(base_path, f"{model_config_id}-question_prompts.jsonl")
+    return os.path.join(base_path, f"{model_config_id}-question_prompts{get_jsonl_extension(compression)}")
 
 
 def get_response_path(prompt_path: str) -> str:
@@ -56,10 +61,39 @@ def get_response_path(prompt_path: str) -> str:
     Returns:
         Path to the response file
     """
-    base, ext = os.path.splitext(prompt_path)
+    base, ext = split_jsonl_extension(prompt_path)
     return f"{base}-response{ext}"
 
 
+def get_language_shard_path(prompt_path: str, language: str) -> str:
+    """
+    Get the path of the language shard of a prompt file.
+
+    Args:
+        prompt_path: Path to the prompt file, e.g. "mc001-question_prompts.jsonl"
+        language: Language of the shard, e.g. "en-US"
+
+    Returns:
+        Path to the shard, e.g. "mc001-question_prompts-en-US.jsonl"
+    """
+    base, ext = split_jsonl_extension(prompt_path)
+    return f"{base}-{language}{ext}"
+
+
+def extract_language_from_filename(filename: str) -> Optional[str]:
+    """
+    Extract the language of a language shard, or of the response and evaluation files of one.
+
+    Args:
+        filename: Filename to extract from (e.g., "mc001-question_prompts-en-US-response.jsonl")
+
+    Returns:
+        Language of the shard, or None for files with all languages
+    """
+    match = re.search(rf"-question_prompts-(?P<language>{LANGUAGE_TAG_PATTERN})(?=[-.]|$)", os.path.basename(filename))
+    return match.group("language") if match else None
+
+
 def extract_model_config_id_from_filename(filename: str) -> Optional[str]:
     """
     Extract the model config ID from a filename.
@@ -127,6 +161,35 @@ def get_model_id_from_config_id(
         return None
 
 
+def resolve_model_id_for_file(jsonl_file: str, method: str) -> Optional[str]:
+    """
+    Look up the model ID for a prompts file when the method needs it (mistral and vertex).
+
+    Args:
+        jsonl_file: Path to the JSONL file, named after its model config ID
+        method: Provider method name
+
+    Returns:
+        Model ID, or None if it is not needed or could not be found
+    """
+    if method.lower() not in ["mistral", "vertex"]:
+        return None
+
+    # Extract model_config_id from the filename
+    model_config_id = extract_model_config_id_from_filename(jsonl_file)
+    if not model_config_id:
+        logger.warning(f"Could not extract model_config_id from filename: {jsonl_file}")
+        return None
+
+    # Look up the model_id in the CSV file
+    model_id = get_model_id_from_config_id(jsonl_file, model_config_id)
+    if model_id:
+        logger.info(f"Using model_id '{model_id}' from config for {model_config_id}")
+    else:
+        logger.warning(f"Could not find model_id for {model_config_id} in config file")
+    return model_id
+
+
 def detect_provider_from_model_id(model_id: str) -> Tuple[str, str]:
     """
     Detect provider and model name from a model ID with provider prefix.
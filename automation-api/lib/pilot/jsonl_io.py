@@ -0,0 +1,124 @@
+"""
+Read and write JSONL files which may be compressed.
+
+The compression is chosen from the file extension: `.jsonl.gz` files are gzip
+compressed, `.jsonl.zst` files are zstd compressed and any other file is read as
+plain UTF-8 text.
+"""
+
+import gzip
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import IO, Iterator, Optional, Tuple, cast
+
+import zstandard
+
+# Extensions of JSONL files, compressed ones first so that they match before ".jsonl"
+COMPRESSION_EXTENSIONS = {"gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+JSONL_EXTENSIONS = (*COMPRESSION_EXTENSIONS.values(), ".jsonl")
+
+
+def get_jsonl_extension(compression: Optional[str] = None) -> str:
+    """
+    Get the file extension of JSONL files with the given compression.
+
+    Args:
+        compression: "gzip", "zstd", or None for plain JSONL
+
+    Returns:
+        File extension, e.g. ".jsonl.gz"
+    """
+    if compression is None or compression == "none":
+        return ".jsonl"
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Unsupported compression: {compression}. Use one of {list(COMPRESSION_EXTENSIONS)}")
+    return COMPRESSION_EXTENSIONS[compression]
+
+
+def split_jsonl_extension(path: str) -> Tuple[str, str]:
+    """
+    Split a path into its base and JSONL extension, including the compression suffix.
+
+    Args:
+        path: File path, e.g. "mc001-question_prompts.jsonl.gz"
+
+    Returns:
+        Tuple of (base, extension), e.g. ("mc001-question_prompts", ".jsonl.gz").
+        Paths without JSONL extension are split by os.path.splitext.
+    """
+    for ext in JSONL_EXTENSIONS:
+        if path.endswith(ext):
+            return path[: -len(ext)], ext
+    return os.path.splitext(path)
+
+
+def is_compressed(path: str) -> bool:
+    """Check whether a path has a compressed JSONL extension."""
+    return split_jsonl_extension(path)[1] in COMPRESSION_EXTENSIONS.values()
+
+
+def find_jsonl_file(path: str) -> str:
+    """
+    Find an existing JSONL file, trying compressed variants of the path.
+
+    Args:
+        path: Path of the JSONL file, with any JSONL extension
+
+    Returns:
+        The path itself if it exists or no variant exists, otherwise the first existing variant
+    """
+    if os.path.isfile(path):
+        return path
+    base, _ = split_jsonl_extension(path)
+    for ext in JSONL_EXTENSIONS:
+        if os.path.isfile(f"{base}{ext}"):
+            return f"{base}{ext}"
+    return path
+
+
+def open_jsonl(path: str, mode: str = "r") -> IO[str]:
+    """
+    Open a JSONL file as UTF-8 text, decompressing or compressing it based on its extension.
+
+    Args:
+        path: Path of the file
+        mode: "r", "w" or "a"
+
+    Returns:
+        Text file object
+    """
+    ext = split_jsonl_extension(path)[1]
+    # Both open a TextIOWrapper in text mode, their annotations also cover binary mode
+    if ext == COMPRESSION_EXTENSIONS["gzip"]:
+        return cast(IO[str], gzip.open(path, f"{mode}t", encoding="utf-8"))
+    if ext == COMPRESSION_EXTENSIONS["zstd"]:
+        return cast(IO[str], zstandard.open(path, f"{mode}t", encoding="utf-8"))
+    return open(path, mode, encoding="utf-8")
+
+
+@contextmanager
+def plain_jsonl_file(path: str) -> Iterator[str]:
+    """
+    Provide an uncompressed copy of a JSONL file, for providers that only accept plain JSONL uploads.
+
+    Plain JSONL files are used as they are. Compressed files are decompressed to a temporary
+    file with a `.jsonl` extension, which is removed on exit.
+
+    Args:
+        path: Path of the JSONL file
+
+    Yields:
+        Path of the plain JSONL file
+    """
+    if not is_compressed(path):
+        yield path
+        return
+
+    base, _ = split_jsonl_extension(os.path.basename(path))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        plain_path = os.path.join(temp_dir, f"{base}.jsonl")
+        with open_jsonl(path) as src, open(plain_path, "w", encoding="utf-8") as dst:
+            shutil.copyfileobj(src, dst)
+        yield plain_path
@@ -0,0 +1,54 @@
+"""
+Write Parquet files chunk by chunk.
+
+Polars can't append to a Parquet file, so each chunk is written to a part file and the
+parts are combined into the file with a streaming sink when all chunks are written.
+"""
+
+import os
+import tempfile
+from typing import Any, Dict, List, Optional, Type
+
+import polars as pl
+
+
+class ParquetChunkWriter:
+    """
+    Write a Parquet file chunk by chunk, without keeping it in memory.
+
+    Use as a context manager: the parts are combined into the file on a clean exit, and
+    dropped when an exception is raised.
+    """
+
+    def __init__(self, path: str, schema: Dict[str, Any]):
+        self.path = path
+        self.schema = schema
+        self._parts_dir = tempfile.TemporaryDirectory(dir=os.path.dirname(path) or ".")
+        self._parts: List[str] = []
+
+    def write(self, frame: pl.DataFrame) -> None:
+        """Write the rows of a chunk."""
+        part_path = os.path.join(self._parts_dir.name, f"part-{len(self._parts):06d}.parquet")
+        frame.select(list(self.schema)).write_parquet(part_path)
+        self._parts.append(part_path)
+
+    def close(self) -> None:
+        """Combine the parts into the Parquet file."""
+        try:
+            if self._parts:
+                pl.scan_parquet(self._parts).sink_parquet(self.path)
+            else:
+                pl.DataFrame(schema=self.schema).write_parquet(self.path)
+        finally:
+            self._parts_dir.cleanup()
+
+    def __enter__(self) -> "ParquetChunkWriter":
+        return self
+
+    def __exit__(
+        self, exc_type: Optional[Type[BaseException]], exc_value: Optional[BaseException], traceback: Any
+    ) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._parts_dir.cleanup()
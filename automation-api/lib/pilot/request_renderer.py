@@ -0,0 +1,58 @@
+"""
+Render JSONL batch requests that only differ in a few string fields.
+
+The request envelope (model, parameters, URL, safety settings...) is serialised once,
+and each line only escapes the variable fields and splices them into the envelope.
+The rendered lines are identical to `json.dumps(request, ensure_ascii=False)`.
+"""
+
+import json
+import re
+from json.encoder import encode_basestring
+from typing import Callable, Dict, List, Sequence
+
+
+class RequestRenderer:
+    """Pre-serialised request envelope with slots for variable string fields."""
+
+    def __init__(self, build_request: Callable[[Dict[str, str]], dict], fields: Sequence[str]) -> None:
+        """
+        Serialise the envelope of the requests built by `build_request`.
+
+        Args:
+            build_request: Function building the request object of a row of field values.
+                Field values may be used as whole strings or as parts of strings.
+            fields: Names of the variable fields
+        """
+        # Markers contain NUL characters, which json escapes and real values don't contain
+        markers = {field: f"\x00{field}\x00" for field in fields}
+        envelope = json.dumps(build_request(markers), ensure_ascii=False)
+
+        escaped_markers = {encode_basestring(marker)[1:-1]: field for field, marker in markers.items()}
+        pattern = re.compile("|".join(re.escape(marker) for marker in escaped_markers))
+
+        self._parts: List[str] = []
+        self._fields: List[str] = []
+        position = 0
+        for match in pattern.finditer(envelope):
+            self._parts.append(envelope[position : match.start()])
+            self._fields.append(escaped_markers[match.group()])
+            position = match.end()
+        self._parts.append(envelope[position:])
+
+    def render(self, values: Dict[str, str]) -> str:
+        """
+        Render the JSON line of a request.
+
+        Args:
+            values: Mapping of field names to their string values
+
+        Returns:
+            The serialised request, without trailing newline
+        """
+        pieces = [self._parts[0]]
+        for field, part in zip(self._fields, self._parts[1:]):
+            # encode_basestring is json's escaping of strings with ensure_ascii=False
+            pieces.append(encode_basestring(values[field])[1:-1])
+            pieces.append(part)
+        return "".join(pieces)
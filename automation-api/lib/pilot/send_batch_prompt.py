@@ -1,29 +1,34 @@
 """Main entry point for batch prompt processing with LLM providers."""
 
 import argparse
-from typing import Dict, Optional, Type
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait as wait_for_futures
+from typing import Dict, List, Optional, Type
 
 from lib.app_singleton import AppSingleton
 from lib.config import read_config
-from lib.pilot.batchjob.anthropic import AnthropicBatchJob
 from lib.pilot.batchjob.base import BaseBatchJob
-from lib.pilot.batchjob.litellm import LiteLLMBatchJob
-from lib.pilot.batchjob.mistral import MistralBatchJob
-from lib.pilot.batchjob.openai import OpenAIBatchJob
-from lib.pilot.batchjob.vertex import VertexBatchJob
 
 logger = AppSingleton().get_logger()
 
-# Map provider names to their batch job classes
-PROVIDER_CLASSES: Dict[str, Type] = {
-    "openai": OpenAIBatchJob,
-    "anthropic": AnthropicBatchJob,
-    "vertex": VertexBatchJob,
-    "litellm": LiteLLMBatchJob,
-    "mistral": MistralBatchJob,
+# Map provider names to their batch job classes, as "module:class".
+# Classes are imported on first use, so a provider SDK is only loaded when its jobs are created.
+PROVIDER_CLASSES: Dict[str, str] = {
+    "openai": "lib.pilot.batchjob.openai:OpenAIBatchJob",
+    "anthropic": "lib.pilot.batchjob.anthropic:AnthropicBatchJob",
+    "vertex": "lib.pilot.batchjob.vertex:VertexBatchJob",
+    "litellm": "lib.pilot.batchjob.litellm:LiteLLMBatchJob",
+    "mistral": "lib.pilot.batchjob.mistral:MistralBatchJob",
 }
 
 
+def get_provider_class(method: str) -> Type[BaseBatchJob]:
+    """Import and return the batch job class of a provider."""
+    module_name, class_name = PROVIDER_CLASSES[method.lower()].split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
 def parse_args():
     """Parse command line arguments."""
     parser = argparse.ArgumentParser(description="Send JSONL prompts to LLM batch APIs")
@@ -64,6 +69,39 @@ def parse_args():
     return parser.parse_args()
 
 
+def create_batch_job(
+    jsonl_file: str,
+    method: str,
+    processes: int = 1,
+    provider: Optional[str] = None,
+    model_id: Optional[str] = None,
+    timeout_hours: Optional[int] = None,
+) -> BaseBatchJob:
+    """Create the batch job instance for the given method."""
+    method = method.lower()
+    if method not in PROVIDER_CLASSES:
+        method = "litellm"
+    job_class: Type = get_provider_class(method)
+    if method == "openai":
+        if provider:
+            return job_class(jsonl_file, provider=provider.lower())
+        return job_class(jsonl_file)
+    elif method == "anthropic":
+        return job_class(jsonl_file)
+    elif method == "vertex":
+        if not model_id:
+            raise ValueError("Please provide model id (--model-id) for vertex AI")
+        return job_class(jsonl_file, model_id)
+    elif method == "mistral":
+        if not model_id:
+            raise ValueError("Please provide model id (--model-id) for mistral")
+        return job_class(jsonl_file, model_id=model_id, timeout_hours=timeout_hours)
+    else:
+        if provider:
+            return job_class(jsonl_file, provider=provider.lower(), num_processes=processes)
+        return job_class(jsonl_file, num_processes=processes)
+
+
 def process_batch(
     jsonl_file: str,
     method: str,
@@ -80,28 +118,7 @@ def process_batch(
 
         method = method.lower()
         # Create batch job instance
-        if method == "openai":
-            if provider:
-                provider = provider.lower()
-                batch_job: BaseBatchJob = OpenAIBatchJob(jsonl_file, provider=provider)
-            else:
-                batch_job = OpenAIBatchJob(jsonl_file)
-        elif method == "anthropic":
-            batch_job = AnthropicBatchJob(jsonl_file)
-        elif method == "vertex":
-            if not model_id:
-                raise ValueError("Please provide model id (--model-id) for vertex AI")
-            batch_job = VertexBatchJob(jsonl_file, model_id)
-        elif method == "mistral":
-            if not model_id:
-                raise ValueError("Please provide model id (--model-id) for mistral")
-            batch_job = MistralBatchJob(jsonl_file, model_id=model_id, timeout_hours=timeout_hours)
-        else:
-            if provider:
-                provider = provider.lower()
-                batch_job = LiteLLMBatchJob(jsonl_file, provider=provider, num_processes=processes)
-            else:
-                batch_job = LiteLLMBatchJob(jsonl_file, num_processes=processes)
+        batch_job = create_batch_job(jsonl_file, method, processes, provider, model_id, timeout_hours)
 
         # Send the batch
         batch_id = batch_job.send()
@@ -141,6 +158,94 @@ def process_batch(
         raise
 
 
+def wait_for_batch_jobs(batch_jobs: List[BaseBatchJob], timeout: float = 1.0) -> List[Optional[str]]:
+    """
+    Wait for several batch jobs concurrently.
+
+    The jobs are polled in worker threads, while the main thread only waits for them with a
+    timeout, so Ctrl+C stops waiting right away. On Ctrl+C all jobs stop polling and keep their
+    processing files, so rerunning the command picks the batches up again.
+
+    Args:
+        batch_jobs: Submitted batch jobs
+        timeout: Seconds between checks of the main thread
+
+    Returns:
+        The result paths of wait_for_completion, in the order of batch_jobs
+    """
+    executor = ThreadPoolExecutor(max_workers=len(batch_jobs))
+    futures = [executor.submit(job.wait_for_completion) for job in batch_jobs]
+    try:
+        not_done = set(futures)
+        while not_done:
+            _, not_done = wait_for_futures(not_done, timeout=timeout)
+    except KeyboardInterrupt:
+        for job in batch_jobs:
+            job.stop_waiting()
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+    return [future.result() for future in futures]
+
+
+def process_batches(batch_jobs: List[BaseBatchJob], wait: bool = False, processes: int = 1) -> None:
+    """
+    Submit several batch jobs at once and optionally wait for all of them together.
+
+    Provider batch jobs are all submitted before any of them is waited on, and then
+    polled concurrently. LiteLLM jobs are processed together under a shared pool of
+    `processes` workers.
+
+    Args:
+        batch_jobs: Batch jobs created with create_batch_job
+        wait: Wait for provider batch jobs to complete and download results
+        processes: Number of processes shared by all LiteLLM jobs
+    """
+    try:
+        read_config()
+
+        litellm_jobs: List = [job for job in batch_jobs if job.synchronous]
+        provider_jobs = [job for job in batch_jobs if not job.synchronous]
+
+        # Submit all provider batches first, so no batch waits on another one to finish
+        jobs_to_wait = []
+        for batch_job in provider_jobs:
+            batch_id = batch_job.send()
+            if batch_job.is_completed and batch_id == batch_job.output_path:
+                print(f"Results already available at: {batch_job.output_path}")
+            else:
+                print(f"Batch ID: {batch_id}")
+                jobs_to_wait.append(batch_job)
+
+        if jobs_to_wait:
+            if wait:
+                logger.info(f"Waiting for {len(jobs_to_wait)} batches to complete...")
+                logger.info("If you're using batch mode, you can stop this command with Ctrl+C")
+                logger.info("and rerun it later with the same parameters to check if results are ready.")
+            else:
+                logger.info("Batch jobs submitted successfully. Results will be available later.")
+                logger.info("You can rerun this command with the same parameters and --wait to check for results.")
+
+        # LiteLLM jobs run synchronously, so they overlap with the provider batches in flight
+        if litellm_jobs:
+            from lib.pilot.batchjob.litellm import send_batch_jobs as send_litellm_batch_jobs
+
+            for result_path in send_litellm_batch_jobs(litellm_jobs, num_processes=processes):
+                print(f"Results saved to: {result_path}")
+
+        if wait and jobs_to_wait:
+            results = wait_for_batch_jobs(jobs_to_wait)
+            for batch_job, output_path in zip(jobs_to_wait, results):
+                if output_path:
+                    print(f"Results saved to: {output_path}")
+                else:
+                    print(f"Batch processing failed or was cancelled: {batch_job.jsonl_path}")
+
+    except Exception as e:
+        logger.error(f"Error processing batches: {str(e)}")
+        raise
+
+
 def main():
     """Command line interface for batch processing."""
     args = parse_args()
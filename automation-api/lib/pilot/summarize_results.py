@@ -8,12 +8,25 @@ import logging
 import re
 from glob import glob
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import polars as pl
 
+from lib.pilot.custom_ids import load_lookup, split_readable_id, split_repeat_id
+from lib.pilot.gm_eval.utils import LANGUAGE_TAG_PATTERN, extract_language_from_filename
+from lib.pilot.jsonl_io import open_jsonl
+
 logger = logging.getLogger(__name__)
 
+# Columns identifying a response, repeated samples of a prompt have their own repeat_index
+RESPONSE_KEYS = ["model_config_id", "question_id", "prompt_variation_id", "repeat_index"]
+
+# Scores of the letter grades given by evaluators
+GRADE_SCORES = {"A": 0, "B": 1, "C": 2, "D": 3}
+
+# Field with the grade in the JSON responses of structured-output evaluators
+GRADE_FIELD = "grade"
+
 # Global dictionary to cache evaluator prefixes loaded from CSV
 _evaluator_prefixes: Optional[Dict[str, str]] = None
 
@@ -111,20 +124,27 @@ def get_evaluator_prefix(evaluator_id: str, prefixes: Optional[Dict[str, str]] =
 # TODO: use information from evaluators.csv from ai eval sheet to
 # find out if all evals are run
 def find_file_groups(folder: Path) -> Dict[str, Tuple[Path, List[Path]]]:
-    """Group response files with their corresponding eval files."""
+    """
+    Group response files with their corresponding eval files.
+
+    Groups are keyed by model config ID, and language for the files of language shards.
+    """
     file_pattern = re.compile(
-        r"(?P<model_id>.+?)-question_prompts-response" r"(-eval-prompts-(?P<evaluator_id>.+?)-response)?\.jsonl$"
+        rf"(?P<model_id>.+?)-question_prompts(-(?P<language>{LANGUAGE_TAG_PATTERN}))?-response"
+        r"(-eval-prompts-(?P<evaluator_id>.+?)-response)?\.jsonl(\.gz|\.zst)?$"
     )
 
     groups: Dict[str, Tuple[Path, List[Path]]] = {}
     eval_files = []
 
-    for path in folder.glob("*.jsonl"):
+    for path in folder.glob("*.jsonl*"):
         match = file_pattern.match(path.name)
         if not match:
             continue
 
         model_id = match.group("model_id")
+        if match.group("language"):
+            model_id = f"{model_id}-{match.group('language')}"
         if not match.group("evaluator_id"):
             groups[model_id] = (path, [])
         else:
@@ -140,15 +160,18 @@ def find_file_groups(folder: Path) -> Dict[str, Tuple[Path, List[Path]]]:
 
 def load_jsonl(file_path: Path) -> List[Dict]:
     """Load a JSONL file into a list of dictionaries."""
-    with file_path.open(encoding="utf-8") as f:
+    with open_jsonl(str(file_path)) as f:
         return [json.loads(line) for line in f]
 
 
-def extract_custom_id_info(custom_id: str, expected_model_config_id: str) -> Dict[str, str]:
-    """Extract info from custom_id and validate model_config_id matches expected"""
-    parts = custom_id.split("-")
-    excludes = ["question", "q", "eval"]
-    parts = [x for x in parts if x not in excludes]
+def extract_custom_id_info(custom_id: str, expected_model_config_id: str) -> Dict[str, Any]:
+    """
+    Extract info from custom_id and validate model_config_id matches expected
+
+    The custom_ids of repeated samples also give their repeat_index.
+    """
+    prompt_id, repeat_index = split_repeat_id(custom_id)
+    parts = split_readable_id(prompt_id)
 
     # First part should be model_config_id
     model_config_id = parts[0]
@@ -158,27 +181,43 @@ def extract_custom_id_info(custom_id: str, expected_model_config_id: str) -> Dic
             f"got {model_config_id} in custom_id {custom_id}"
         )
 
+    info: Dict[str, Any]
     if len(parts) == 3:  # question responses
-        return dict(zip(["model_config_id", "question_id", "prompt_variation_id"], parts))
+        info = dict(zip(["model_config_id", "question_id", "prompt_variation_id"], parts))
     else:
-        return dict(
+        info = dict(
             zip(
                 ["model_config_id", "question_id", "prompt_variation_id", "metric_id"],
                 parts,
             )
         )
+    if repeat_index is not None:
+        info["repeat_index"] = repeat_index
+    return info
 
 
 # FIXME: this is a shortcut, we should get proper dict from the
 # AI eval sheet configuration.
 def extract_score(eval_text):
-    """Extract A/B/C/D letter grade from eval text, returning score from 0-3."""
-    mapping = {"A": 0, "B": 1, "C": 2, "D": 3}
+    """
+    Extract A/B/C/D letter grade from eval text, returning score from 0-3.
+
+    Structured-output evaluators answer with a JSON object like {"grade": "A"}, other
+    evaluators end their text with the grade.
+    """
+    mapping = GRADE_SCORES
 
     # Handle null or non-string responses
     if eval_text is None or not isinstance(eval_text, str):
         return -1
 
+    if eval_text.lstrip().startswith("{"):
+        try:
+            grade = json.loads(eval_text)[GRADE_FIELD]
+            return mapping.get(str(grade).strip().upper(), -1)
+        except (json.JSONDecodeError, KeyError, TypeError):
+            pass
+
     try:
         # Get the last line
         last_line = eval_text.strip().split("\n")[-1]
@@ -190,32 +229,73 @@ def extract_score(eval_text):
         return -1
 
 
-def process_responses(responses: List[Dict], model_id: str) -> List[Dict]:
+def resolve_custom_ids(
+    custom_ids: List[str], expected_model_config_id: str, id_lookup: Optional[pl.DataFrame] = None
+) -> List[Dict[str, Any]]:
+    """
+    Get the parts of custom_ids, joining compact ids on the lookup table and parsing readable ones.
+
+    Returns:
+        Info dicts like extract_custom_id_info, in the order of custom_ids
+    """
+    if id_lookup is None:
+        return [extract_custom_id_info(custom_id, expected_model_config_id) for custom_id in custom_ids]
+
+    # The lookup table has the custom_ids of prompts, samples append their repeat index to them
+    split_ids = [split_repeat_id(custom_id) for custom_id in custom_ids]
+    joined = pl.DataFrame({"custom_id": [base_id for base_id, _ in split_ids]}, schema={"custom_id": pl.Utf8}).join(
+        id_lookup, on="custom_id", how="left", maintain_order="left"
+    )
+    infos = []
+    for custom_id, (_, repeat_index), row in zip(custom_ids, split_ids, joined.iter_rows(named=True)):
+        if row["model_config_id"] is None:
+            # Readable custom_id, or a compact one missing from the lookup table
+            infos.append(extract_custom_id_info(custom_id, expected_model_config_id))
+            continue
+        if row["model_config_id"] != expected_model_config_id:
+            raise ValueError(
+                f"Model config ID mismatch: expected {expected_model_config_id}, "
+                f"got {row['model_config_id']} in custom_id {row['custom_id']}"
+            )
+        info: Dict[str, Any] = {name: row[name] for name in ["model_config_id", "question_id", "prompt_variation_id"]}
+        if row["metric_id"] is not None:
+            info["metric_id"] = row["metric_id"]
+        if repeat_index is not None:
+            info["repeat_index"] = repeat_index
+        infos.append(info)
+    return infos
+
+
+def process_responses(responses: List[Dict], model_id: str, id_lookup: Optional[pl.DataFrame] = None) -> List[Dict]:
     """Process response records into structured data."""
     processed = []
-    for resp in responses:
-        info = extract_custom_id_info(resp["custom_id"], model_id)
+    infos = resolve_custom_ids([resp["custom_id"] for resp in responses], model_id, id_lookup)
+    for resp, info in zip(responses, infos):
         processed.append(
             {
                 "model_config_id": info["model_config_id"],
                 "question_id": info["question_id"],
                 "prompt_variation_id": info["prompt_variation_id"],
+                "repeat_index": info.get("repeat_index", 0),
                 "response": resp.get("content", "NOT_ANSWERED"),
             }
         )
     return processed
 
 
-def process_evals(evals: List[Dict], evaluator_prefix: str, model_id: str) -> List[Dict]:
+def process_evals(
+    evals: List[Dict], evaluator_prefix: str, model_id: str, id_lookup: Optional[pl.DataFrame] = None
+) -> List[Dict]:
     """Process evaluation records into structured scores."""
     processed = []
-    for eval_rec in evals:
-        info = extract_custom_id_info(eval_rec["custom_id"], model_id)
+    infos = resolve_custom_ids([eval_rec["custom_id"] for eval_rec in evals], model_id, id_lookup)
+    for eval_rec, info in zip(evals, infos):
         processed.append(
             {
                 "model_config_id": info["model_config_id"],
                 "question_id": info["question_id"],
                 "prompt_variation_id": info["prompt_variation_id"],
+                "repeat_index": info.get("repeat_index", 0),
                 "metric_id": info.get("metric_id", ""),
                 f"{evaluator_prefix}_score": extract_score(eval_rec.get("content", "")),
             }
@@ -227,7 +307,7 @@ def pivot_eval_df(df: pl.DataFrame, evalulator_prefix: str) -> pl.DataFrame:
     """Pivot evaluation dataframe to have metric_id values as columns"""
     pivoted = df.pivot(
         values=f"{evalulator_prefix}_score",
-        index=["model_config_id", "question_id", "prompt_variation_id"],
+        index=RESPONSE_KEYS,
         on="metric_id",
         aggregate_function="first",
     )
@@ -235,7 +315,7 @@ def pivot_eval_df(df: pl.DataFrame, evalulator_prefix: str) -> pl.DataFrame:
     # Rename columns to include evaluator name
     new_columns = []
     for col in pivoted.columns:
-        if col in ["model_config_id", "question_id", "prompt_variation_id"]:
+        if col in RESPONSE_KEYS:
             new_columns.append(col)
         else:
             new_columns.append(f"{evalulator_prefix}_{col}")
@@ -280,43 +360,43 @@ def calculate_final_score(scores: List[int]) -> int:
 
 
 def process_group(
-    response_path: Path, eval_paths: List[Path], output_dir: Path, evaluator_prefixes: Dict[str, str]
+    response_path: Path,
+    eval_paths: List[Path],
+    output_dir: Path,
+    evaluator_prefixes: Dict[str, str],
+    id_lookup: Optional[pl.DataFrame] = None,
 ) -> None:
     """Process a group of response + eval files into final output."""
     model_id = response_path.name.split("-")[0]
+    language = extract_language_from_filename(response_path.name)
 
     # Load and process data
     responses = load_jsonl(response_path)
-    response_df = pl.DataFrame(process_responses(responses, model_id))
+    response_df = pl.DataFrame(process_responses(responses, model_id, id_lookup))
 
     # Process evaluations
     eval_dfs = []
     for eval_path in eval_paths:
         eval_file_match = re.match(
-            r".+?-question_prompts-response-eval-prompts-(?P<evaluator_id>.+?)-response\.jsonl$",
+            r".+?-response-eval-prompts-(?P<evaluator_id>.+?)-response\.jsonl(\.gz|\.zst)?$",
             eval_path.name,
         )
         evaluator_id = eval_file_match.group("evaluator_id") if eval_file_match else "unknown"
         prefix = get_evaluator_prefix(evaluator_id, evaluator_prefixes)
         evals = load_jsonl(eval_path)
-        eval_df = pl.DataFrame(process_evals(evals, prefix, model_id))
+        eval_df = pl.DataFrame(process_evals(evals, prefix, model_id, id_lookup))
         eval_dfs.append(pivot_eval_df(eval_df, prefix))
 
     # Combine all data
     combined_df = response_df
     for df in eval_dfs:
-        combined_df = combined_df.join(df, on=["model_config_id", "question_id", "prompt_variation_id"], how="left")
+        combined_df = combined_df.join(df, on=RESPONSE_KEYS, how="left")
 
     # Fill null evaluation scores with -1
     # And fille null response with n/a
     # Identify evaluation columns by excluding the joining columns
     # and response column
-    joining_columns = [
-        "model_config_id",
-        "question_id",
-        "prompt_variation_id",
-        "response",
-    ]
+    joining_columns = [*RESPONSE_KEYS, "response"]
     eval_columns = [col for col in combined_df.columns if col not in joining_columns]
 
     combined_df = combined_df.with_columns([pl.col(col).fill_null(-1) for col in eval_columns]).with_columns(
@@ -331,10 +411,14 @@ def process_group(
         .alias("final_correctness")
     )
 
+    # Language of the shard, None when the responses have all languages
+    combined_df = combined_df.with_columns(pl.lit(language, dtype=pl.Utf8).alias("language"))
+
     # Write output
-    output_path = output_dir / f"{model_id}_output.parquet"
+    group_id = f"{model_id}-{language}" if language else model_id
+    output_path = output_dir / f"{group_id}_output.parquet"
     combined_df.write_parquet(output_path)
-    logger.info(f"Processed {model_id} → {output_path}")
+    logger.info(f"Processed {group_id} → {output_path}")
 
 
 def create_master_output(input_dir: str, language: str = "en-US") -> pl.DataFrame:
@@ -342,7 +426,7 @@ def create_master_output(input_dir: str, language: str = "en-US") -> pl.DataFram
 
     Args:
         output_folder: Folder containing parquet files with results
-        language: Language code to add to results (default: "en-US")
+        language: Language code of results which are not from a language shard (default: "en-US")
 
     Returns:
         DataFrame with standardized columns for upload
@@ -350,12 +434,17 @@ def create_master_output(input_dir: str, language: str = "en-US") -> pl.DataFram
     # Define mapping for correctness values
     result_map = {-1: "n/a", 0: "fail", 1: "very_wrong", 2: "wrong", 3: "correct"}
 
-    # Read and combine all parquet files
-    res_list = [pl.read_parquet(x) for x in glob(f"{input_dir}/*parquet")]
+    # Read and combine the output parquet files of all groups, not the custom_id lookup tables
+    res_list = [pl.read_parquet(x) for x in glob(f"{input_dir}/*_output.parquet")]
 
     # make sure the columns are in same order
-    cols = ["model_config_id", "question_id", "prompt_variation_id", "response", "final_correctness"]
-    res_list = [r.select(cols) for r in res_list]
+    # outputs summarized before repeated samples and language shards existed have a single
+    # sample and no language
+    defaults = {"repeat_index": pl.lit(0, dtype=pl.Int64), "language": pl.lit(None, dtype=pl.Utf8)}
+    cols = ["model_config_id", "question_id", "prompt_variation_id", "repeat_index", "response", "final_correctness"]
+    res_list = [
+        r.select([pl.col(c) if c in r.columns else defaults[c].alias(c) for c in [*cols, "language"]]) for r in res_list
+    ]
 
     res = pl.concat(res_list)
 
@@ -371,8 +460,9 @@ def create_master_output(input_dir: str, language: str = "en-US") -> pl.DataFram
         date_part = date_part[:8]
 
     # Add metadata columns and map correctness
+    # Outputs of language shards have their language, the others get the default one
     res = res.with_columns(
-        pl.lit(language).alias("language"),
+        pl.col("language").fill_null(language),
         pl.lit(date_part).alias("last_evaluation_datetime"),
         pl.col("final_correctness").replace_strict(result_map).alias("result"),
     )
@@ -383,6 +473,7 @@ def create_master_output(input_dir: str, language: str = "en-US") -> pl.DataFram
             pl.col("question_id"),
             pl.col("language"),
             pl.col("prompt_variation_id"),
+            pl.col("repeat_index"),
             pl.col("model_config_id").alias("model_configuration_id"),
             pl.col("last_evaluation_datetime"),
             pl.col("result"),
@@ -398,10 +489,13 @@ def main(input_dir: Path, output_dir: Optional[Path] = None) -> None:
     # Load evaluator prefixes from configuration file
     evaluator_prefixes = load_evaluator_prefixes(input_dir)
 
+    # Lookup table of compact custom_ids, None if the experiment uses readable custom_ids only
+    id_lookup = load_lookup(str(input_dir))
+
     file_groups = find_file_groups(input_dir)
     for model_id, (resp_path, eval_paths) in file_groups.items():
         logger.info(f"Processing {model_id}...")
-        process_group(resp_path, eval_paths, output_dir, evaluator_prefixes)
+        process_group(resp_path, eval_paths, output_dir, evaluator_prefixes, id_lookup)
 
     # Combine all parquet to create a master output csv file
     # I need to provide the fullpath, because it is needed for
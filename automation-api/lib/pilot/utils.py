@@ -13,6 +13,7 @@ from lib.ai_eval_spreadsheet.wrapper import (
 from lib.app_singleton import AppSingleton
 from lib.authorized_clients import get_service_account_authorized_clients
 from lib.config import read_config
+from lib.pilot.jsonl_io import split_jsonl_extension
 
 logger = AppSingleton().get_logger()
 
@@ -64,17 +65,17 @@ def get_batch_id_and_output_path(jsonl_path: str) -> Tuple[str, str]:
 
 
 def get_output_path(jsonl_path: str) -> str:
-    # Get base filename without extension
-    base_name = os.path.splitext(os.path.basename(jsonl_path))[0]
+    # Get base filename without extension, responses keep the compression of the input
+    base_name, ext = split_jsonl_extension(os.path.basename(jsonl_path))
     output_dir = os.path.dirname(jsonl_path)
-    output_path = os.path.join(output_dir, f"{base_name}-response.jsonl")
+    output_path = os.path.join(output_dir, f"{base_name}-response{ext}")
 
     return output_path
 
 
 def generate_batch_id(jsonl_path: str) -> str:
     # Get base filename without extension
-    base_name = os.path.splitext(os.path.basename(jsonl_path))[0]
+    base_name = split_jsonl_extension(os.path.basename(jsonl_path))[0]
     # Add timestamp to batch_id (YYYYMMDDHHMMSS format)
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
     batch_id = f"{base_name}-{timestamp}"
@@ -0,0 +1,39 @@
+"""Tests for simplifying Anthropic batch results."""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from lib.pilot.batchjob.anthropic import _simplify_anthropic_response
+from lib.pilot.gm_eval.commands.split import is_failed_response
+
+
+def _result(result_type, **kwargs):
+    return SimpleNamespace(custom_id="mc001-1-v1", result=SimpleNamespace(type=result_type, **kwargs))
+
+
+def test_simplify_succeeded_response():
+    message = SimpleNamespace(content=[SimpleNamespace(type="text", text="<think>x</think>A")])
+    simplified = _simplify_anthropic_response(_result("succeeded", message=message))
+
+    assert simplified["content"] == "A"
+    assert not is_failed_response(simplified)
+
+
+def test_simplify_tool_use_response():
+    """Test that the input of a forced tool call, used for structured output, is the content."""
+    message = SimpleNamespace(content=[SimpleNamespace(type="tool_use", input={"grade": "B"})])
+    simplified = _simplify_anthropic_response(_result("succeeded", message=message))
+
+    assert json.loads(simplified["content"]) == {"grade": "B"}
+
+
+@pytest.mark.parametrize("result_type", ["expired", "canceled"])
+def test_simplify_unfinished_response_is_failed(result_type):
+    """Test that expired and canceled requests, which have no error, are retried."""
+    simplified = _simplify_anthropic_response(_result(result_type))
+
+    assert simplified["content"] is None
+    assert simplified["error"] == f"Error: request {result_type}"
+    assert is_failed_response(simplified)
@@ -1,8 +1,11 @@
 """Tests for batch job utility functions."""
 
+import json
+import logging
+
 import pytest
 
-from lib.pilot.batchjob.utils import post_process_response
+from lib.pilot.batchjob.utils import ProgressLogger, get_num_samples, post_process_response, split_samples
 
 test_cases = [
     ("Hello <think>this should be removed</think> world", "Hello  world"),
@@ -24,3 +27,61 @@ test_cases = [
 def test_post_process_response(input_str, expected_output):
     """Test the post_process_response function."""
     assert post_process_response(input_str) == expected_output
+
+
+def test_split_samples():
+    """Test that each sample of a multi-sample response gets its own custom_id."""
+    simplified = {"custom_id": "mc001-1-v1", "status_code": 200, "content": None, "error": None}
+
+    assert split_samples(simplified, ["<think>x</think>A"]) == [{**simplified, "content": "A"}]
+    assert split_samples({**simplified, "status_code": 500}, []) == [{**simplified, "status_code": 500}]
+    assert split_samples(simplified, ["A", "B"]) == [
+        {**simplified, "custom_id": "mc001-1-v1-rep0", "content": "A"},
+        {**simplified, "custom_id": "mc001-1-v1-rep1", "content": "B"},
+    ]
+
+    # Requests for several samples always get suffixed ids, missing samples are failed
+    assert split_samples(simplified, ["A"], num_samples=2) == [
+        {**simplified, "custom_id": "mc001-1-v1-rep0", "content": "A"},
+        {
+            **simplified,
+            "custom_id": "mc001-1-v1-rep1",
+            "status_code": 500,
+            "error": "Error: sample 1 missing from the response",
+        },
+    ]
+    failed = {**simplified, "status_code": 429, "error": "rate limited"}
+    assert split_samples(failed, [], num_samples=2) == [
+        {**failed, "custom_id": "mc001-1-v1-rep0"},
+        {**failed, "custom_id": "mc001-1-v1-rep1"},
+    ]
+
+
+def test_get_num_samples(tmp_path):
+    """Test reading the number of samples requested by a prompt file."""
+    openai_path = tmp_path / "openai.jsonl"
+    openai_path.write_text(json.dumps({"custom_id": "a", "body": {"model": "gpt-4o", "n": 3}}) + "\n")
+    vertex_path = tmp_path / "vertex.jsonl"
+    vertex_path.write_text(json.dumps({"request": {"generationConfig": {"candidateCount": 2}}}) + "\n")
+    single_path = tmp_path / "single.jsonl"
+    single_path.write_text(json.dumps({"custom_id": "a", "body": {"model": "claude"}}) + "\n")
+
+    assert get_num_samples(str(openai_path)) == 3
+    assert get_num_samples(str(vertex_path)) == 2
+    assert get_num_samples(str(single_path)) == 1
+
+
+def test_progress_logger_logs_every_n_items(caplog):
+    """Test that ProgressLogger logs one line per `every` items instead of one per item."""
+    logger = logging.getLogger("test_progress")
+    progress = ProgressLogger(logger, total=25, every=10, interval=3600)
+
+    with caplog.at_level(logging.INFO, logger="test_progress"):
+        for i in range(25):
+            progress.update(succeeded=i % 5 != 0)
+        progress.finish()
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert len(messages) == 3
+    assert messages[0].startswith("Progress: 40.0% (10/25 processed, 2 failed")
+    assert messages[-1].startswith("Progress: 100.0% (25/25 processed, 5 failed")
@@ -0,0 +1,93 @@
+"""Tests for compact custom_ids and their lookup tables."""
+
+import polars as pl
+import pytest
+
+from lib.pilot.custom_ids import (
+    LookupWriter,
+    build_eval_lookup,
+    build_question_lookup,
+    compact_id,
+    get_lookup_path,
+    load_lookup,
+    repeat_id,
+    split_repeat_id,
+)
+from lib.pilot.summarize_results import resolve_custom_ids
+
+
+def test_compact_id_is_short_and_deterministic():
+    """Test that compact ids have a fixed length and only use characters allowed by all providers."""
+    ids = [
+        compact_id(f"mc001-{question_id}-v{variation_id}") for question_id in range(100) for variation_id in range(5)
+    ]
+
+    assert len(set(ids)) == len(ids)
+    assert all(len(x) == 11 for x in ids)
+    assert all(x.replace("-", "").replace("_", "").isalnum() for x in ids)
+    assert compact_id("mc001-1-v1") == ids[6]
+    # Ids which are not ascii, e.g. of translated questions, are hashed as utf-8
+    assert len(compact_id("mc001-fråga_1-v1")) == 11
+    assert compact_id("mc001-fråga_1-v1") != compact_id("mc001-fraga_1-v1")
+
+
+def test_lookup_maps_compact_ids_back(tmp_path):
+    """Test that question and evaluation lookup tables resolve compact ids to their parts."""
+    question_lookup = build_question_lookup("mc001", pl.Series([1, 2]), pl.Series(["v1", "v2"]))
+    assert question_lookup.height == 4
+    assert question_lookup["custom_id"][0] == compact_id("mc001-1-v1")
+
+    eval_lookup = build_eval_lookup(question_lookup, pl.Series(["correctness", "tone"]))
+    assert eval_lookup.height == 8
+    assert eval_lookup["custom_id"][0] == compact_id("mc001-1-v1-correctness")
+    assert eval_lookup["response_custom_id"][0] == question_lookup["custom_id"][0]
+
+    question_lookup.write_parquet(get_lookup_path(str(tmp_path / "mc001-question_prompts.jsonl")))
+    eval_lookup.drop("response_custom_id").write_parquet(
+        get_lookup_path(str(tmp_path / "mc001-question_prompts-response-eval-prompts-gpt-4o.jsonl.gz"))
+    )
+    lookup = load_lookup(str(tmp_path))
+    assert lookup is not None and lookup.height == 12
+
+    # Summaries join compact ids on the lookup table, and still parse readable ids
+    infos = resolve_custom_ids([compact_id("mc001-2-v1-tone"), "mc001-2-v2"], "mc001", lookup)
+    assert infos == [
+        {"model_config_id": "mc001", "question_id": "2", "prompt_variation_id": "v1", "metric_id": "tone"},
+        {"model_config_id": "mc001", "question_id": "2", "prompt_variation_id": "v2"},
+    ]
+
+
+def test_lookup_writer_combines_chunks(tmp_path):
+    """Test that lookup tables written chunk by chunk are checked for collisions across chunks."""
+    path = str(tmp_path / "mc001-question_prompts-custom-ids.parquet")
+    with LookupWriter(path) as writer:
+        writer.write(build_question_lookup("mc001", pl.Series([1]), pl.Series(["v1", "v2"])))
+        writer.write(build_question_lookup("mc001", pl.Series([2]), pl.Series(["v1", "v2"])))
+    assert pl.read_parquet(path).equals(build_question_lookup("mc001", pl.Series([1, 2]), pl.Series(["v1", "v2"])))
+    assert [x.name for x in tmp_path.iterdir()] == ["mc001-question_prompts-custom-ids.parquet"]
+
+    collision = build_question_lookup("mc001", pl.Series([1]), pl.Series(["v1"]))
+    with pytest.raises(ValueError, match="collision"):
+        with LookupWriter(path) as writer:
+            writer.write(collision)
+            writer.write(collision.with_columns(pl.lit("v3").alias("prompt_variation_id")))
+
+
+def test_load_lookup_without_tables(tmp_path):
+    """Test that experiments with readable custom_ids have no lookup table."""
+    assert load_lookup(str(tmp_path)) is None
+
+
+def test_repeat_ids():
+    """Test that samples append their repeat index to readable and compact custom_ids."""
+    assert repeat_id("mc001-2-v1", 0) == "mc001-2-v1-rep0"
+    assert split_repeat_id("mc001-2-v1-rep12") == ("mc001-2-v1", 12)
+    assert split_repeat_id("mc001-2-v1-correctness") == ("mc001-2-v1-correctness", None)
+    assert split_repeat_id("mc001-2-reporting") == ("mc001-2-reporting", None)
+
+    lookup = build_question_lookup("mc001", pl.Series([2]), pl.Series(["v1"]))
+    infos = resolve_custom_ids([repeat_id(compact_id("mc001-2-v1"), 1), "mc001-2-v1-rep2"], "mc001", lookup)
+    assert infos == [
+        {"model_config_id": "mc001", "question_id": "2", "prompt_variation_id": "v1", "repeat_index": 1},
+        {"model_config_id": "mc001", "question_id": "2", "prompt_variation_id": "v1", "repeat_index": 2},
+    ]
@@ -0,0 +1,89 @@
+"""Tests for the token, cost and shard forecast of prompt files."""
+
+import json
+
+import pytest
+
+from lib.pilot.forecast import (
+    BatchLimits,
+    count_tokens,
+    forecast_file,
+    get_max_output_tokens,
+    get_request_text,
+    get_token_prices,
+    recommend_shards,
+)
+from lib.pilot.generate_prompts import build_mistral_request, build_openai_request, build_vertex_request
+
+ROW = {"prompt_id": "1-v1", "prompt_text": "What share of the world population lives in Asia?"}
+
+
+def test_request_text_and_output_limit_of_each_format():
+    """Test that the prompt text and max output tokens are found in all JSONL formats."""
+    requests = [
+        build_openai_request(ROW, "gpt-4o", {"max_completion_tokens": 100}, "mc001-"),
+        build_mistral_request(ROW, {"max_tokens": 100}, "mc001-"),
+        build_vertex_request(ROW, {"max_output_tokens": 100}),
+    ]
+    for request in requests:
+        assert get_request_text(request) == ROW["prompt_text"]
+        assert get_max_output_tokens(request) == 100
+    assert get_max_output_tokens(build_openai_request(ROW, "gpt-4o", {})) is None
+
+
+def test_recommend_shards():
+    """Test that files are split in as many batches as the request or size limit needs."""
+    limits = BatchLimits(max_requests=100, max_bytes=1000)
+    assert recommend_shards(100, 1000, limits) == 1
+    assert recommend_shards(250, 10, limits) == 3
+    assert recommend_shards(10, 4500, limits) == 5
+    assert recommend_shards(10**6, 10**9, None) == 1
+
+
+def test_forecast_file(tmp_path):
+    """Test the token and shard forecast of a prompt file."""
+    path = tmp_path / "mc001-question_prompts.jsonl"
+    rows = [{"prompt_id": f"{i}-v1", "prompt_text": "word " * (i + 1)} for i in range(10)]
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(build_openai_request(row, "gpt-4o", {"max_tokens": 50}, "mc001-")) + "\n")
+
+    forecast = forecast_file(str(path), "openai/gpt-4o", "openai")
+
+    assert forecast.num_requests == 10
+    assert forecast.total_tokens == sum(count_tokens([row["prompt_text"] for row in rows]))
+    assert forecast.min_tokens <= forecast.mean_tokens <= forecast.max_tokens
+    assert forecast.max_output_tokens == 50
+    assert forecast.num_shards == 1 and forecast.shard_size == 10
+
+    prices = get_token_prices("openai/gpt-4o")
+    if prices is None:
+        pytest.skip("no price list available")
+    assert forecast.input_cost == pytest.approx(forecast.total_tokens * prices["input"])
+    assert forecast.max_output_cost == pytest.approx(500 * prices["output"])
+
+
+def test_forecast_file_with_several_samples(tmp_path):
+    """Test that requests for several samples can use the max output tokens for each sample."""
+    path = tmp_path / "mc001-question_prompts.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(build_openai_request(ROW, "gpt-4o", {"max_tokens": 50, "n": 3}, "mc001-")) + "\n")
+        f.write(json.dumps(build_vertex_request(ROW, {"maxOutputTokens": 50, "candidateCount": 2})) + "\n")
+
+    forecast = forecast_file(str(path), "openai/gpt-4o", "openai")
+
+    assert forecast.max_output_tokens == 50
+    prices = get_token_prices("openai/gpt-4o")
+    if prices is None:
+        pytest.skip("no price list available")
+    assert forecast.max_output_cost == pytest.approx(250 * prices["output"])
+
+
+def test_batch_prices_are_discounted():
+    """Test that batch prices are lower than the prices of sending requests one by one."""
+    batch = get_token_prices("openai/gpt-4o", "batch")
+    realtime = get_token_prices("openai/gpt-4o", "litellm")
+    if batch is None or realtime is None:
+        pytest.skip("no price list available")
+    assert batch["input"] < realtime["input"]
+    assert get_token_prices("unknown/not-a-model") is None
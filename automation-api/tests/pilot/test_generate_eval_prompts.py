@@ -0,0 +1,440 @@
+import json
+import os
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+import lib.pilot.generate_eval_prompts as eval_prompts_module
+from lib.pilot.custom_ids import build_question_lookup, compact_id
+from lib.pilot.eval_updates import get_pending_path, merge_pending_responses
+from lib.pilot.generate_eval_prompts import (
+    STRUCTURED_OUTPUT_MAX_TOKENS,
+    JsonlFormat,
+    generate_eval_prompts,
+    get_cache_layout_template,
+    get_eval_prompt_file_spec,
+    get_structured_output_parameters,
+    read_responses,
+    write_eval_prompt_files,
+)
+from lib.pilot.gm_eval.commands.merge import load_all_responses
+from lib.pilot.gm_eval.commands.retry import load_requests
+from lib.pilot.gm_eval.utils import get_response_path
+
+
+def _questions(question_ids: list) -> pl.DataFrame:
+    return pl.DataFrame(
+        {
+            "question_id": question_ids,
+            "question_text": [f"Question {x}?" for x in question_ids],
+            **{f"option_{letter}": [f"{letter} of {x}" for x in question_ids] for letter in "abc"},
+            **{
+                f"option_{letter}_correctness": [correctness] * len(question_ids)
+                for letter, correctness in zip("abc", ["Correct", "Wrong", "Very Wrong"])
+            },
+        }
+    )
+
+
+METRICS = pl.DataFrame({"name": ["correctness"], "prompt": ["{question_text} {option_a} => {raw_output}"]})
+
+
+def _responses(responses: dict) -> pl.DataFrame:
+    return pl.DataFrame({"custom_id": list(responses), "content": list(responses.values())})
+
+
+def _read_prompts(path) -> dict:
+    with open(path) as f:
+        return {request["custom_id"]: request["body"]["messages"][0]["content"] for request in map(json.loads, f)}
+
+
+def test_generate_eval_prompts_matches_whole_question_ids(tmp_path):
+    """Test that responses are only evaluated against their own question, not ones whose id contains it."""
+    responses = {
+        "mc001-1-v1": "one",
+        "mc001-11-v1": "eleven",
+        "mc001-question-21-v1-rep0": "twenty-one",
+        "mc001-question-21-v1-rep1": "twenty-one again",
+    }
+    output_path = tmp_path / "eval.jsonl"
+
+    spec = get_eval_prompt_file_spec(str(output_path), "openai/gpt", "gpt", {}, JsonlFormat.OPENAI)
+    generate_eval_prompts(_questions([1, 11, 21]), _responses(responses), METRICS, [spec])
+
+    assert _read_prompts(output_path) == {
+        "mc001-1-v1-correctness": "Question 1? a of 1 => one",
+        "mc001-11-v1-correctness": "Question 11? a of 11 => eleven",
+        "mc001-21-v1-correctness-rep0": "Question 21? a of 21 => twenty-one",
+        "mc001-21-v1-correctness-rep1": "Question 21? a of 21 => twenty-one again",
+    }
+
+
+def test_generate_eval_prompts_looks_up_compact_ids(tmp_path):
+    """Test that the questions of compact custom_ids come from the lookup table."""
+    lookup = build_question_lookup("mc001", pl.Series([1, 11]), pl.Series(["v1"]))
+    responses = {f"{compact_id('mc001-11-v1')}-rep0": "eleven", compact_id("mc001-1-v1"): "one"}
+    output_path = tmp_path / "eval.jsonl"
+
+    spec = get_eval_prompt_file_spec(str(output_path), "openai/gpt", "gpt", {}, JsonlFormat.OPENAI)
+    generate_eval_prompts(_questions([1, 11]), _responses(responses), METRICS, [spec], id_lookup=lookup)
+
+    assert _read_prompts(output_path) == {
+        compact_id("mc001-1-v1-correctness"): "Question 1? a of 1 => one",
+        f"{compact_id('mc001-11-v1-correctness')}-rep0": "Question 11? a of 11 => eleven",
+    }
+
+
+def test_generate_eval_prompts_writes_every_evaluator(tmp_path):
+    """Test that the prompts are written to the files of all evaluators, in the format of each."""
+    responses = {"mc001-1-v1": "one", "mc001-11-v1": 'eleven, "quoted"\nover two lines'}
+    specs = [
+        get_eval_prompt_file_spec(str(tmp_path / "gpt.jsonl"), "openai/gpt", "gpt", {}, JsonlFormat.OPENAI),
+        get_eval_prompt_file_spec(str(tmp_path / "mistral.jsonl"), "mistral/large", "large", {}, JsonlFormat.MISTRAL),
+        get_eval_prompt_file_spec(str(tmp_path / "gemini.jsonl"), "vertex_ai/gemini", "gemini", {}, JsonlFormat.VERTEX),
+    ]
+
+    assert generate_eval_prompts(_questions([1, 11]), _responses(responses), METRICS, specs) == 2
+
+    expected = {
+        "mc001-1-v1-correctness": "Question 1? a of 1 => one",
+        "mc001-11-v1-correctness": 'Question 11? a of 11 => eleven, "quoted"\nover two lines',
+    }
+    assert _read_prompts(tmp_path / "gpt.jsonl") == expected
+    assert _read_prompts(tmp_path / "mistral.jsonl") == expected
+    with open(tmp_path / "gemini.jsonl") as f:
+        assert [json.loads(line)["request"]["contents"][0]["parts"][0]["text"] for line in f] == list(expected.values())
+    mapping = pl.read_csv(tmp_path / "gemini-prompt-mapping.csv")
+    assert dict(zip(mapping["prompt_id"], mapping["prompt_text"])) == expected
+
+
+def test_generate_eval_prompts_rejects_long_custom_ids(tmp_path):
+    """Test that readable custom_ids longer than providers accept are rejected before anything is sent."""
+    responses = {"mc001-1-v1": "one", f"mc001-1-{'long_variation' * 4}": "one"}
+    spec = get_eval_prompt_file_spec(str(tmp_path / "eval.jsonl"), "openai/gpt", "gpt", {}, JsonlFormat.OPENAI)
+
+    with pytest.raises(ValueError, match="--compact-ids"):
+        generate_eval_prompts(_questions([1]), _responses(responses), METRICS, [spec])
+
+
+def test_read_responses_in_chunks_of_whole_questions(tmp_path):
+    """Test that responses are read sorted by question, with all responses to a question in one chunk."""
+    response_path = tmp_path / "responses.jsonl"
+    lines = [
+        {"custom_id": "mc001-2-v1", "content": "two"},
+        {"custom_id": "mc001-1-v1", "content": "one"},
+        {"custom_id": "mc001-9-v1", "content": "unknown question"},
+        {"custom_id": "mc001-2-v2", "content": None},
+        {"custom_id": "mc001-1-v2", "content": "uno"},
+        {"custom_id": "mc001-2-v3", "content": "dos"},
+        {"custom_id": "mc001-1-v1", "content": "one, retried"},
+        {"custom_id": "mc001-3-v1", "content": "three"},
+    ]
+    response_path.write_text("".join(f"{json.dumps(line)}\n" for line in lines))
+
+    chunks = list(
+        read_responses(str(response_path), _questions([1, 2, 3]), str(tmp_path / "spill.parquet"), chunk_size=2)
+    )
+
+    assert [chunk.rows() for chunk in chunks] == [
+        [("mc001-1-v1", "one"), ("mc001-1-v2", "uno"), ("mc001-1-v1", "one, retried")],
+        [("mc001-2-v1", "two"), ("mc001-2-v3", "dos"), ("mc001-3-v1", "three")],
+    ]
+
+
+def _write_eval_sheets(base_path):
+    sheets_dir = base_path / "ai_eval_sheets"
+    sheets_dir.mkdir()
+    pl.DataFrame(
+        {"question_id": [1, 2], "language": ["en-US"] * 2, "published_version_of_question": ["Q1?", "Q2?"]}
+    ).write_csv(sheets_dir / "questions.csv")
+    pl.DataFrame(
+        {
+            "question_option_id": [f"{q}{letter}" for q in [1, 2] for letter in "ABC"],
+            "question_id": [q for q in [1, 2] for _ in "ABC"],
+            "language": ["en-US"] * 6,
+            "letter": list("ABC") * 2,
+            "question_option": [f"option {letter}" for _ in [1, 2] for letter in "ABC"],
+            "correctness_of_answer_option": [1, 2, 3] * 2,
+        }
+    ).write_csv(sheets_dir / "question_options.csv")
+    METRICS.write_csv(sheets_dir / "metrics.csv")
+    pl.DataFrame(
+        {
+            "evaluator_id": ["openai/gpt-4o", "vertex_ai/publishers/google/models/gemini-2.0-flash"],
+            "provider": ["openai", "vertex"],
+            "jsonl_format": ["openai", "vertex"],
+            "parameters": ['{"temperature": 0}', '{"temperature": 0}'],
+        }
+    ).write_csv(sheets_dir / "evaluators.csv")
+
+
+def _write_jsonl(path, records: list) -> None:
+    path.parent.mkdir(exist_ok=True)
+    path.write_text("".join(f"{json.dumps(record)}\n" for record in records))
+
+
+def _answer(request_path, grade: str = "A") -> None:
+    """Write a response with the grade for each request of a file, like a downloaded batch."""
+    _write_jsonl(
+        Path(get_response_path(str(request_path))),
+        [
+            {"custom_id": custom_id, "content": f"Grade: {grade}", "status_code": 200}
+            for custom_id in load_requests(str(request_path))
+        ],
+    )
+
+
+def test_write_eval_prompt_files_only_sends_prompts_without_results(tmp_path):
+    """Test that evaluating again only sends the prompts whose responses changed or which have no valid score."""
+    _write_eval_sheets(tmp_path)
+    response_path = tmp_path / "mc001-question_prompts-response.jsonl"
+    answers = {"mc001-1-v1": "one", "mc001-1-v2": "uno", "mc001-2-v1": "two"}
+    _write_jsonl(response_path, [{"custom_id": k, "content": v, "status_code": 200} for k, v in answers.items()])
+
+    # Nothing was evaluated yet, the whole prompts files are sent
+    eval_files = write_eval_prompt_files(str(tmp_path), str(response_path))
+    assert [x.send_path for x in eval_files] == [x.path for x in eval_files]
+    for eval_file in eval_files:
+        _answer(eval_file.path)
+    # One evaluator's result of the Spanish answer can't be read
+    gpt_response_path = Path(get_response_path(eval_files[0].path))
+    gpt_results = [json.loads(line) for line in gpt_response_path.read_text().splitlines()]
+    gpt_results[1]["content"] = "I can't grade this"
+    _write_jsonl(gpt_response_path, gpt_results)
+
+    # The first answer changed
+    answers["mc001-1-v1"] = "one!"
+    _write_jsonl(response_path, [{"custom_id": k, "content": v, "status_code": 200} for k, v in answers.items()])
+    eval_files = write_eval_prompt_files(str(tmp_path), str(response_path))
+
+    gpt, gemini = eval_files
+    assert gpt.send_path == get_pending_path(gpt.path)
+    assert list(load_requests(gpt.send_path)) == ["mc001-1-v1-correctness", "mc001-1-v2-correctness"]
+    assert list(load_requests(gemini.send_path)) == ["mc001-1-v1-correctness"]
+    # The outdated and failed results are dropped from the response files
+    assert list(load_all_responses([get_response_path(gpt.path)])) == ["mc001-2-v1-correctness"]
+
+    # Downloaded results of the pending files are merged into the response files
+    for eval_file in eval_files:
+        _answer(eval_file.send_path, "B")
+        assert merge_pending_responses(eval_file.path) > 0
+    merged = load_all_responses([get_response_path(gemini.path)])
+    assert {custom_id: json.loads(line)["content"] for custom_id, line in merged.items()} == {
+        "mc001-1-v1-correctness": "Grade: B",
+        "mc001-1-v2-correctness": "Grade: A",
+        "mc001-2-v1-correctness": "Grade: A",
+    }
+    assert not os.path.exists(gemini.send_path)
+
+    # Everything is up to date now
+    assert [x.send_path for x in write_eval_prompt_files(str(tmp_path), str(response_path))] == [None, None]
+
+
+def test_write_eval_prompt_files_uses_cached_results_of_other_experiments(tmp_path):
+    """Test that prompts evaluated in another experiment get the cached result instead of being sent."""
+    cache_dir = str(tmp_path / "cache")
+    experiments = []
+    for name in ["first", "second"]:
+        base_path = tmp_path / name
+        base_path.mkdir()
+        _write_eval_sheets(base_path)
+        experiments.append(base_path)
+
+    # The first experiment is evaluated and its results are added to the cache
+    response_path = experiments[0] / "mc001-question_prompts-response.jsonl"
+    _write_jsonl(response_path, [{"custom_id": "mc001-1-v1", "content": "one", "status_code": 200}])
+    eval_files = write_eval_prompt_files(str(experiments[0]), str(response_path), eval_cache=cache_dir)
+    for eval_file in eval_files:
+        _answer(eval_file.path)
+    write_eval_prompt_files(str(experiments[0]), str(response_path), eval_cache=cache_dir)
+
+    # The second experiment has the same answer and a new one
+    answers = {"mc001-1-v1": "one", "mc001-2-v1": "two"}
+    response_path = experiments[1] / "mc001-question_prompts-response.jsonl"
+    _write_jsonl(response_path, [{"custom_id": k, "content": v, "status_code": 200} for k, v in answers.items()])
+    eval_files = write_eval_prompt_files(str(experiments[1]), str(response_path), eval_cache=cache_dir)
+
+    for eval_file in eval_files:
+        assert list(load_requests(eval_file.send_path)) == ["mc001-2-v1-correctness"]
+        cached = load_all_responses([get_response_path(eval_file.path)])
+        assert list(cached) == ["mc001-1-v1-correctness"]
+        assert json.loads(cached["mc001-1-v1-correctness"])["content"] == "Grade: A"
+
+
+def test_write_eval_prompt_files_sends_identical_prompts_once(tmp_path):
+    """Test that identical evaluation prompts are sent once and their result is merged for all of them."""
+    _write_eval_sheets(tmp_path)
+    response_path = tmp_path / "mc001-question_prompts-response.jsonl"
+    answers = {"mc001-1-v1": "A", "mc001-1-v2": "A", "mc001-1-v3": "B", "mc001-2-v1": "A"}
+    _write_jsonl(response_path, [{"custom_id": k, "content": v, "status_code": 200} for k, v in answers.items()])
+
+    eval_files = write_eval_prompt_files(str(tmp_path), str(response_path))
+
+    for eval_file in eval_files:
+        # The same answer to another question is a different prompt
+        expected = ["mc001-1-v2-correctness", "mc001-1-v3-correctness", "mc001-2-v1-correctness"]
+        assert list(load_requests(eval_file.send_path)) == expected
+        _answer(eval_file.send_path)
+        assert merge_pending_responses(eval_file.path) == 4
+        assert sorted(load_all_responses([get_response_path(eval_file.path)])) == sorted(
+            f"{custom_id}-correctness" for custom_id in answers
+        )
+    assert [x.send_path for x in write_eval_prompt_files(str(tmp_path), str(response_path))] == [None, None]
+
+
+def test_generate_eval_prompts_marks_cacheable_prefix(tmp_path):
+    """Test that prompt cache markers split the prompts before the evaluated response."""
+    responses = {"mc001-1-v1": "one", "mc001-1-v2": ""}
+    metrics = pl.DataFrame({"name": ["correctness"], "prompt": ["{{Q}} {question_text}\nAnswer: {raw_output}"]})
+    specs = [
+        get_eval_prompt_file_spec(str(tmp_path / "claude.jsonl"), "anthropic/c", "c", {}, JsonlFormat.OPENAI, True),
+        get_eval_prompt_file_spec(str(tmp_path / "gpt.jsonl"), "openai/gpt", "gpt", {}, JsonlFormat.OPENAI),
+    ]
+
+    generate_eval_prompts(_questions([1]), _responses(responses), metrics, specs, min_cached_prefix_tokens=0)
+
+    with open(tmp_path / "claude.jsonl") as f:
+        cached, empty = [json.loads(line)["body"]["messages"][0]["content"] for line in f]
+    assert cached == [
+        {"type": "text", "text": "{Q} Question 1?\nAnswer: ", "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": "one"},
+    ]
+    # Providers reject empty blocks, the prompt of an empty response is sent whole
+    assert empty == "{Q} Question 1?\nAnswer: "
+    assert _read_prompts(tmp_path / "gpt.jsonl") == {
+        "mc001-1-v1-correctness": "{Q} Question 1?\nAnswer: one",
+        "mc001-1-v2-correctness": "{Q} Question 1?\nAnswer: ",
+    }
+
+
+# The shape of the correctness metric prompt of the AI Eval sheets, with the instructions after the response
+SHEET_METRIC_PROMPT = """You are assessing a submitted answer on a given task based on a criterion. Here is the data:
+- Task: Answer a question.
+[Input]: {question_text}
+Possible Options and Correctness of Options:
+A. {option_a} ({option_a_correctness})
+B. {option_b} ({option_b_correctness})
+C. {option_c} ({option_c_correctness})
+[Result]: {raw_output}
+[Assessment requirements]:
+Assess the answer by selecting one of the following options.
+[Instruction]:
+1. First, write out in a step by step manner your reasoning.
+2. Finally print only a single choice from A,B,C,D on its own line.
+
+Reasoning:
+"""
+
+
+def test_cache_layout_puts_static_parts_before_the_response(tmp_path):
+    """Test that the cache layout of a sheet metric prompt caches its instructions, and only long prefixes."""
+    template = get_cache_layout_template(SHEET_METRIC_PROMPT)
+    assert template.endswith("Reasoning:\n[Result]: {raw_output}")
+    assert sorted(template.split("\n")) == sorted(SHEET_METRIC_PROMPT.rstrip("\n").split("\n"))
+
+    metrics = pl.DataFrame({"name": ["correctness"], "prompt": [template]})
+    spec = get_eval_prompt_file_spec(str(tmp_path / "claude.jsonl"), "anthropic/c", "c", {}, JsonlFormat.OPENAI, True)
+    generate_eval_prompts(
+        _questions([1]), _responses({"mc001-1-v1": "one"}), metrics, [spec], min_cached_prefix_tokens=0
+    )
+    with open(tmp_path / "claude.jsonl") as f:
+        prefix, response = json.loads(f.readline())["body"]["messages"][0]["content"]
+    assert "[Input]: Question 1?" in prefix["text"] and "[Instruction]:" in prefix["text"]
+    assert prefix["cache_control"] == {"type": "ephemeral"}
+    assert response == {"type": "text", "text": "one"}
+
+    # Anthropic doesn't cache prefixes this short, the prompt is sent whole
+    generate_eval_prompts(_questions([1]), _responses({"mc001-1-v1": "one"}), metrics, [spec])
+    with open(tmp_path / "claude.jsonl") as f:
+        assert json.loads(f.readline())["body"]["messages"][0]["content"] == prefix["text"] + "one"
+
+
+def test_write_eval_prompt_files_staged_only_sends_undecided_evaluations(tmp_path):
+    """Test that the last evaluator only gets the evaluations the first two don't agree on or couldn't score."""
+    _write_eval_sheets(tmp_path)
+    pl.DataFrame(
+        {
+            "evaluator_id": ["openai/gpt-a", "openai/gpt-b", "openai/gpt-c"],
+            "provider": ["openai"] * 3,
+            "jsonl_format": ["openai"] * 3,
+            "parameters": ["{}"] * 3,
+        }
+    ).write_csv(tmp_path / "ai_eval_sheets" / "evaluators.csv")
+    response_path = tmp_path / "mc001-question_prompts-response.jsonl"
+    answers = {"mc001-1-v1": "one", "mc001-1-v2": "uno", "mc001-2-v1": "two"}
+    _write_jsonl(response_path, [{"custom_id": k, "content": v, "status_code": 200} for k, v in answers.items()])
+
+    # The last evaluator waits for the results of the first stage
+    first, second, last = write_eval_prompt_files(str(tmp_path), str(response_path), staged=True)
+    assert [first.send_path, second.send_path, last.send_path] == [first.path, second.path, None]
+    assert not last.first_stage
+
+    _answer(first.path, "A")
+    second_results = [
+        {"custom_id": "mc001-1-v1-correctness", "content": "Grade: A", "status_code": 200},
+        {"custom_id": "mc001-1-v2-correctness", "content": "Grade: B", "status_code": 200},
+        {"custom_id": "mc001-2-v1-correctness", "content": "No grade", "status_code": 200},
+    ]
+    _write_jsonl(Path(get_response_path(second.path)), second_results)
+
+    first, second, last = write_eval_prompt_files(str(tmp_path), str(response_path), staged=True)
+    assert first.send_path is None
+    assert list(load_requests(second.send_path)) == ["mc001-2-v1-correctness"]
+    assert list(load_requests(last.send_path)) == ["mc001-1-v2-correctness", "mc001-2-v1-correctness"]
+
+
+def test_staged_evaluation_writes_response_file_of_evaluators_not_needed(tmp_path, monkeypatch):
+    """Test that an evaluator gets a response file when the first stage agrees on all evaluations."""
+    _write_eval_sheets(tmp_path)
+    pl.DataFrame(
+        {
+            "evaluator_id": ["openai/gpt-a", "openai/gpt-b", "openai/gpt-c"],
+            "provider": ["openai"] * 3,
+            "jsonl_format": ["openai"] * 3,
+            "parameters": ["{}"] * 3,
+        }
+    ).write_csv(tmp_path / "ai_eval_sheets" / "evaluators.csv")
+    response_path = tmp_path / "mc001-question_prompts-response.jsonl"
+    _write_jsonl(response_path, [{"custom_id": "mc001-1-v1", "content": "one", "status_code": 200}])
+
+    sent = []
+
+    def answer_all(eval_files, wait, processes=1, eval_cache=None):
+        for eval_file in eval_files:
+            if eval_file.send_path is not None:
+                sent.append(eval_file.path)
+                _answer(eval_file.path, "A")
+
+    monkeypatch.setattr(eval_prompts_module, "send_eval_files", answer_all)
+    eval_prompts_module.main(str(tmp_path), [str(response_path)], send=True, wait=True, staged=True)
+
+    last_response_path = Path(
+        get_response_path(str(tmp_path / "mc001-question_prompts-response-eval-prompts-gpt-c.jsonl"))
+    )
+    assert len(sent) == 2
+    assert last_response_path.exists()
+    assert last_response_path.read_text() == ""
+
+
+def test_get_structured_output_parameters():
+    """Test that structured output uses the parameters of each provider, with a token limit of a grade."""
+    openai = get_structured_output_parameters("openai", JsonlFormat.OPENAI, {"temperature": 0})
+    assert openai["response_format"]["json_schema"]["schema"]["properties"]["grade"]["enum"] == list("ABCD")
+    assert openai["max_completion_tokens"] == STRUCTURED_OUTPUT_MAX_TOKENS
+    assert openai["temperature"] == 0
+
+    anthropic = get_structured_output_parameters("anthropic", JsonlFormat.OPENAI, {"max_tokens": 2000})
+    assert anthropic["tool_choice"] == {"type": "tool", "name": "grade"}
+    assert anthropic["max_tokens"] == STRUCTURED_OUTPUT_MAX_TOKENS
+    # A smaller limit of the evaluator is kept, in the key of the provider
+    openai = get_structured_output_parameters("openai", JsonlFormat.OPENAI, {"max_tokens": 16})
+    assert openai["max_completion_tokens"] == 16
+    assert "max_tokens" not in openai
+    # LiteLLM translates the response format for Anthropic models
+    assert "response_format" in get_structured_output_parameters("anthropic", JsonlFormat.OPENAI, {}, "litellm")
+
+    vertex = get_structured_output_parameters("vertex", JsonlFormat.VERTEX, {})
+    assert vertex["responseMimeType"] == "application/json"
+    assert "additionalProperties" not in vertex["responseSchema"]
+    assert vertex["maxOutputTokens"] == STRUCTURED_OUTPUT_MAX_TOKENS
@@ -0,0 +1,338 @@
+import io
+import json
+
+import polars as pl
+import pytest
+
+from lib.pilot.custom_ids import compact_id
+from lib.pilot.generate_prompts import (
+    generate_prompts_by_language,
+    generate_prompts_for_configs,
+    generate_question_prompt_combinations,
+    get_languages,
+    get_prompt_store_path,
+    is_prompt_store_current,
+    iter_question_prompt_combinations,
+    main,
+    read_prompt_sheets,
+    render_prompts_from_store,
+    write_prompt_store,
+)
+from lib.pilot.gm_eval.commands.send import check_and_generate_prompts
+
+
+def _format_each_combination(questions: pl.DataFrame, prompt_variations: pl.DataFrame) -> list:
+    """Reference implementation formatting every combination with str.format"""
+    processed = []
+    for combo in questions.join(prompt_variations, how="cross").to_dicts():
+        formatted_question = combo["question_template"].format(
+            question_text=combo["question_text"],
+            option_a=combo["option_a"],
+            option_b=combo["option_b"],
+            option_c=combo["option_c"],
+        )
+        processed.append(
+            {
+                "prompt_id": f"{combo['question_id']}-{combo['variation_id']}",
+                "prompt_text": combo["question_prompt_template"].format(question=formatted_question),
+            }
+        )
+    return processed
+
+
+def test_generate_question_prompt_combinations_matches_str_format():
+    questions = pl.DataFrame(
+        {
+            "question_id": [1, 2, 10],
+            "question_text": ["How many {people}?", "Which country?", "Ünïcode «quotes»"],
+            "option_a": ["A lot", "Sweden", None],
+            "option_b": ["Few", "Chad", "b"],
+            "option_c": ["None", "", "c"],
+        }
+    )
+    prompt_variations = pl.DataFrame(
+        {
+            "variation_id": ["v1", "v2", "v3"],
+            "question_template": [
+                "{question_text}\nA. {option_a}\nB. {option_b}\nC. {option_c}",
+                # Format specs can't be expressed as columns and use str.format
+                "{question_text:>30}|{option_a!r}",
+                "{{literal braces}} {option_c}{option_c}",
+            ],
+            "question_prompt_template": [
+                "Answer this: {question}",
+                "{question}",
+                "No question here",
+            ],
+        }
+    )
+
+    result = generate_question_prompt_combinations(questions, prompt_variations)
+
+    assert result.columns == ["prompt_id", "prompt_text"]
+    assert result.to_dicts() == _format_each_combination(questions, prompt_variations)
+
+
+def test_generate_question_prompt_combinations_without_variations():
+    questions = pl.DataFrame(
+        {"question_id": [1], "question_text": ["q"], "option_a": ["a"], "option_b": ["b"], "option_c": ["c"]}
+    )
+    prompt_variations = pl.DataFrame(
+        schema={"variation_id": pl.Utf8, "question_template": pl.Utf8, "question_prompt_template": pl.Utf8}
+    )
+
+    result = generate_question_prompt_combinations(questions, prompt_variations)
+
+    assert result.height == 0
+    assert result.columns == ["prompt_id", "prompt_text"]
+
+
+def test_iter_question_prompt_combinations_chunks_keep_order():
+    questions = pl.DataFrame(
+        {
+            "question_id": [str(i) for i in range(7)],
+            "question_text": [f"q{i}" for i in range(7)],
+            "option_a": ["a"] * 7,
+            "option_b": ["b"] * 7,
+            "option_c": ["c"] * 7,
+        }
+    )
+    prompt_variations = pl.DataFrame(
+        {
+            "variation_id": ["v1", "v2", "v3"],
+            "question_template": ["{question_text} {option_a}"] * 3,
+            "question_prompt_template": ["1 {question}", "2 {question}", "3 {question}"],
+        }
+    )
+
+    chunks = list(iter_question_prompt_combinations(questions, prompt_variations, chunk_size=6))
+
+    assert [chunk.height for chunk in chunks] == [6, 6, 6, 3]
+    assert pl.concat(chunks).equals(generate_question_prompt_combinations(questions, prompt_variations))
+
+
+def _write_sheets(base_path):
+    sheets_dir = base_path / "ai_eval_sheets"
+    sheets_dir.mkdir()
+    pl.DataFrame(
+        {"question_id": [1, 2, 3], "language": ["en-US"] * 3, "published_version_of_question": ["Q1", "Q2", "Q3?"]}
+    ).write_csv(sheets_dir / "questions.csv")
+    pl.DataFrame(
+        {
+            "question_option_id": [f"{q}{letter}" for q in [1, 2, 3] for letter in "ABC"],
+            "question_id": [q for q in [1, 2, 3] for _ in "ABC"],
+            "language": ["en-US"] * 9,
+            "letter": list("ABC") * 3,
+            "question_option": [f"option, {letter}" for _ in [1, 2, 3] for letter in "ABC"],
+            "correctness_of_answer_option": [1, 2, 3] * 3,
+        }
+    ).write_csv(sheets_dir / "question_options.csv")
+    pl.DataFrame(
+        {
+            "variation_id": ["v1", "v2"],
+            "question_template": ["{question_text}\nA. {option_a}\nB. {option_b}\nC. {option_c}", "{question_text}"],
+            "question_prompt_template": ["Answer: {question}", '"Quoted" {question}'],
+        }
+    ).write_csv(sheets_dir / "prompt_variations.csv")
+    pl.DataFrame(
+        {
+            "model_config_id": ["mc001", "mc002", "mc003"],
+            "model_id": [
+                "openai/gpt-4o",
+                "vertex_ai/publishers/google/models/gemini-2.0-flash",
+                "mistral/mistral-small",
+            ],
+            "model_parameters": ['{"temperature": 0}', '{"temperature": 0.5}', None],
+        }
+    ).write_csv(sheets_dir / "gen_ai_model_configs.csv")
+
+
+def test_generate_prompts_for_configs_matches_single_config_generation(tmp_path):
+    _write_sheets(tmp_path)
+    jsonl_formats = {"mc001": "openai", "mc002": "vertex", "mc003": "mistral"}
+
+    paths = generate_prompts_for_configs(str(tmp_path), jsonl_formats, chunk_size=3)
+
+    assert paths == {mc: str(tmp_path / f"{mc}-question_prompts.jsonl") for mc in jsonl_formats}
+    multi_outputs = {path.name: path.read_text(encoding="utf-8") for path in tmp_path.glob("mc*")}
+    assert len(multi_outputs) == 4  # three JSONL files and the vertex prompt mapping
+
+    openai_lines = [json.loads(line) for line in multi_outputs["mc001-question_prompts.jsonl"].splitlines()]
+    assert len(openai_lines) == 6
+    assert openai_lines[0]["body"]["model"] == "gpt-4o"
+    assert openai_lines[0]["custom_id"].startswith("mc001-")
+    mapping = pl.read_csv(tmp_path / "mc002-question_prompts-prompt-mapping.csv")
+    assert mapping["prompt_id"].str.starts_with("mc002-").all()
+    assert mapping.height == 6
+
+    # Generating one config at a time gives the same files, up to the order of the questions
+    for path in tmp_path.glob("mc*"):
+        path.unlink()
+    for model_config_id, jsonl_format in jsonl_formats.items():
+        main(str(tmp_path), model_config_id, jsonl_format)
+    for name, content in multi_outputs.items():
+        single_content = (tmp_path / name).read_text(encoding="utf-8")
+        assert sorted(single_content.splitlines()) == sorted(content.splitlines())
+
+
+def test_render_prompts_from_store_matches_generation(tmp_path):
+    _write_sheets(tmp_path)
+    jsonl_formats = {"mc001": "openai", "mc002": "vertex", "mc003": "mistral"}
+    generate_prompts_for_configs(str(tmp_path), jsonl_formats, chunk_size=3, compact_ids=True)
+    generated = {path.name: path.read_bytes() for path in tmp_path.glob("mc*")}
+    for path in tmp_path.glob("mc*"):
+        path.unlink()
+
+    # The prompt table holds each prompt once, for all model configurations
+    store_path = write_prompt_store(str(tmp_path), chunk_size=3)
+    assert store_path == get_prompt_store_path(str(tmp_path))
+    store = pl.read_parquet(store_path)
+    assert store.columns == ["prompt_id", "question_id", "variation_id", "language", "text"]
+    assert store.height == 6
+    assert store.row(0) == ("1-v1", "1", "v1", "en-US", "Answer: Q1\nA. option, A\nB. option, B\nC. option, C")
+    assert not list(tmp_path.glob("mc*"))
+
+    render_prompts_from_store(str(tmp_path), jsonl_formats, chunk_size=4, compact_ids=True)
+    rendered = {path.name: path.read_bytes() for path in tmp_path.glob("mc*")}
+    assert rendered.keys() == generated.keys()
+    for name, content in generated.items():
+        if name.endswith(".parquet"):
+            assert (
+                pl.read_parquet(tmp_path / name)
+                .sort("custom_id")
+                .equals(pl.read_parquet(io.BytesIO(content)).sort("custom_id"))
+            )
+        else:
+            assert sorted(rendered[name].splitlines()) == sorted(content.splitlines())
+
+
+def test_generate_prompts_with_compact_ids(tmp_path):
+    _write_sheets(tmp_path)
+
+    generate_prompts_for_configs(str(tmp_path), {"mc001": "openai", "mc002": "vertex"}, chunk_size=3, compact_ids=True)
+
+    lookup = pl.read_parquet(tmp_path / "mc001-question_prompts-custom-ids.parquet")
+    lines = [json.loads(line) for line in (tmp_path / "mc001-question_prompts.jsonl").read_text().splitlines()]
+    assert sorted(line["custom_id"] for line in lines) == sorted(lookup["custom_id"])
+    assert all(len(line["custom_id"]) == 11 for line in lines)
+    assert (lookup["model_config_id"] == "mc001").all()
+    assert all(
+        row["custom_id"] == compact_id(f"mc001-{row['question_id']}-{row['prompt_variation_id']}")
+        for row in lookup.iter_rows(named=True)
+    )
+    # The lookup table is written chunk by chunk, no part files are left behind
+    assert not [path for path in tmp_path.iterdir() if path.is_dir() and path.name != "ai_eval_sheets"]
+
+    # Vertex requests have no custom_id, the prompt mapping holds the compact ids
+    mapping = pl.read_csv(tmp_path / "mc002-question_prompts-prompt-mapping.csv")
+    vertex_lookup = pl.read_parquet(tmp_path / "mc002-question_prompts-custom-ids.parquet")
+    assert sorted(mapping["prompt_id"]) == sorted(vertex_lookup["custom_id"])
+
+
+def test_generate_prompts_with_repeat_times(tmp_path):
+    _write_sheets(tmp_path)
+    pl.DataFrame(
+        {
+            "model_config_id": ["mc001", "mc002", "mc004"],
+            "model_id": ["openai/gpt-4o", "vertex_ai/publishers/google/models/gemini-2.0-flash", "anthropic/claude"],
+            "model_parameters": ['{"temperature": 1}', None, None],
+            "repeat_times": [3, 2, 3],
+        }
+    ).write_csv(tmp_path / "ai_eval_sheets" / "gen_ai_model_configs.csv")
+
+    generate_prompts_for_configs(str(tmp_path), {"mc001": "openai", "mc002": "vertex", "mc004": "openai"})
+
+    # Providers with a multi-sample parameter get one request for all samples of a prompt
+    openai_lines = [json.loads(line) for line in (tmp_path / "mc001-question_prompts.jsonl").read_text().splitlines()]
+    assert len(openai_lines) == 6
+    assert all(line["body"]["n"] == 3 and line["body"]["temperature"] == 1 for line in openai_lines)
+    vertex_lines = [json.loads(line) for line in (tmp_path / "mc002-question_prompts.jsonl").read_text().splitlines()]
+    assert all(line["request"]["generationConfig"] == {"candidateCount": 2} for line in vertex_lines)
+
+    # Others get a request for each sample, with the repeat index in the custom_id
+    anthropic_lines = [
+        json.loads(line) for line in (tmp_path / "mc004-question_prompts.jsonl").read_text().splitlines()
+    ]
+    assert len(anthropic_lines) == 18
+    assert "n" not in anthropic_lines[0]["body"]
+    assert [line["custom_id"] for line in anthropic_lines[:3]] == [f"mc004-1-v1-rep{i}" for i in range(3)]
+
+
+def test_generate_prompts_by_language(tmp_path):
+    _write_sheets(tmp_path)
+    sheets_dir = tmp_path / "ai_eval_sheets"
+    # Add a Spanish version of the first two questions
+    questions = pl.read_csv(sheets_dir / "questions.csv")
+    pl.concat(
+        [
+            questions,
+            questions.head(2).with_columns(
+                pl.lit("es-ES").alias("language"), pl.lit("P?").alias("published_version_of_question")
+            ),
+        ]
+    ).write_csv(sheets_dir / "questions.csv")
+    options = pl.read_csv(sheets_dir / "question_options.csv")
+    pl.concat([options, options.head(6).with_columns(pl.lit("es-ES").alias("language"))]).write_csv(
+        sheets_dir / "question_options.csv"
+    )
+
+    paths = generate_prompts_by_language(str(tmp_path), {"mc001": "openai", "mc002": "vertex"}, processes=2)
+
+    assert paths["mc001"] == [str(tmp_path / f"mc001-question_prompts-{x}.jsonl") for x in ["en-US", "es-ES"]]
+    spanish = [json.loads(line) for line in (tmp_path / "mc001-question_prompts-es-ES.jsonl").read_text().splitlines()]
+    assert len(spanish) == 4
+    assert all("P?" in line["body"]["messages"][0]["content"] for line in spanish)
+    assert (tmp_path / "mc002-question_prompts-en-US-prompt-mapping.csv").exists()
+
+    # A single language can be generated again without touching the others
+    (tmp_path / "mc001-question_prompts-en-US.jsonl").unlink()
+    generate_prompts_by_language(str(tmp_path), {"mc001": "openai"}, languages=["es-ES"])
+    assert not (tmp_path / "mc001-question_prompts-en-US.jsonl").exists()
+
+
+def test_read_prompt_sheets_with_mixed_language_tags(tmp_path):
+    """Test that rows tagged en_US belong to the en-US shard, as in the prompt variations of the sheets."""
+    _write_sheets(tmp_path)
+    variations_path = tmp_path / "ai_eval_sheets" / "prompt_variations.csv"
+    pl.read_csv(variations_path).with_columns(language=pl.Series(["en-US", "en_US"])).write_csv(variations_path)
+
+    assert get_languages(pl.DataFrame({"language": ["en-US", "en_US", "es-ES"]})) == ["en-US", "es-ES"]
+    questions, variations = read_prompt_sheets(str(tmp_path), "en-US")
+    assert questions.height == 3
+    assert variations["variation_id"].to_list() == ["v1", "v2"]
+
+
+def _prompt_texts(path) -> list:
+    return [json.loads(line)["body"]["messages"][0]["content"] for line in path.read_text().splitlines()]
+
+
+def test_check_and_generate_prompts_writes_outdated_prompt_table_again(tmp_path):
+    """Test that prompts are not rendered from a prompt table of sheets edited after it was written."""
+    _write_sheets(tmp_path)
+    write_prompt_store(str(tmp_path))
+    assert is_prompt_store_current(str(tmp_path))
+
+    questions_path = tmp_path / "ai_eval_sheets" / "questions.csv"
+    pl.read_csv(questions_path).with_columns(published_version_of_question=pl.lit("Edited?")).write_csv(questions_path)
+    assert not is_prompt_store_current(str(tmp_path))
+
+    jsonl_file = check_and_generate_prompts("mc001", str(tmp_path), "openai", "batch")
+
+    assert jsonl_file == str(tmp_path / "mc001-question_prompts.jsonl")
+    assert all("Edited?" in text for text in _prompt_texts(tmp_path / "mc001-question_prompts.jsonl"))
+    assert is_prompt_store_current(str(tmp_path))
+
+
+def test_check_and_generate_prompts_uses_language_shard_of_prompt_table(tmp_path):
+    _write_sheets(tmp_path)
+    write_prompt_store(str(tmp_path), language="en-US")
+
+    # Without a language it is unclear which shard to send
+    with pytest.raises(Exception, match="--language"):
+        check_and_generate_prompts("mc001", str(tmp_path), "openai", "batch")
+    assert not (tmp_path / "mc001-question_prompts.jsonl").exists()
+
+    jsonl_file = check_and_generate_prompts("mc001", str(tmp_path), "openai", "batch", language="en-US")
+
+    assert jsonl_file == str(tmp_path / "mc001-question_prompts-en-US.jsonl")
+    assert len(_prompt_texts(tmp_path / "mc001-question_prompts-en-US.jsonl")) == 6
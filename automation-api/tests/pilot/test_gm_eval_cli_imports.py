@@ -0,0 +1,22 @@
+"""
+Tests that the gm-eval CLI starts without loading provider SDKs.
+"""
+
+import os
+import subprocess
+import sys
+
+PROVIDER_MODULES = ["litellm", "vertexai", "google.cloud.storage", "anthropic", "mistralai", "openai"]
+
+
+def test_cli_import_does_not_load_provider_sdks():
+    # Run in a fresh interpreter, other tests may have imported the providers already.
+    # The OpenAI keys are removed to check that nothing reads the config at import time.
+    env = {k: v for k, v in os.environ.items() if k not in ("OPENAI_API_KEY", "OPENAI_ORG_ID")}
+    code = (
+        "import sys; import lib.pilot.gm_eval.cli; "
+        f"print(','.join(m for m in {PROVIDER_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True)
+
+    assert result.stdout.strip() == ""
@@ -0,0 +1,29 @@
+"""
+Tests for the gm-eval merge command.
+"""
+
+import argparse
+import json
+
+from lib.pilot.gm_eval.commands.merge import handle
+
+
+def _write_responses(path, contents: dict) -> str:
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id, content in contents.items():
+            f.write(json.dumps({"custom_id": custom_id, "content": content, "status_code": 200}) + "\n")
+    return str(path)
+
+
+def test_merge_refuses_files_of_different_language_shards(tmp_path):
+    """Test that shards, whose questions have the same custom_ids, are not merged into each other."""
+    english = _write_responses(tmp_path / "mc001-question_prompts-en-US-response.jsonl", {"mc001-1-v1": "one"})
+    spanish = _write_responses(tmp_path / "mc001-question_prompts-es-ES-response.jsonl", {"mc001-1-v1": "uno"})
+    retried = _write_responses(tmp_path / "retry1.jsonl", {"mc001-1-v1": "one again"})
+    output = tmp_path / "merged.jsonl"
+
+    assert handle(argparse.Namespace(files=[english, spanish], output=str(output))) == 1
+    assert not output.exists()
+
+    assert handle(argparse.Namespace(files=[english, retried], output=str(output))) == 0
+    assert [json.loads(line)["content"] for line in output.read_text().splitlines()] == ["one again"]
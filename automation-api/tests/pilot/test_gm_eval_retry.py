@@ -0,0 +1,50 @@
+"""
+Tests for selecting the requests to resend in the gm-eval retry command.
+"""
+
+import json
+
+from lib.pilot.gm_eval.commands.retry import get_ids_to_retry, load_requests
+
+
+def _line(data):
+    return json.dumps(data)
+
+
+def test_get_ids_to_retry_includes_failed_and_missing():
+    responses = {
+        "mc001-q1-v1": _line({"custom_id": "mc001-q1-v1", "content": "A", "status_code": 200}),
+        "mc001-q2-v1": _line({"custom_id": "mc001-q2-v1", "error": "rate limit", "status_code": 429}),
+        "mc001-q3-v1": _line({"custom_id": "mc001-q3-v1", "content": "B", "status_code": ""}),
+        "mc001-q4-v1": _line({"custom_id": "mc001-q4-v1", "content": None, "status_code": 500}),
+    }
+    request_ids = ["mc001-q1-v1", "mc001-q2-v1", "mc001-q3-v1", "mc001-q4-v1", "mc001-q5-v1"]
+
+    assert get_ids_to_retry(request_ids, responses) == ["mc001-q2-v1", "mc001-q4-v1", "mc001-q5-v1"]
+
+
+def test_get_ids_to_retry_checks_the_samples_of_multi_sample_requests():
+    responses = {
+        "mc001-q1-v1-rep0": _line({"custom_id": "mc001-q1-v1-rep0", "content": "A", "status_code": 200}),
+        "mc001-q1-v1-rep1": _line({"custom_id": "mc001-q1-v1-rep1", "content": "B", "status_code": 200}),
+        "mc001-q2-v1-rep0": _line({"custom_id": "mc001-q2-v1-rep0", "content": None, "status_code": 500}),
+        "mc001-q2-v1-rep1": _line({"custom_id": "mc001-q2-v1-rep1", "content": "C", "status_code": 200}),
+        "mc001-q3-v1": _line({"custom_id": "mc001-q3-v1", "error": "rate limit", "status_code": 429}),
+    }
+    request_ids = ["mc001-q1-v1", "mc001-q2-v1", "mc001-q3-v1"]
+
+    assert get_ids_to_retry(request_ids, responses) == ["mc001-q2-v1", "mc001-q3-v1"]
+
+
+def test_load_requests_uses_vertex_prompt_mapping(tmp_path):
+    requests_path = tmp_path / "mc001-question_prompts.jsonl"
+    request = {"request": {"contents": [{"role": "user", "parts": [{"text": "What is 1+1?"}]}]}}
+    requests_path.write_text(json.dumps(request) + "\n")
+    (tmp_path / "mc001-question_prompts-prompt-mapping.csv").write_text(
+        "prompt_id,prompt_text\nmc001-q1-v1,What is 1+1?\n"
+    )
+
+    requests = load_requests(str(requests_path))
+
+    assert list(requests) == ["mc001-q1-v1"]
+    assert json.loads(requests["mc001-q1-v1"]) == request
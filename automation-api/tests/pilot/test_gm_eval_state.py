@@ -0,0 +1,70 @@
+"""
+Tests for the input fingerprints of the gm-eval run workflow.
+"""
+
+from lib.pilot.gm_eval.state import (
+    STALE_SUFFIX,
+    check_stage,
+    get_input_hashes,
+    hash_file,
+    invalidate_outputs,
+    load_state,
+    record_stage,
+    save_state,
+)
+
+
+def test_hash_file_changes_with_content(tmp_path):
+    path = tmp_path / "questions.csv"
+    assert hash_file(str(path)) == ""
+
+    path.write_text("question_id\n1\n")
+    first = hash_file(str(path))
+    assert first == hash_file(str(path))
+
+    path.write_text("question_id\n2\n")
+    assert hash_file(str(path)) != first
+
+
+def test_check_stage_lifecycle(tmp_path):
+    sheet = tmp_path / "questions.csv"
+    sheet.write_text("question_id\n1\n")
+    output = tmp_path / "mc001-question_prompts.jsonl"
+    state: dict = {}
+
+    inputs = get_input_hashes({"questions": str(sheet)}, {"mode": "batch"})
+    status = check_stage(state, "generate:mc001", inputs, [str(output)])
+    assert status.should_run and not status.outputs_stale
+
+    output.write_text("{}\n")
+    record_stage(state, "generate:mc001", inputs)
+    status = check_stage(state, "generate:mc001", inputs, [str(output)])
+    assert not status.should_run
+
+    # Changing an input makes the recorded outputs stale
+    sheet.write_text("question_id\n1\n2\n")
+    inputs = get_input_hashes({"questions": str(sheet)}, {"mode": "batch"})
+    status = check_stage(state, "generate:mc001", inputs, [str(output)])
+    assert status.should_run and status.outputs_stale
+    assert "questions" in status.reason
+
+    # Missing outputs are rerun without being stale
+    record_stage(state, "generate:mc001", inputs)
+    output.unlink()
+    status = check_stage(state, "generate:mc001", inputs, [str(output)])
+    assert status.should_run and not status.outputs_stale
+
+
+def test_state_roundtrip_and_invalidate(tmp_path):
+    state = {"send:mc001": {"prompts": "abc"}}
+    save_state(str(tmp_path), state)
+    assert load_state(str(tmp_path)) == state
+
+    response = tmp_path / "mc001-question_prompts-response.jsonl"
+    response.write_text("{}\n")
+    (tmp_path / "mc001-question_prompts-response.jsonl.processing").write_text("batch_1")
+
+    moved = invalidate_outputs([str(response)])
+    assert len(moved) == 2
+    assert not response.exists()
+    assert (tmp_path / f"mc001-question_prompts-response.jsonl{STALE_SUFFIX}").exists()
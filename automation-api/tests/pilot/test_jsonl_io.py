@@ -0,0 +1,89 @@
+"""Tests for reading and writing compressed JSONL files."""
+
+import gzip
+import json
+import os
+
+import pytest
+
+from lib.pilot.gm_eval.commands.merge import load_all_responses
+from lib.pilot.gm_eval.utils import get_response_path
+from lib.pilot.jsonl_io import (
+    find_jsonl_file,
+    open_jsonl,
+    plain_jsonl_file,
+    split_jsonl_extension,
+)
+
+LINES = [
+    {"custom_id": "mc001-1-v1", "content": "Svar: ä 🌍"},
+    {"custom_id": "mc001-2-v1", "content": "B"},
+]
+
+
+@pytest.mark.parametrize("ext", [".jsonl", ".jsonl.gz", ".jsonl.zst"])
+def test_open_jsonl_round_trip(tmp_path, ext):
+    """Test that lines written with open_jsonl are read back unchanged."""
+    path = str(tmp_path / f"responses{ext}")
+
+    with open_jsonl(path, "w") as f:
+        for line in LINES:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    with open_jsonl(path) as f:
+        assert [json.loads(line) for line in f] == LINES
+
+    # Responses are merged from compressed files like from plain ones
+    assert list(load_all_responses([path])) == ["mc001-1-v1", "mc001-2-v1"]
+
+
+def test_gzip_file_is_compressed(tmp_path):
+    """Test that .jsonl.gz files are really gzip compressed."""
+    path = str(tmp_path / "prompts.jsonl.gz")
+    with open_jsonl(path, "w") as f:
+        f.write('{"custom_id": "a"}\n')
+
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert f.read() == '{"custom_id": "a"}\n'
+
+
+def test_split_jsonl_extension():
+    """Test that compression suffixes are kept as part of the extension."""
+    assert split_jsonl_extension("dir/mc001-question_prompts.jsonl") == ("dir/mc001-question_prompts", ".jsonl")
+    assert split_jsonl_extension("mc001-question_prompts.jsonl.gz") == ("mc001-question_prompts", ".jsonl.gz")
+    assert split_jsonl_extension("mc001-question_prompts.jsonl.zst") == ("mc001-question_prompts", ".jsonl.zst")
+    assert split_jsonl_extension("mapping.csv") == ("mapping", ".csv")
+
+
+def test_response_path_keeps_compression():
+    """Test that responses of compressed prompt files are compressed the same way."""
+    assert get_response_path("mc001-question_prompts.jsonl.gz") == "mc001-question_prompts-response.jsonl.gz"
+    assert get_response_path("mc001-question_prompts.jsonl") == "mc001-question_prompts-response.jsonl"
+
+
+def test_find_jsonl_file(tmp_path):
+    """Test that a compressed variant is found when the plain file does not exist."""
+    plain = str(tmp_path / "mc001-question_prompts.jsonl")
+    assert find_jsonl_file(plain) == plain
+
+    compressed = f"{plain}.gz"
+    with open_jsonl(compressed, "w") as f:
+        f.write("{}\n")
+    assert find_jsonl_file(plain) == compressed
+
+
+def test_plain_jsonl_file(tmp_path):
+    """Test that compressed files are decompressed to a temporary plain file for uploads."""
+    path = str(tmp_path / "mc001-question_prompts.jsonl.gz")
+    with open_jsonl(path, "w") as f:
+        f.write('{"custom_id": "a"}\n')
+
+    with plain_jsonl_file(path) as plain_path:
+        assert os.path.basename(plain_path) == "mc001-question_prompts.jsonl"
+        with open(plain_path, encoding="utf-8") as f:
+            assert f.read() == '{"custom_id": "a"}\n'
+    assert not os.path.exists(plain_path)
+
+    plain = str(tmp_path / "prompts.jsonl")
+    with plain_jsonl_file(plain) as plain_path:
+        assert plain_path == plain
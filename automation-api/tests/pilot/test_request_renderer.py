@@ -0,0 +1,51 @@
+"""Tests for rendering JSONL requests from a pre-serialised envelope."""
+
+import json
+
+import pytest
+
+from lib.pilot.generate_prompts import (
+    PROMPT_FIELDS,
+    build_mistral_request,
+    build_openai_request,
+    build_vertex_request,
+)
+from lib.pilot.request_renderer import RequestRenderer
+
+MODEL_PARAMETERS = {"temperature": 0.5, "stop": ["\n\n"], "note": 'Ünïcödé "quoted"'}
+
+BUILDERS = {
+    "openai": lambda row: build_openai_request(row, "gpt-4o", MODEL_PARAMETERS, 'mc"01\\-'),
+    "mistral": lambda row: build_mistral_request(row, MODEL_PARAMETERS, "mc001-"),
+    "vertex": lambda row: build_vertex_request(row, MODEL_PARAMETERS),
+}
+
+ROWS = [
+    {"prompt_id": "1-v1", "prompt_text": "Plain prompt"},
+    {"prompt_id": "2-v1", "prompt_text": 'Quotes " and backslashes \\ and \\n literal'},
+    {"prompt_id": "3-v1", "prompt_text": "Lines\nand\ttabs\r\nand control \x01\x1f chars"},
+    {"prompt_id": "4-v1", "prompt_text": "Unicode: 世界人口 — ça va? 🌍  "},
+    {"prompt_id": "5-v1", "prompt_text": ""},
+    {"prompt_id": "6-v1", "prompt_text": "Looks like a field: prompt_text {prompt_id}"},
+]
+
+
+@pytest.mark.parametrize("format", list(BUILDERS))
+def test_render_matches_json_dumps(format):
+    """Test that rendered lines are byte-identical to json.dumps of the built request."""
+    build_request = BUILDERS[format]
+    renderer = RequestRenderer(build_request, PROMPT_FIELDS)
+
+    for row in ROWS:
+        assert renderer.render(row) == json.dumps(build_request(row), ensure_ascii=False)
+
+
+def test_render_repeated_field():
+    """Test that a field used several times in the envelope is filled everywhere."""
+
+    def build_request(row):
+        return {"id": row["prompt_id"], "messages": [row["prompt_text"], f"again: {row['prompt_text']}"]}
+
+    renderer = RequestRenderer(build_request, PROMPT_FIELDS)
+    row = {"prompt_id": "q1", "prompt_text": 'say "hi"'}
+    assert renderer.render(row) == json.dumps(build_request(row), ensure_ascii=False)
@@ -0,0 +1,58 @@
+"""Tests for waiting on several batch jobs."""
+
+import threading
+import time
+
+import pytest
+
+import lib.pilot.send_batch_prompt as send_batch_prompt
+from lib.pilot.batchjob.base import BaseBatchJob
+
+
+class FakeBatchJob(BaseBatchJob):
+    """A batch job which completes after a number of status checks."""
+
+    def __init__(self, jsonl_path: str, checks: int):
+        super().__init__(jsonl_path)
+        self._batch_id = "batch-1"
+        self._checks = checks
+        with open(self._processing_file, "w") as f:
+            f.write(self._batch_id)
+
+    def send(self) -> str:
+        return self.batch_id
+
+    def check_status(self) -> str:
+        self._checks -= 1
+        return "completed" if self._checks <= 0 else "processing"
+
+    def download_results(self) -> str:
+        return self.output_path
+
+
+def test_wait_for_batch_jobs(tmp_path):
+    jobs = [FakeBatchJob(str(tmp_path / f"mc00{i}-question_prompts.jsonl"), checks=1) for i in range(3)]
+
+    assert send_batch_prompt.wait_for_batch_jobs(jobs) == [job.output_path for job in jobs]
+
+
+def test_wait_for_batch_jobs_stops_on_ctrl_c(tmp_path, monkeypatch):
+    """Test that Ctrl+C stops polling right away and keeps the batches to pick up later."""
+    jobs = [FakeBatchJob(str(tmp_path / f"mc00{i}-question_prompts.jsonl"), checks=100) for i in range(2)]
+
+    def interrupted_wait(futures, timeout):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(send_batch_prompt, "wait_for_futures", interrupted_wait)
+    start = time.monotonic()
+    with pytest.raises(KeyboardInterrupt):
+        send_batch_prompt.wait_for_batch_jobs(jobs)
+
+    # The pollers sleep 60 seconds between checks unless they are stopped
+    pollers = [thread for thread in threading.enumerate() if thread.name.startswith("ThreadPoolExecutor")]
+    for thread in pollers:
+        thread.join(timeout=5)
+    assert not any(thread.is_alive() for thread in pollers)
+    assert time.monotonic() - start < 5
+    assert all(job._stop_waiting.is_set() for job in jobs)
+    assert all((tmp_path / f"mc00{i}-question_prompts-response.jsonl.processing").exists() for i in range(2))
@@ -1,3 +1,4 @@
+import gzip
 from pathlib import Path
 
 import polars as pl
@@ -53,6 +54,27 @@ def test_main_processing(example_data_dir, tmp_path):
     assert df.height > 0, "Output should contain data rows"
 
 
+def test_main_processing_compressed_files(tmp_path):
+    """Test that gzip compressed response and eval files give the same results as plain ones"""
+    plain_dir = tmp_path / "plain"
+    compressed_dir = tmp_path / "compressed"
+    plain_dir.mkdir()
+    compressed_dir.mkdir()
+    for src_file in TEST_DATA_DIR.glob("*.jsonl"):
+        (plain_dir / src_file.name).write_text(src_file.read_text())
+        with gzip.open(compressed_dir / f"{src_file.name}.gz", "wt", encoding="utf-8") as f:
+            f.write(src_file.read_text())
+
+    main(plain_dir)
+    main(compressed_dir)
+
+    # Evaluator columns are ordered like the files in the folder, so compare them by name
+    for plain_file in plain_dir.glob("*.parquet"):
+        expected = pl.read_parquet(plain_file)
+        result = pl.read_parquet(compressed_dir / plain_file.name).select(expected.columns)
+        assert result.sort(expected.columns).equals(expected.sort(expected.columns))
+
+
 def test_extract_score():
     """Test score extraction from evaluation responses"""
     assert extract_score("This answer is grade A\n\nA") == 0
@@ -62,6 +84,16 @@ def test_extract_score():
     assert extract_score("???") == -1
 
 
+def test_extract_score_structured_output():
+    """Test score extraction from the JSON responses of structured-output evaluators"""
+    assert extract_score('{"grade": "A"}') == 0
+    assert extract_score(' {"grade": "c"}\n') == 2
+    assert extract_score('{"grade": "E"}') == -1
+    assert extract_score('{"score": "A"}') == -1
+    # Not JSON, the grade is the last word
+    assert extract_score("{see below}\nB") == 1
+
+
 def test_extract_custom_id():
     """Test custom ID parsing"""
     info = extract_custom_id_info("model123-q42-pv7", "model123")
@@ -75,6 +107,13 @@ def test_extract_custom_id():
     assert info["question_id"] == "q42"
     assert info["prompt_variation_id"] == "pv7"
     assert info["metric_id"] == "correctness"
+    assert "repeat_index" not in info
+
+    # Test with the repeat index of a sample
+    info = extract_custom_id_info("model123-q42-pv7-correctness-rep2", "model123")
+    assert info["prompt_variation_id"] == "pv7"
+    assert info["metric_id"] == "correctness"
+    assert info["repeat_index"] == 2
 
 
 def test_calculate_final_score():
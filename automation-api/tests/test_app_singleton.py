@@ -0,0 +1,29 @@
+import logging
+
+from lib.app_singleton import AppSingleton, RingBufferHandler
+
+
+def test_ring_buffer_handler_keeps_latest_records() -> None:
+    handler = RingBufferHandler(capacity=3)
+    logger = logging.getLogger("test_ring_buffer")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    try:
+        for i in range(5):
+            logger.info(f"message {i}")
+    finally:
+        logger.removeHandler(handler)
+
+    assert handler.getvalue() == "message 2\nmessage 3\nmessage 4\n"
+
+    handler.clear()
+    assert handler.getvalue() == ""
+
+
+def test_log_buffer_reset() -> None:
+    app = AppSingleton()
+    app.get_logger().warning("buffered message")
+    assert "buffered message" in app.get_log_messages()
+
+    app.reset_log_buffer()
+    assert app.get_log_messages() == ""